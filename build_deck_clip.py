@@ -12,11 +12,15 @@ from PyQt5.QtWidgets import (
 )
 from PyQt5.QtCore import Qt, QPoint
 
-from clip_model import extract_image_feature
+from clip_model import extract_image_feature, feature_namespace
+from feature_store import get_store
+from config import EMBEDDING_STORAGE
+from compress_deck_clip import write_prototypes, prototype_path
 from image_utils import (
     crop_art_region,
     augment_image,
-    extract_color_hist_hsv   
+    extract_color_hist_hsv,
+    ScoringWeights
 )
 import re
 
@@ -25,6 +29,11 @@ import re
 # =========================
 AUG_N = 100
 DEBUG = False
+STORE_FLOAT16 = EMBEDDING_STORAGE != "float32"
+
+# Encoder of the un-namespaced deck_clip(_cache).pkl of earlier versions
+LEGACY_NAMESPACE = "_vit-b-32_p1"
+LEGACY_CACHE_NAME = "deck_clip_cache.pkl"
 
 
 # =========================
@@ -71,6 +80,83 @@ def save_debug_image(
     cv2.imwrite(str(out_dir / filename), img)
 
 
+def clip_feature_paths(deck_dir: Path):
+    """
+    (deck features, extraction cache) of the active CLIP encoder and the
+    configured scoring weights.
+    """
+    ns = feature_namespace() + ScoringWeights.from_config().feature_tag()
+    return (
+        deck_dir / f"deck_clip{ns}.pkl",
+        deck_dir / f"deck_clip_cache{ns}.pkl",
+    )
+
+
+def adopt_legacy_cache(deck_dir: Path) -> dict:
+    """
+    Extraction cache of an earlier version (deck_clip_cache.pkl), when
+    it was built with the active encoder and preprocessing, so existing
+    decks are not extracted again. CLIP features of regions the scoring
+    weights do not use are dropped.
+    """
+    legacy_path = deck_dir / LEGACY_CACHE_NAME
+    if feature_namespace() != LEGACY_NAMESPACE or not legacy_path.exists():
+        return {}
+
+    with open(legacy_path, "rb") as f:
+        cache = pickle.load(f)
+
+    weights = ScoringWeights.from_config()
+    for entry in cache.values():
+        for region in ("art", "full"):
+            if not weights.uses(f"{region}_clip"):
+                entry["data"][region]["clip_feats"] = []
+            if not weights.uses(f"{region}_color"):
+                entry["data"][region]["color_hist"] = None
+
+    print(f"[INFO] adopted {len(cache)} cached images from {legacy_path.name}")
+    return cache
+
+
+def clip_store_namespace() -> str:
+    """
+    Feature store namespace of the extracted features of the active
+    CLIP encoder.
+    """
+    ns = f"clip{feature_namespace()}_aug{AUG_N}"
+    ns += ScoringWeights.from_config().feature_tag()
+    if STORE_FLOAT16:
+        ns += "_f16"
+    return ns
+
+
+def cast_features(data, dtype):
+    """
+    Copy of extracted features with the CLIP vectors cast to dtype
+    (float16 in the feature store, float32 in memory).
+    """
+    return {
+        region: {
+            "clip_feats": [np.asarray(f, dtype=dtype) for f in data[region]["clip_feats"]],
+            "color_hist": data[region]["color_hist"],
+        }
+        for region in ("art", "full")
+    }
+
+
+def store_get(store, img_hash, store_ns):
+    data = store.get(img_hash, store_ns)
+    if data is not None and STORE_FLOAT16:
+        data = cast_features(data, np.float32)
+    return data
+
+
+def store_put(store, img_hash, store_ns, data):
+    if STORE_FLOAT16:
+        data = cast_features(data, np.float16)
+    store.put(img_hash, store_ns, data)
+
+
 def calc_image_hash(path: Path) -> str:
     h = hashlib.sha256()
     with open(path, "rb") as f:
@@ -86,8 +172,16 @@ def extract_features_from_image(
     card_name: str = "",
     side: str = "front",
     card_idx = None,
-    total_cards = None
+    total_cards = None,
+    weights: ScoringWeights | None = None
 ):
+    """
+    CLIP features (base + AUG_N augmentations) and color histogram of
+    the full card and of its art region. Features with zero weight are
+    skipped (empty list / None).
+    """
+    weights = weights or ScoringWeights.from_config()
+
     img = imread_utf8(img_path)
     if img is None:
         return None
@@ -100,8 +194,12 @@ def extract_features_from_image(
     # full_clip_feats = [extract_image_feature(img)]
 
     img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    full_clip_feats = [extract_image_feature(img_rgb)]
-    full_color_hist = extract_color_hist_hsv(img_rgb)
+    full_clip_feats = []
+    if weights.uses("full_clip"):
+        full_clip_feats.append(extract_image_feature(img_rgb))
+    full_color_hist = (
+        extract_color_hist_hsv(img_rgb) if weights.uses("full_color") else None
+    )
 
     # --- FULL base debug ---
     if DEBUG and debug_base_dir:
@@ -115,7 +213,7 @@ def extract_features_from_image(
         )
 
     # augmentation（FULL）
-    for i in range(AUG_N):
+    for i in range(AUG_N if weights.uses("full_clip") else 0):
         if status:
             status.update_text(f"Card : {card_name} {card_idx}/{total_cards}\n {label} Full Augment {i + 1}/{AUG_N}")
 
@@ -147,8 +245,12 @@ def extract_features_from_image(
     # art_clip_feats = [extract_image_feature(art)]
 
     art_rgb = cv2.cvtColor(art, cv2.COLOR_BGR2RGB)
-    art_clip_feats = [extract_image_feature(art_rgb)]
-    art_color_hist = extract_color_hist_hsv(art_rgb)
+    art_clip_feats = []
+    if weights.uses("art_clip"):
+        art_clip_feats.append(extract_image_feature(art_rgb))
+    art_color_hist = (
+        extract_color_hist_hsv(art_rgb) if weights.uses("art_color") else None
+    )
 
     # --- ART base debug ---
     if DEBUG and debug_base_dir:
@@ -162,7 +264,7 @@ def extract_features_from_image(
         )
 
     # augmentation（ART）
-    for i in range(AUG_N):
+    for i in range(AUG_N if weights.uses("art_clip") else 0):
         if status:
             status.update_text(f"Card : {card_name} {card_idx}/{total_cards}\n {label} Art Augment {i + 1}/{AUG_N}")
 
@@ -237,17 +339,30 @@ class ProgressWindow(QWidget):
 # -------------------------
 # Main processing
 # -------------------------
+def deck_layout(cards):
+    """
+    (name_en, front image, back image) per card, in deck order.
+    """
+    return [
+        (c["name_en"], *(c[side] and c[side]["image"] for side in ("front", "back")))
+        for c in cards
+    ]
+
+
 def process_deck_from_csv(csv_path: Path):
     deck_dir = csv_path.parent
 
-    cache_path = deck_dir / "deck_clip_cache.pkl"
+    out_path, cache_path = clip_feature_paths(deck_dir)
+    store = get_store()
+    store_ns = clip_store_namespace()
     if cache_path.exists():
         with open(cache_path, "rb") as f:
             cache = pickle.load(f)
     else:
-        cache = {}
+        cache = adopt_legacy_cache(deck_dir)
 
     cards = []
+    changed = False
 
     with open(csv_path, encoding="utf-8") as f:
         rows = list(csv.DictReader(f))
@@ -295,16 +410,22 @@ def process_deck_from_csv(csv_path: Path):
                 if cache_entry and cache_entry["hash"] == img_hash:
                     data = cache_entry["data"]
                 else:
-                    data = extract_features_from_image(
-                        front_path,
-                        status,
-                        label="Front",
-                        debug_base_dir=deck_dir,
-                        card_name=row["name_en"],
-                        side="front",
-                        card_idx = card_idx,
-                        total_cards = total_cards
-                    )
+                    changed = True
+                    # The same image may already be processed in another deck
+                    data = store_get(store, img_hash, store_ns)
+                    if data is None:
+                        data = extract_features_from_image(
+                            front_path,
+                            status,
+                            label="Front",
+                            debug_base_dir=deck_dir,
+                            card_name=row["name_en"],
+                            side="front",
+                            card_idx = card_idx,
+                            total_cards = total_cards
+                        )
+                        if data:
+                            store_put(store, img_hash, store_ns, data)
                     if data:
                         cache[front_file] = {
                             "hash": img_hash,
@@ -331,16 +452,22 @@ def process_deck_from_csv(csv_path: Path):
                 if cache_entry and cache_entry["hash"] == img_hash:
                     data = cache_entry["data"]
                 else:
-                    data = extract_features_from_image(
-                        back_path,
-                        status,
-                        label="Back",
-                        debug_base_dir=deck_dir,
-                        card_name=row["name_en"],
-                        side="back",
-                        card_idx = card_idx,
-                        total_cards = total_cards
-                    )
+                    changed = True
+                    # The same image may already be processed in another deck
+                    data = store_get(store, img_hash, store_ns)
+                    if data is None:
+                        data = extract_features_from_image(
+                            back_path,
+                            status,
+                            label="Back",
+                            debug_base_dir=deck_dir,
+                            card_name=row["name_en"],
+                            side="back",
+                            card_idx = card_idx,
+                            total_cards = total_cards
+                        )
+                        if data:
+                            store_put(store, img_hash, store_ns, data)
                     if data:
                         cache[back_file] = {
                             "hash": img_hash,
@@ -359,12 +486,42 @@ def process_deck_from_csv(csv_path: Path):
     progress.setValue(total_cards)
     status.update_text("Complete")
 
-    out_path = deck_dir / "deck_clip.pkl"
-    with open(out_path, "wb") as f:
-        pickle.dump(cards, f)
+    # Entries of cards no longer in the deck
+    used = {
+        side["image"] for c in cards for side in (c["front"], c["back"]) if side
+    }
+    if not progress.wasCanceled():
+        stale = [file for file in cache if file not in used]
+        for file in stale:
+            del cache[file]
+        changed = changed or bool(stale)
+    else:
+        changed = True
+
+    # All images hit the cache: only renamed or reordered cards remain
+    if not changed and out_path.exists():
+        with open(out_path, "rb") as f:
+            changed = deck_layout(pickle.load(f)) != deck_layout(cards)
+    elif not out_path.exists():
+        changed = True
+
+    proto_path = prototype_path(deck_dir)
+    proto_stale = not proto_path.exists() or (
+        out_path.exists() and proto_path.stat().st_mtime < out_path.stat().st_mtime
+    )
+
+    if changed:
+        with open(out_path, "wb") as f:
+            pickle.dump(cards, f)
 
-    with open(cache_path, "wb") as f:
-        pickle.dump(cache, f)
+        with open(cache_path, "wb") as f:
+            pickle.dump(cache, f)
+
+    # Prototypes are only rebuilt when the features changed
+    if changed or proto_stale:
+        write_prototypes(deck_dir, cards)
+    else:
+        print(f"[INFO] {csv_path.name}: features unchanged → prototypes kept")
 
     print(f"[OK] {csv_path.name}: {len(cards)} cards")
 
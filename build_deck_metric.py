@@ -7,17 +7,24 @@ import numpy as np
 import sys
 from PyQt5.QtWidgets import QApplication, QFileDialog
 from image_utils import crop_art_region, augment_image
-from train_metric import train_metric
+from train_metric import (
+    train_metric, CHECKPOINT_PATH_NAME, HASH_PATH_NAME, MODEL_PATH_NAME
+)
+from distill_metric import distill_metric, student_is_stale
+from feature_store import get_store, file_sha256
 from log_window import LogWindow, StdoutRedirect, enable_dark_mode
 from PyQt5.QtCore import QTimer
 
 import hashlib
-
-HASH_PATH_NAME = "deck_metric.hash"
+import multiprocessing
+import os
+import queue
+import time
 
 AUG_N = 10
+METRIC_STORE_NS = f"metric_art_aug{AUG_N}_v1"
 
-from PyQt5.QtCore import QThread, pyqtSignal
+from PyQt5.QtCore import QObject, pyqtSignal
 
 class CountdownCloser:
     def __init__(self, seconds: int, log_window: LogWindow, app: QApplication):
@@ -48,33 +55,191 @@ class CountdownCloser:
             self.app.quit()
 
 
-class MetricWorker(QThread):
+def run_metric_process(csv_path: Path, epochs, queue, cancel_event, num_threads, use_global=False):
+    """
+    Entry point of the training child process.
+    Sends structured messages to the parent:
+        {"type": "log", "text": str}
+        {"type": "progress", "epoch": int, "epochs": int, "loss": float, "acc": float}
+        {"type": "done"} / {"type": "cancelled"} / {"type": "error", "text": str}
+    """
+    import torch
+    torch.set_num_threads(num_threads)
+
+    def log_fn(text):
+        queue.put({"type": "log", "text": str(text)})
+
+    def progress_fn(epoch, total, loss, acc):
+        queue.put({
+            "type": "progress",
+            "epoch": epoch,
+            "epochs": total,
+            "loss": loss,
+            "acc": acc,
+        })
+
+    try:
+        completed = build_metric_core(
+            csv_path,
+            epochs=epochs,
+            log_fn=log_fn,
+            progress_fn=progress_fn,
+            should_stop=cancel_event.is_set,
+            num_workers=num_threads,
+            use_global=use_global,
+        )
+        queue.put({"type": "done" if completed else "cancelled"})
+    except Exception as e:
+        queue.put({"type": "error", "text": str(e)})
+
+
+def default_thread_budget() -> int:
+    # Leave half of the cores to the camera loop and the Qt event loop
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+class MetricWorker(QObject):
+    """
+    Runs build_metric_core in a child process and relays its messages
+    as Qt signals. Polling happens on a QTimer in the GUI thread, so the
+    GUI process never runs training code.
+    """
     log = pyqtSignal(str)
+    progress = pyqtSignal(int, int)
     finished = pyqtSignal()
+    cancelled = pyqtSignal()
+    error = pyqtSignal(str)
+
+    POLL_MS = 100
+    CANCEL_GRACE_SEC = 10.0
 
-    def __init__(self, csv_path: Path, epochs=30):
+    def __init__(self, csv_path: Path, epochs=30, num_threads=None, use_global=False):
         super().__init__()
         self.csv_path = csv_path
         self.epochs = epochs
+        self.use_global = use_global
+        self.num_threads = num_threads or default_thread_budget()
+
+        ctx = multiprocessing.get_context("spawn")
+        self.queue = ctx.Queue()
+        self.cancel_event = ctx.Event()
+        # Not a daemon: the DataLoader inside needs to spawn its own workers
+        self.process = ctx.Process(
+            target=run_metric_process,
+            args=(
+                self.csv_path,
+                self.epochs,
+                self.queue,
+                self.cancel_event,
+                self.num_threads,
+                self.use_global,
+            ),
+        )
 
-    def run(self):
-        try:
-            self.log.emit("[INFO] processing metric dataset...")
-
-            changed = process_deck_metric(self.csv_path)
-
-            if changed:
-                self.log.emit("[INFO] training metric model...")
-                train_metric(self.csv_path, epochs=self.epochs)
-            else:
-                self.log.emit("[SKIP] metric training skipped (no changes)")
-
-            self.log.emit("[DONE] all tasks finished")
-
-        except Exception as e:
-            self.log.emit(f"[ERROR] {e}")
+        self.cancel_time = None
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.poll)
 
-        self.finished.emit()
+    def start(self):
+        self.process.start()
+        self.timer.start(self.POLL_MS)
+
+        # The child is not a daemon: stop it when the application quits
+        app = QApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(self.shutdown)
+
+    def is_running(self):
+        return self.timer.isActive()
+
+    def cancel(self):
+        if not self.is_running() or self.cancel_time is not None:
+            return
+        self.log.emit("[INFO] cancelling metric training...")
+        self.cancel_event.set()
+        self.cancel_time = time.time()
+
+    def poll(self):
+        alive = self.process.is_alive()
+
+        # Drain after the liveness check so the last messages of an
+        # exiting child are never missed
+        while True:
+            try:
+                msg = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if self.handle_message(msg):
+                return
+
+        if not alive:
+            self.stop()
+            self.error.emit(
+                f"metric process exited unexpectedly (code {self.process.exitcode})"
+            )
+            return
+
+        # The child did not react to the cancel request in time
+        if self.cancel_time is not None:
+            if time.time() - self.cancel_time > self.CANCEL_GRACE_SEC:
+                self.process.terminate()
+                self.stop()
+                self.cancelled.emit()
+
+    def handle_message(self, msg) -> bool:
+        """
+        Returns True when the message ends the run.
+        """
+        kind = msg.get("type")
+
+        if kind == "log":
+            self.log.emit(msg["text"])
+        elif kind == "progress":
+            self.progress.emit(msg["epoch"], msg["epochs"])
+            return False
+        elif kind == "done":
+            self.stop()
+            self.finished.emit()
+            return True
+        elif kind == "cancelled":
+            self.stop()
+            self.cancelled.emit()
+            return True
+        elif kind == "error":
+            self.stop()
+            self.error.emit(msg["text"])
+            return True
+
+        return False
+
+    def stop(self):
+        self.timer.stop()
+        self.process.join(timeout=1.0)
+
+    def shutdown(self):
+        """
+        Stop the child for good (window or application closing): ask it
+        to cancel, give it CANCEL_GRACE_SEC to save its checkpoint, then
+        terminate it. Blocks until the child is gone.
+        """
+        self.timer.stop()
+        if not self.process.is_alive():
+            return
+
+        self.cancel_event.set()
+        deadline = time.time() + self.CANCEL_GRACE_SEC
+        while self.process.is_alive() and time.time() < deadline:
+            # Drain so the exiting child never blocks on a full queue
+            try:
+                while True:
+                    self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.process.join(timeout=0.1)
+
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout=1.0)
 
 
 def imread_utf8(path):
@@ -112,6 +277,8 @@ def process_deck_metric(csv_path: Path, log_fn=print) -> bool:
 
     cards = []
     image_hashes = []
+    # Several MB per image: kept apart from the CLIP features
+    store = get_store("metric")
 
     with open(csv_path, encoding="utf-8") as f:
         rows = list(csv.DictReader(f))
@@ -131,23 +298,30 @@ def process_deck_metric(csv_path: Path, log_fn=print) -> bool:
             if not img_path.exists():
                 continue
 
-            img = imread_utf8(img_path)
-            if img is None:
-                continue
+            # The same image may already be processed in another deck
+            file_hash = file_sha256(img_path)
+            stored = store.get(file_hash, METRIC_STORE_NS)
+            if stored is None:
+                img = imread_utf8(img_path)
+                if img is None:
+                    continue
 
-            art = crop_art_region(img)
-            if art is None or art.size == 0:
-                continue
+                art = crop_art_region(img)
+                if art is None or art.size == 0:
+                    continue
 
-            art = cv2.cvtColor(art, cv2.COLOR_BGR2RGB)
-            art = np.ascontiguousarray(art)
+                art = cv2.cvtColor(art, cv2.COLOR_BGR2RGB)
+                art = np.ascontiguousarray(art)
 
-            # Compute hash (before augmentation)
-            image_hashes.append(hash_image(art))
+                stored = {
+                    # Compute hash (before augmentation)
+                    "hash": hash_image(art),
+                    "images": [art] + [augment_image(art) for _ in range(AUG_N)],
+                }
+                store.put(file_hash, METRIC_STORE_NS, stored)
 
-            card_entry["images"].append(art)
-            for _ in range(AUG_N):
-                card_entry["images"].append(augment_image(art))
+            image_hashes.append(stored["hash"])
+            card_entry["images"].extend(stored["images"])
 
         if card_entry["images"]:
             cards.append(card_entry)
@@ -159,6 +333,16 @@ def process_deck_metric(csv_path: Path, log_fn=print) -> bool:
     if hash_path.exists():
         prev = hash_path.read_text().strip()
         if prev == deck_fingerprint:
+            # An unfinished training run of the same dataset is resumed
+            if (deck_dir / CHECKPOINT_PATH_NAME).exists():
+                log_fn("[INFO] unfinished metric training found → resume")
+                return True
+            # Interrupted before the first checkpoint: the model is missing
+            # or older than the dataset (the hash is written before training)
+            model_path = deck_dir / MODEL_PATH_NAME
+            if not model_path.exists() or model_path.stat().st_mtime < hash_path.stat().st_mtime:
+                log_fn("[INFO] metric model not trained on this dataset → train")
+                return True
             log_fn("[INFO] metric dataset unchanged → skip training")
             return False
 
@@ -177,22 +361,67 @@ def build_metric_core(
     csv_path: Path,
     epochs=3,
     log_fn=print, 
+    incremental=True,
+    progress_fn=None,
+    should_stop=None,
+    num_workers=None,
+    distill=True,
+    use_global=False,
 ):
     """
-    GUI-independent core logic with injectable logging function
+    GUI-independent core logic with injectable logging function.
+    With incremental=True, the previous model of the deck is fine-tuned
+    instead of retrained from ImageNet weights when only a few cards changed.
+    With distill=True, a lightweight student model is distilled from the
+    trained model for camera-time re-ranking.
+    With use_global=True, no deck model is trained: the deck is embedded
+    as a gallery with the shared global model (see global_metric.py).
+
+    Returns False when the training was cancelled through should_stop.
     """
 
+    if use_global:
+        from global_metric import build_deck_gallery
+        log_fn("[INFO] building deck gallery with the global metric model...")
+        build_deck_gallery(csv_path, log_fn=log_fn)
+        log_fn("[DONE] metric build finished")
+        return True
+
     log_fn("[INFO] processing metric dataset...")
 
     changed = process_deck_metric(csv_path, log_fn=log_fn)
 
     if changed:
         log_fn("[INFO] training metric model...")
-        train_metric(csv_path, epochs=epochs, log_fn=log_fn)
+        completed = train_metric(
+            csv_path,
+            epochs=epochs,
+            log_fn=log_fn,
+            incremental=incremental,
+            progress_fn=progress_fn,
+            should_stop=should_stop,
+            num_workers=num_workers,
+        )
+        if not completed:
+            log_fn("[INFO] metric build cancelled")
+            return False
     else:
         log_fn("[SKIP] metric training skipped (no changes)")
 
+    if distill and student_is_stale(csv_path.parent):
+        log_fn("[INFO] distilling student model...")
+        completed = distill_metric(
+            csv_path,
+            log_fn=log_fn,
+            should_stop=should_stop,
+            num_workers=num_workers,
+        )
+        if not completed:
+            log_fn("[INFO] metric build cancelled")
+            return False
+
     log_fn("[DONE] metric build finished")
+    return True
 
 
 
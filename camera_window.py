@@ -1,30 +1,52 @@
 # camera_window.py
 import cv2
 import numpy as np
-from ultralytics import YOLO
 
 from PyQt5.QtWidgets import (
-    QWidget, QLabel, QVBoxLayout, QHBoxLayout,
-    QComboBox, QMessageBox, QCheckBox, QSpinBox
+    QApplication, QWidget, QLabel, QVBoxLayout, QHBoxLayout,
+    QComboBox, QMessageBox, QCheckBox, QSpinBox, QFileDialog, QPushButton
 )
 from PyQt5.QtCore import Qt, QTimer, QThread, pyqtSignal
 from PyQt5.QtGui import QImage, QPixmap
 from pathlib import Path
 import sys
+import argparse
 import pickle
 import numpy as np
-from clip_model import extract_image_feature
+from clip_model import (
+    extract_image_feature, extract_image_features,
+    set_active_model, CLIP_REGISTRY, CLIP_PROFILES
+)
+import clip_model
 from dataset_metric import extract_metric_feature
-from image_utils import crop_art_region, search_clip_with_color, metric_score_for_card
+from image_utils import (
+    crop_art_region, search_clip_with_color, search_clip_with_color_batch,
+    ClipDeckIndex, ScoringWeights, MetricGallery, extract_color_hist_hsv,
+    card_metadata,
+)
 import time
-from collections import deque
+from collections import deque, OrderedDict
 from collections import Counter
-from PyQt5.QtGui import QPainter, QFont, QColor
-from build_deck_clip import process_deck_from_csv
+from PyQt5.QtGui import QPainter, QFont, QColor, QPen
+from build_deck_clip import process_deck_from_csv, clip_feature_paths
+from compress_deck_clip import prototype_path, write_prototypes
 from PyQt5.QtCore import pyqtSignal
 import torch
-from model_metric import ConvNeXtEmbed
-from log_window import LogWindow, StdoutRedirect
+from model_metric import ConvNeXtEmbed, StudentEmbed
+from distill_metric import STUDENT_PATH_NAME, STUDENT_IMAGE_SIZE, TEACHER_IMAGE_SIZE
+from global_metric import (
+    GLOBAL_DIR, global_model_available, load_global_model, load_deck_gallery
+)
+from train_metric import MODEL_PATH_NAME
+from inference_backend import load_runtime, load_yolo
+from config import RUNTIME_DIR, EMBEDDING_STORAGE, DETECT_POLICY
+from collection_index import CollectionIndex, collection_index_available
+from phash_cascade import build_phash_cascade
+from card_tracker import CardTracker, crop_signature
+from detect_scheduler import DetectionScheduler, DETECT_POLICIES
+from frame_source import CameraSource, LatestFrameSource, open_source
+from stage_timer import StageTimer
+from log_window import LogWindow
 import platform
 import cv2
 
@@ -43,6 +65,9 @@ RESOLUTIONS = {
     "1920 x 1080 (16:9)": (1920, 1080),
 }
 
+def active_clip_model_id():
+    return clip_model.active_model_id
+
 def load_deck_clip(pkl_path):
     with open(pkl_path, "rb") as f:
         return pickle.load(f)
@@ -65,27 +90,29 @@ CONF_TH = 0.4          # Confidence threshold
 CARD_RATIO_TH = 8.0    # Percentage threshold to consider the card "close"
 CLIP_SCORE_TH = 0.5    # Minimum similarity score
 METRIC_SCORE_TH = 0.2  # Metric score threshold
-
-class MetricBuildWorker(QThread):
-    finished = pyqtSignal()
+FUSION_MARGIN = 0.05   # Fusion mode: lead over the next card to decide
+THUMB_CACHE_SIZE = 32  # resized detected-card thumbnails kept
+
+class MetricGalleryWorker(QThread):
+    """
+    Builds the metric model and gallery of the other "Fast metric"
+    setting off the GUI thread.
+    """
+    finished = pyqtSignal(str, object)  # kind, (model, input size, gallery)
     error = pyqtSignal(str)
+    log = pyqtSignal(str)
 
-    def __init__(self, csv_path: Path, epochs=3):
+    def __init__(self, build_fn, kind):
         super().__init__()
-        self.csv_path = csv_path
-        self.epochs = epochs
+        self.build_fn = build_fn
+        self.kind = kind
 
     def run(self):
         try:
-            from build_deck_metric import build_metric_core
-            build_metric_core(
-                self.csv_path,
-                epochs=self.epochs
-            )  
+            setup = self.build_fn(self.kind, log_fn=self.log.emit)
+            self.finished.emit(self.kind, setup)
         except Exception as e:
             self.error.emit(str(e))
-        finally:
-            self.finished.emit()
 
 
 def cosine(a, b):
@@ -222,7 +249,15 @@ def detect_cameras(max_devices=5):
 class CameraWindow(QWidget):
     cardDetected = pyqtSignal(str)
 
-    def __init__(self, csv_path: Path, parent=None):
+    def __init__(
+        self, csv_path: Path, parent=None, source=None, realtime=True, loop=True,
+        trace_path=None,
+    ):
+        """
+        source: replay instead of the camera ("synthetic", a video file
+        or an image directory, see frame_source.py)
+        trace_path: write the per-stage timings (.csv/.json) on close
+        """
         super().__init__(parent)
 
         self.csv_path = csv_path
@@ -246,6 +281,9 @@ class CameraWindow(QWidget):
 
         self.metric_loaded = False
         self.metric_loading = False
+        self.metric_use_global = False
+        self.metric_setups = {}     # "student" / "teacher" -> (model, size, gallery)
+        self.gallery_worker = None
 
         self.advanced_enabled = False
 
@@ -259,28 +297,53 @@ class CameraWindow(QWidget):
         self.vote_spin.valueChanged.connect(self.on_vote_window_changed)
 
 
+        # Zero-weight features are neither loaded nor encoded per frame
+        self.scoring_weights = ScoringWeights.from_config()
+
         process_deck_from_csv(self.csv_path)
-        self.deck_features = load_deck_clip(
-            self.deck_dir / "deck_clip.pkl"
-        )
+        self.use_prototypes = False
+        self.load_deck_features()
+
+        # Per-track result cache (re-recognize only changed crops)
+        self.tracker = CardTracker()
+
+        # Perceptual-hash first stage (CLIP only for ambiguous crops),
+        # built when the cascade is first switched on
+        self.phash_cascade = None
+
+        # Collection mode: search every indexed card instead of the deck
+        self.collection_mode = False
+        self.collection_index = None
+        self.result_cards = {}
 
         self.setWindowTitle("Camera Window")
         self.resize(1000, 650)
 
         self.detected_pix = None   
+        self.detected_pix_key = None
+        self.thumb_cache = OrderedDict()
         self.detected_name = None
 
 
         # ---------- YOLO ----------
         try:
-            self.model = YOLO(YOLO_MODEL_PATH)
+            self.model = load_yolo(YOLO_MODEL_PATH, RUNTIME_DIR)
         except Exception as e:
             QMessageBox.critical(self, "YOLO Error", str(e))
             self.model = None
 
-        # ---------- Camera ----------
-        self.cap = None
+        # ---------- Per-stage latency ----------
+        self.timings = StageTimer()
+        self.trace_path = trace_path
+
+        # ---------- Detection scheduling ----------
+        self.detector = DetectionScheduler(self.detect_card, policy=DETECT_POLICY)
+
+        # ---------- Camera / replay source ----------
+        self.source = None
         self.camera_index = 0
+        self.replay_spec = source
+        self.replay_loop = loop
 
         # ---------- View ----------
         self.view = QLabel(alignment=Qt.AlignCenter)
@@ -296,43 +359,162 @@ class CameraWindow(QWidget):
 
         # ---------- UI ----------
         self.debug_check = QCheckBox("debug mode")
+        self.prototype_check = QCheckBox("Prototypes")
+        self.prototype_check.setToolTip(
+            "Search k-means prototypes of the augmented features (faster)"
+        )
+        self.prototype_check.stateChanged.connect(self.on_prototype_changed)
         self.advanced_check = QCheckBox("Advanced image detection")
         self.advanced_check.setToolTip(
             "Ranked CLIP then choose one card by Metric"
         )
         self.advanced_check.stateChanged.connect(self.on_advanced_check_changed)
+        self.fast_metric_check = QCheckBox("Fast metric")
+        self.fast_metric_check.setToolTip(
+            "Use the distilled lightweight model for Metric re-ranking"
+        )
+        self.fast_metric_check.setChecked(True)
+        self.fast_metric_check.stateChanged.connect(self.on_fast_metric_changed)
+        self.global_metric_check = QCheckBox("Global metric")
+        self.global_metric_check.setToolTip(
+            "Use the shared model of all decks (no per-deck training).\n"
+            "Train it with: python global_metric.py"
+        )
+        self.global_metric_check.setEnabled(global_model_available())
+        self.global_metric_check.setChecked(global_model_available())
+        self.collection_check = QCheckBox("Collection")
+        self.collection_check.setToolTip(
+            "Recognize any card of the collection instead of this deck.\n"
+            "Build the index with: python collection_index.py build"
+        )
+        self.collection_check.setEnabled(collection_index_available())
+        self.collection_check.stateChanged.connect(self.on_collection_changed)
+        self.cascade_check = QCheckBox("Hash cascade")
+        self.cascade_check.setToolTip(
+            "Accept clear perceptual-hash matches without running CLIP"
+        )
+        self.cascade_check.stateChanged.connect(self.on_cascade_changed)
+        self.track_check = QCheckBox("Track reuse")
+        self.track_check.setToolTip(
+            "Reuse the result of a tracked card until its crop changes"
+        )
+        self.track_check.setChecked(True)
+        self.fusion_check = QCheckBox("Fusion")
+        self.fusion_check.setToolTip(
+            "Search with the mean embedding of the tracked card and decide\n"
+            "as soon as it is clearly ahead (instead of frame voting)"
+        )
+        self.fusion_check.stateChanged.connect(self.on_fusion_changed)
+        self.multi_check = QCheckBox("Multi-card")
+        self.multi_check.setToolTip(
+            "Recognize every card in view (one batched CLIP pass per frame)"
+        )
 
         self.camera_box = QComboBox()
         self.camera_indices = detect_cameras()
-        if not self.camera_indices:
+        if not self.camera_indices and self.replay_spec is None:
             QMessageBox.critical(self, "Camera Error", "Camera not found.")
+            self.replay_spec = "synthetic"
         for i in self.camera_indices:
             self.camera_box.addItem(f"Camera {i}", i)
-        self.camera_index = self.camera_indices[0]
+        if self.camera_indices:
+            self.camera_index = self.camera_indices[0]
+        # Replay sources (reproducible runs, no webcam needed)
+        self.camera_box.addItem("Video file...", "video")
+        self.camera_box.addItem("Image folder...", "folder")
+        self.camera_box.addItem("Synthetic (deck)", "synthetic")
+        if self.replay_spec == "synthetic":
+            self.camera_box.setCurrentIndex(self.camera_box.findData("synthetic"))
+        elif self.replay_spec is not None:
+            kind = "folder" if Path(self.replay_spec).is_dir() else "video"
+            self.camera_box.setCurrentIndex(self.camera_box.findData(kind))
 
         self.camera_box.currentIndexChanged.connect(self.change_camera)
 
+        self.realtime_check = QCheckBox("Real time")
+        self.realtime_check.setToolTip(
+            "Replay at the source frame rate (dropping frames when behind).\n"
+            "Off: every frame as fast as possible (throughput)"
+        )
+        self.realtime_check.setChecked(realtime)
+        self.realtime_check.stateChanged.connect(self.on_realtime_changed)
+
+        self.latest_check = QCheckBox("Latest frame")
+        self.latest_check.setToolTip(
+            "Capture on a separate thread and always process the newest\n"
+            "camera frame (no queued stale frames)"
+        )
+        self.latest_check.setChecked(True)
+        self.latest_check.stateChanged.connect(self.reopen_camera)
+
         self.resolution_box = QComboBox()
         self.resolution_box.addItems(RESOLUTIONS.keys())
         self.resolution_box.setCurrentText("1280 x 720 (16:9)")
         self.resolution_box.currentIndexChanged.connect(self.reopen_camera)
 
+        self.clip_model_box = QComboBox()
+        profile_of = {v: k for k, v in CLIP_PROFILES.items()}
+        for model_id in CLIP_REGISTRY:
+            label = model_id
+            if model_id in profile_of:
+                label = f"{profile_of[model_id]} ({model_id})"
+            self.clip_model_box.addItem(label, model_id)
+        self.clip_model_box.setCurrentIndex(
+            self.clip_model_box.findData(active_clip_model_id())
+        )
+        self.clip_model_box.setToolTip(
+            "CLIP backbone (changing it builds the deck features once)"
+        )
+        self.clip_model_box.currentIndexChanged.connect(self.change_clip_model)
+
+        self.detect_box = QComboBox()
+        self.detect_box.addItems(DETECT_POLICIES)
+        self.detect_box.setCurrentText(DETECT_POLICY)
+        self.detect_box.setToolTip(
+            "full: YOLO on every frame\n"
+            "skip: YOLO every few frames, boxes followed in between\n"
+            "roi: YOLO around the last boxes between full-frame passes"
+        )
+        self.detect_box.currentTextChanged.connect(self.detector.set_policy)
+
         self.debug_check.stateChanged.connect(self.toggle_debug)
 
+        self.export_btn = QPushButton("Export timings")
+        self.export_btn.setToolTip("Save the per-stage timings of this session (CSV / JSON)")
+        self.export_btn.clicked.connect(self.export_timings)
+
         # ---------- Layout ----------
         top = QHBoxLayout()
         top.addWidget(self.debug_check)
+        top.addWidget(self.prototype_check)
+        top.addWidget(self.collection_check)
+        top.addWidget(self.cascade_check)
+        top.addWidget(self.track_check)
+        top.addWidget(self.fusion_check)
+        top.addWidget(self.multi_check)
         top.addSpacing(10)
         top.addWidget(self.advanced_check)
+        top.addWidget(self.fast_metric_check)
+        top.addWidget(self.global_metric_check)
         top.addSpacing(20)
         top.addWidget(QLabel("Camera"))
         top.addWidget(self.camera_box)
+        top.addWidget(self.realtime_check)
+        top.addWidget(self.latest_check)
         top.addSpacing(20)
         top.addWidget(QLabel("Resolution"))
         top.addWidget(self.resolution_box)
         top.addSpacing(20)
+        top.addWidget(QLabel("Model"))
+        top.addWidget(self.clip_model_box)
+        top.addSpacing(20)
+        top.addWidget(QLabel("Detect"))
+        top.addWidget(self.detect_box)
+        top.addSpacing(20)
         top.addWidget(QLabel("Vote num."))
         top.addWidget(self.vote_spin)
+        top.addSpacing(20)
+        top.addWidget(self.export_btn)
         top.addStretch()
 
         layout = QVBoxLayout(self)
@@ -368,93 +550,179 @@ class CameraWindow(QWidget):
         else:
             self.advanced_enabled = False
 
+        # Cached track results were decided with the other mode
+        self.tracker.clear()
+
     def load_metric_if_needed(self):
         if self.metric_loaded or self.metric_loading:
             return
 
         self.metric_loading = True
 
-        # ===== KILL logging BEFORE redirecting stdout =====
-        import logging
-        root = logging.getLogger()
-        root.handlers.clear()
-        root.addHandler(logging.NullHandler())
-        root.propagate = False
-
         # --- Log window ---
         self.log_window = LogWindow()
         self.log_window.show()
+        self.log_window.append_log("[INFO] building metric files")
 
-        # --- Redirect stdout / stderr to the GUI ---
-        self._stdout = sys.stdout
-        self._stderr = sys.stderr
-
-        self.stdout_redirect = StdoutRedirect()
-        self.stdout_redirect.text_emitted.connect(
-            self.log_window.append_log,
-            Qt.QueuedConnection
+        # --- Worker (training runs in a child process) ---
+        from build_deck_metric import MetricWorker
+        self.metric_use_global = (
+            self.global_metric_check.isChecked() and global_model_available()
         )
-
-        sys.stdout = self.stdout_redirect
-        sys.stderr = self.stdout_redirect
-
-        print("[INFO] building metric files")
-
-        # --- Worker ---
-        self.metric_worker = MetricBuildWorker(
+        self.metric_worker = MetricWorker(
             csv_path=self.csv_path,
-            epochs=20
+            epochs=20,
+            use_global=self.metric_use_global
         )
 
-        self.metric_worker.finished.connect(self.on_metric_ready)
-        self.metric_worker.error.connect(
-            lambda e: print(f"[ERROR] {e}")
+        self.metric_worker.log.connect(self.log_window.append_log)
+        self.metric_worker.progress.connect(
+            lambda epoch, total: self.log_window.setWindowTitle(
+                f"Log - metric training {epoch}/{total}"
+            )
         )
+        self.metric_worker.finished.connect(self.on_metric_ready)
+        self.metric_worker.error.connect(self.on_metric_failed)
+        self.metric_worker.cancelled.connect(self.on_metric_failed)
 
         self.metric_worker.start()
 
+    def on_metric_failed(self, message=""):
+        if message:
+            self.log_window.append_log(f"[ERROR] {message}")
+        self.log_window.append_log("[INFO] metric model not available")
 
+        self.metric_loading = False
+        self.advanced_enabled = False
+        self.advanced_check.blockSignals(True)
+        self.advanced_check.setChecked(False)
+        self.advanced_check.blockSignals(False)
 
     def on_metric_ready(self):
-        print("[INFO] loading metric model and features...")
+        self.log_window.append_log("[INFO] loading metric model and features...")
 
  
-        self.deck_metric = load_deck_metric(
-            self.deck_dir / "deck_metric.pkl"
-        )
+        if self.metric_use_global:
+            self.metric_input_size = TEACHER_IMAGE_SIZE
+            self.metric_model = self.metric_runtime(
+                load_global_model(), GLOBAL_DIR / MODEL_PATH_NAME,
+                self.metric_input_size, self.log_window.append_log
+            )
+            self.metric_features = load_deck_gallery(self.csv_path)
+            self.metric_gallery = MetricGallery(self.metric_features)
+        else:
+            self.deck_metric = load_deck_metric(
+                self.deck_dir / "deck_metric.pkl"
+            )
+            kind = self.metric_kind()
+            self.metric_setups = {
+                kind: self.build_metric_setup(kind, self.log_window.append_log)
+            }
+            self.use_metric_setup(kind)
 
-        self.metric_model = ConvNeXtEmbed(embed_dim=256)
-        self.metric_model.load_state_dict(
-            torch.load(self.deck_dir / "metric_model.pth", map_location="cpu", weights_only=True)
+        self.metric_loaded = True
+        self.metric_loading = False
+        self.tracker.clear()
+
+        self.log_window.append_log("[INFO] Metric model loaded")
+        self.log_window.append_log("[INFO] This window can be closed.")
+
+    def metric_kind(self):
+        """
+        "student" when "Fast metric" is on and the distilled student
+        exists, otherwise "teacher" (the full ConvNeXt model).
+        """
+        student_path = self.deck_dir / STUDENT_PATH_NAME
+        if self.fast_metric_check.isChecked() and student_path.exists():
+            return "student"
+        return "teacher"
+
+    def build_metric_setup(self, kind, log_fn=print):
+        """
+        Load the model of `kind` and embed the deck gallery with it.
+        Only reads window state, so it can run on a worker thread.
+        """
+        if kind == "student":
+            weights_path = self.deck_dir / STUDENT_PATH_NAME
+            model = StudentEmbed(embed_dim=256)
+            input_size = STUDENT_IMAGE_SIZE
+        else:
+            weights_path = self.deck_dir / "metric_model.pth"
+            model = ConvNeXtEmbed(embed_dim=256)
+            input_size = TEACHER_IMAGE_SIZE
+        model.load_state_dict(
+            torch.load(weights_path, map_location="cpu", weights_only=True)
         )
-        self.metric_model.eval()
+        runtime = self.metric_runtime(model, weights_path, input_size, log_fn)
 
-        self.metric_features = []
+        metric_features = []
         with torch.no_grad():
             for card in self.deck_metric:
                 feats = []
                 for img in card["images"]:
-                    f = extract_metric_feature(self.metric_model, img)
+                    f = extract_metric_feature(runtime, img, size=input_size)
                     feats.append(f)
 
                 mean_feat = np.mean(feats, axis=0)
                 mean_feat /= np.linalg.norm(mean_feat)
 
-                self.metric_features.append({
+                metric_features.append({
                     "name_en": card["name_en"],
                     "metric_feature": mean_feat
                 })
 
-        self.metric_loaded = True
-        self.metric_loading = False
+        return runtime, input_size, MetricGallery(metric_features)
+
+    def use_metric_setup(self, kind):
+        self.metric_model, self.metric_input_size, self.metric_gallery = (
+            self.metric_setups[kind]
+        )
+
+    def metric_runtime(self, model, weights_path: Path, size, log_fn=print):
+        """
+        Run the metric model on the fastest available inference backend.
+        The exported artifact is cached next to the weights.
+        """
+        model.eval()
+        return load_runtime(
+            model,
+            torch.randn(2, 3, size, size),
+            weights_path.with_suffix(""),
+            weights_path=weights_path,
+            log_fn=log_fn,
+        )
 
-        print("[INFO] Metric model loaded")
+    def on_fast_metric_changed(self, state=None):
+        """
+        Swap to the gallery of the new setting; one that was not built
+        yet is built on a worker thread and swapped in when ready.
+        """
+        if not self.metric_loaded or self.metric_use_global:
+            return
 
-        print("[INFO] This window can be closed.")
+        kind = self.metric_kind()
+        if kind in self.metric_setups:
+            self.use_metric_setup(kind)
+            self.tracker.clear()
+            return
+
+        # Re-checked when the running build finishes
+        if self.gallery_worker is not None and self.gallery_worker.isRunning():
+            return
 
-        # --- Restore stdout / stderr ---
-        sys.stdout = self._stdout
-        sys.stderr = self._stderr
+        self.log_window.append_log(f"[INFO] building {kind} metric gallery...")
+        self.gallery_worker = MetricGalleryWorker(self.build_metric_setup, kind)
+        self.gallery_worker.log.connect(self.log_window.append_log)
+        self.gallery_worker.finished.connect(self.on_metric_gallery_ready)
+        self.gallery_worker.error.connect(
+            lambda message: self.log_window.append_log(f"[ERROR] {message}")
+        )
+        self.gallery_worker.start()
+
+    def on_metric_gallery_ready(self, kind, setup):
+        self.metric_setups[kind] = setup
+        self.log_window.append_log(f"[OK] {kind} metric gallery ready")
+        self.on_fast_metric_changed()
 
 
     # ================= Camera Control =================
@@ -468,41 +736,170 @@ class CameraWindow(QWidget):
     def toggle_debug(self, state):
         self.debug_view.setVisible(state == Qt.Checked)
 
+    def export_timings(self):
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Export timings", "camera_timings.csv", "CSV (*.csv);;JSON (*.json)"
+        )
+        if path:
+            self.timings.export(path)
+
     def open_camera(self):
-        if self.cap:
-            self.cap.release()
+        self.close_source()
+
+        if self.replay_spec is None:
+            self.source = CameraSource(
+                self.camera_index,
+                RESOLUTIONS[self.resolution_box.currentText()],
+                get_cv_backend(),
+            )
+            if self.latest_check.isChecked():
+                self.source = LatestFrameSource(self.source)
+        else:
+            try:
+                self.source = open_source(
+                    self.replay_spec,
+                    self.csv_path,
+                    realtime=self.realtime_check.isChecked(),
+                    loop=self.replay_loop,
+                )
+            except Exception as e:
+                QMessageBox.warning(self, "Source Error", str(e))
+                return
+            print(f"[INFO] replay source: {self.source.describe()}")
+
+        self.detector.reset()
+        self.tracker.clear()
+        self.timer.start(self.source.interval_ms())
+
+    def close_source(self):
+        self.timer.stop()
+        if self.source:
+            if self.source.fps is not None or isinstance(self.source, LatestFrameSource):
+                print(self.source.report())
+            self.source.release()
+            self.source = None
+
+    def on_realtime_changed(self, state):
+        if self.source:
+            self.source.set_realtime(state == Qt.Checked)
+            self.timer.setInterval(self.source.interval_ms())
+
+    def load_deck_features(self):
+        """
+        Full augmented features, or their k-means prototypes when the
+        "Prototypes" search mode is on.
+        """
+        path = clip_feature_paths(self.deck_dir)[0]
+        if self.use_prototypes:
+            proto = prototype_path(self.deck_dir)
+            if not proto.exists():
+                write_prototypes(self.deck_dir, load_deck_clip(path))
+            path = proto
+        deck = load_deck_clip(path)
+
+        # Searched through one compact matrix per region; only the card
+        # metadata is kept, the float32 features are released here
+        self.deck_index = ClipDeckIndex(
+            deck,
+            storage=EMBEDDING_STORAGE,
+            use_prototypes=self.use_prototypes,
+            weights=self.scoring_weights,
+        )
+        self.deck_cards = [card_metadata(c) for c in deck]
 
-        backend = get_cv_backend()
-        self.cap = cv2.VideoCapture(self.camera_index, backend)
-        w, h = RESOLUTIONS[self.resolution_box.currentText()]
-        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, w)
-        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, h)
+    def on_prototype_changed(self, state):
+        self.use_prototypes = state == Qt.Checked
+        self.load_deck_features()
+        self.vote_buffer.clear()
+        self.tracker.clear()
 
-        self.timer.start(30)
+    def on_collection_changed(self, state):
+        self.collection_mode = state == Qt.Checked
+        if self.collection_mode and self.collection_index is None:
+            self.collection_index = CollectionIndex()
+        self.vote_buffer.clear()
+        self.tracker.clear()
+
+    def on_fusion_changed(self, state):
+        self.vote_buffer.clear()
+        self.tracker.clear()
+
+    def on_cascade_changed(self, state):
+        if state == Qt.Checked and self.phash_cascade is None:
+            self.phash_cascade = build_phash_cascade(self.csv_path)
+        if self.phash_cascade is None:
+            return
+        if state != Qt.Checked and self.phash_cascade.queries:
+            print(
+                f"[REPORT] hash cascade: {self.phash_cascade.queries} crops, "
+                f"hit rate {self.phash_cascade.hit_rate:.3f}"
+            )
+        self.phash_cascade.reset_stats()
+        self.tracker.clear()
+
+    def change_clip_model(self):
+        self.timer.stop()
+        set_active_model(self.clip_model_box.currentData())
+
+        # Features are namespaced per model, so this only builds once
+        process_deck_from_csv(self.csv_path)
+        self.load_deck_features()
+
+        # The collection index is per model too
+        self.collection_index = None
+        available = collection_index_available()
+        self.collection_check.setEnabled(available)
+        if not available:
+            self.collection_check.setChecked(False)
+        elif self.collection_mode:
+            self.collection_index = CollectionIndex()
+
+        self.vote_buffer.clear()
+        self.tracker.clear()
+        if self.source:
+            self.timer.start(self.source.interval_ms())
 
     def reopen_camera(self):
         self.open_camera()
 
     def change_camera(self):
-        self.camera_index = self.camera_box.currentData()
+        kind = self.camera_box.currentData()
+        if kind == "video":
+            path, _ = QFileDialog.getOpenFileName(
+                self, "Video file", "", "Videos (*.mp4 *.avi *.mov *.mkv);;All files (*)"
+            )
+        elif kind == "folder":
+            path = QFileDialog.getExistingDirectory(self, "Image folder")
+        elif kind == "synthetic":
+            path = "synthetic"
+        else:
+            self.camera_index = kind
+            path = None
+
+        if kind in ("video", "folder") and not path:
+            # Cancelled: keep the current source
+            return
+        self.replay_spec = path
         self.open_camera()
 
     # ================= YOLO Detection =================
 
-    def detect_card(self, frame):
+    def detect_card(self, frame, imgsz=None):
         """
-        Detect cards using YOLO.
+        Detect cards using YOLO (imgsz: reduced input size for ROIs).
         Returns:
             boxes: [(x1, y1, x2, y2, conf)]
         """
         if self.model is None:
             return []
 
+        kwargs = {"imgsz": imgsz} if imgsz else {}
         results = self.model.predict(
             frame,
             conf=CONF_TH,
             verbose=False,
-            device="cpu"
+            device="cpu",
+            **kwargs
         )
 
         boxes = []
@@ -517,94 +914,90 @@ class CameraWindow(QWidget):
         return boxes
 
     
-    def overlay_detected_image(self, frame):
-        if self.detected_pix is None or self.fade_alpha <= 0.01:
-            return frame
-
-        h, w = frame.shape[:2]
-        overlay = frame.copy()
+    def detected_thumbnail(self, w, h):
+        """
+        Detected card resized for the right quarter of a (w, h) frame, as
+        (QImage, x, y). Cached per card image and frame size, so the
+        resize only runs when the card or the resolution changes.
+        """
+        key = (self.detected_pix_key, w, h)
+        hit = self.thumb_cache.get(key)
+        if hit is not None:
+            self.thumb_cache.move_to_end(key)
+            return hit[1:]
 
         # ---- Display area ----
         area_x1 = int(w * 0.75)
         area_w = w - area_x1
         area_h = h
 
-        img = self.detected_pix.copy()
-        ih, iw = img.shape[:2]
-
+        ih, iw = self.detected_pix.shape[:2]
         scale = min(area_w / iw, area_h / ih) * 0.9
         nw, nh = int(iw * scale), int(ih * scale)
-        img = cv2.resize(img, (nw, nh), interpolation=cv2.INTER_AREA)
+        thumb = cv2.cvtColor(
+            cv2.resize(self.detected_pix, (nw, nh), interpolation=cv2.INTER_AREA),
+            cv2.COLOR_BGR2RGB
+        )
+        qimg = QImage(thumb.data, nw, nh, thumb.strides[0], QImage.Format_RGB888)
 
         x = area_x1 + (area_w - nw) // 2
         y = (area_h - nh) // 2
 
-        # ---- Draw image onto overlay ----
-        roi = overlay[y:y+nh, x:x+nw]
-        if roi.shape[:2] == img.shape[:2]:
-            overlay[y:y+nh, x:x+nw] = img
-
-        # ---- Draw guide line onto overlay----
-        if self.show_line and self.last_box_center is not None:
-            cv2.line(
-                overlay,
-                self.last_box_center,
-                (x, y + nh // 2),
-                (0, 0, 255),
-                2
-            )
-
-        # ---- Fade blending ----
-        cv2.addWeighted(
-            overlay, self.fade_alpha,
-            frame, 1 - self.fade_alpha,
-            0,
-            frame
-        )
-
-        return frame
-
-
+        # The array owns the pixels of the QImage
+        self.thumb_cache[key] = (thumb, qimg, x, y)
+        if len(self.thumb_cache) > THUMB_CACHE_SIZE:
+            self.thumb_cache.popitem(last=False)
+        return qimg, x, y
 
-
-
-    def draw_text_qt(self, frame, text, x, y):
-        # OpenCV → RGB
+    def render_frame(self, frame, texts):
+        """
+        Show the BGR frame in the main view: one RGB conversion, then
+        the card texts, the detected-card thumbnail and the guide line
+        are painted onto the same QImage (faded by fade_alpha).
+        texts: [(text, x, y)]
+        """
         rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        h, w, ch = rgb.shape
-        bytes_per_line = ch * w
-
-        # NumPy → QImage
-        qimg = QImage(
-            rgb.data,
-            w,
-            h,
-            bytes_per_line,
-            QImage.Format_RGB888
-        )
-
-        painter = QPainter(qimg)
-        painter.setFont(QFont("Meiryo", 16))
-        painter.setPen(QColor(255, 0, 0))
-        painter.drawText(x, y, text)
+        h, w = rgb.shape[:2]
+        img = QImage(rgb.data, w, h, rgb.strides[0], QImage.Format_RGB888)
+
+        painter = QPainter(img)
+        if texts:
+            painter.setFont(QFont("Meiryo", 16))
+            painter.setPen(QColor(255, 0, 0))
+            for text, x, y in texts:
+                painter.drawText(x, y, text)
+
+        if self.detected_pix is not None and self.fade_alpha > 0.01:
+            thumb, x, y = self.detected_thumbnail(w, h)
+            painter.setOpacity(self.fade_alpha)
+            painter.drawImage(x, y, thumb)
+
+            # ---- Guide line ----
+            if self.show_line and self.last_box_center is not None:
+                cx, cy = self.last_box_center
+                painter.setPen(QPen(QColor(255, 0, 0), 2))
+                painter.drawLine(int(cx), int(cy), x, y + thumb.height() // 2)
         painter.end()
 
-        ptr = qimg.bits()
-        ptr.setsize(h * bytes_per_line)
-        arr = np.frombuffer(ptr, np.uint8).reshape((h, w, ch))
-
-        # Convert RGB back to BGR
-        return cv2.cvtColor(arr, cv2.COLOR_RGB2BGR)
-
-
+        self.view.setPixmap(
+            QPixmap.fromImage(img).scaled(
+                self.view.size(),
+                Qt.KeepAspectRatio,
+                Qt.FastTransformation
+            )
+        )
 
     # ================= Frame Update =================
 
     def update_frame(self):
-        if self.metric_loading:
-            return
+        self.timings.begin_frame()
+        try:
+            self.process_frame()
+        finally:
+            self.timings.end_frame()
 
-        if not self.cap:
+    def process_frame(self):
+        if not self.source:
             return
         
         if self.advanced_enabled:
@@ -612,16 +1005,25 @@ class CameraWindow(QWidget):
 
 
         now = time.time()
-        ret, frame = self.cap.read()
+        with self.timings.stage("capture"):
+            ret, frame = self.source.read()
         found_target = False
         if not ret:
+            # No new camera frame yet (capture thread) or end of a replay
+            self.timings.discard()
+            if self.source.fps is not None:
+                self.close_source()
             return
 
         h, w = frame.shape[:2]
 
-        boxes = self.detect_card(frame)
+        # Full-frame YOLO, propagated boxes or ROI YOLO (see detect_scheduler.py)
+        with self.timings.stage("yolo"):
+            boxes = self.detector.detect(frame)
+        self.detector.frame_done()
 
         valid_boxes = []
+        overlay_texts = []
         best_clip_score = 0
         best_color_score = 0
 
@@ -647,14 +1049,24 @@ class CameraWindow(QWidget):
                     color,
                     2
                 )
+        # Track ids keep cached results across frames
+        tracks = self.tracker.update(valid_boxes, now)
+
+        # Multi-card: every card of the frame in one batch
+        multi_recs = {}
+        if self.multi_check.isChecked() and valid_boxes:
+            multi_recs = self.recognize_all(frame, valid_boxes, tracks, now)
+
         if not valid_boxes:
             found_target = False
         else:
             found_target = True
-            x1, y1, x2, y2, conf, area = max(
-                valid_boxes,
-                key=lambda b: b[5]  # area
+            target = max(
+                range(len(valid_boxes)),
+                key=lambda i: valid_boxes[i][5]  # area
             )
+            x1, y1, x2, y2, conf, area = valid_boxes[target]
+            track = tracks[target]
 
         if found_target:
             cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), 3)
@@ -670,6 +1082,7 @@ class CameraWindow(QWidget):
             )
 
 
+            crop_start = time.perf_counter()
             card_img = crop_inner(frame, x1, y1, x2, y2)
             if card_img.size == 0:
                 # continue
@@ -688,7 +1101,7 @@ class CameraWindow(QWidget):
             h2, w2 = art_img.shape[:2]
 
             art_qimg = QImage(
-                art_img.tobytes(),
+                art_img.data,
                 w2,
                 h2,
                 art_img.strides[0],
@@ -706,79 +1119,43 @@ class CameraWindow(QWidget):
             if art_img.ndim != 3 or art_img.shape[2] != 3:
                 # continue
                 return
-            art_clip = extract_image_feature(art_img)
-
-            full_img = card_img            
-            full_clip = extract_image_feature(full_img)
-
-            res = search_clip_with_color(
-                query_art_clip_feat=art_clip,
-                query_art_img=art_img,
-                query_full_clip_feat=full_clip,
-                query_full_img=full_img,
-                deck=self.deck_features,
-            )
-
-
-            clip_card = res["best"]["card"]
-            clip_side = res["best"]["side"]
-            clip_score = res["best"]["score"]
-            top_cards = res["topk"]
-
-            final_card = clip_card
-            final_score = clip_score
-            best_clip_score = final_score
-
-            # ---------------------------
-            # Advanced image detection
-            # ---------------------------
-            if self.advanced_enabled:
-
-                if not self.metric_loaded:
-                    return
-                
-                self.load_metric_if_needed()
-
-                metric_feat = extract_metric_feature(self.metric_model, art_img)
-
-                # Re-evaluate only the CLIP Top-K card names using the Metric model
-                best_metric_score = -1
-                best_metric_name = None
-
-                for c in top_cards:
-                    name = c["card"]["name_en"]
-                    score = metric_score_for_card(
-                        metric_feat,
-                        name,
-                        self.metric_features
-                    )
-
-                    if score > best_metric_score:
-                        best_metric_score = score
-                        best_metric_name = name
-
-                if best_metric_name is not None:
-                    final_card = {"name_en": best_metric_name}
-                    final_score = best_metric_score
-
 
+            # The crop signature decides reuse of the track's result
+            signature = crop_signature(art_img)
+            self.timings.add("crop", time.perf_counter() - crop_start)
+            fusion = self.fusion_check.isChecked()
+            if fusion and self.tracker.crop_changed(track, signature):
+                # Another card under the same box
+                track.reset_fusion()
+            if target in multi_recs:
+                # Already recognized (or reused) with the other cards of the frame
+                rec, reused = multi_recs[target]
+            else:
+                reused = self.can_reuse(track, signature, now)
+                if reused:
+                    rec = self.tracker.reuse(track)
+                else:
+                    rec = self.recognize(card_img, art_img, track=track if fusion else None)
+                    self.tracker.store(track, signature, rec, now, embedding=rec["embedding"])
+
+            final_card = rec["card"]
+            best_clip_score = rec["clip_score"]
+            top_cards = rec["topk"]
+            use_metric = rec["use_metric"]
+            metric_scores = rec["metric_scores"]
 
             # ---------------------------
             # Vote decision
             # ---------------------------
-            if self.advanced_enabled:
-                # Advanced ON → decide using Metric score
-                if final_card is not None and final_score >= METRIC_SCORE_TH:
-                    self.vote_buffer.append(final_card["name_en"])
-
+            vote_start = time.perf_counter()
+            if fusion:
+                self.decide_track(track, rec)
+                voted_name = track.decided
             else:
-                # Advanced OFF → decide using CLIP score
-                if final_card is not None and final_score >= CLIP_SCORE_TH:
+                if rec["accepted"]:
                     self.vote_buffer.append(final_card["name_en"])
 
-
-
-            voted_name = self.majority_vote()
+                voted_name = self.majority_vote()
 
             # ---- Final decision ----
             self.current_card = voted_name
@@ -795,8 +1172,8 @@ class CameraWindow(QWidget):
 
                     # ---- Update displayed image ----
                     voted_card = next(
-                        (c for c in self.deck_features if c["name_en"] == self.current_card),
-                        None
+                        (c for c in self.deck_cards if c["name_en"] == self.current_card),
+                        self.result_cards.get(self.current_card)
                     )
                     if voted_card:
                         face = voted_card.get("front")
@@ -805,6 +1182,7 @@ class CameraWindow(QWidget):
                             img = cv2.imread(str(img_path))
                             if img is not None:
                                 self.detected_pix = img
+                                self.detected_pix_key = face["image"]
 
                 # ---- Update guide line (always refresh while detection continues) ----
                 self.last_box_center = (
@@ -828,7 +1206,10 @@ class CameraWindow(QWidget):
                 self.show_line = False
 
 
+            self.timings.add("vote", time.perf_counter() - vote_start)
+
             # ---- Draw text ----
+            render_start = time.perf_counter()
             topk_text = "\n".join(
             (
                 f"{i+1}. {c['card']['name_en']} "
@@ -843,8 +1224,8 @@ class CameraWindow(QWidget):
                 f"med:{c['full_clip_median']:.2f} "
                 f"Col:{c['full_color_score']:.2f} "
                 + (
-                    f"METRIC:{metric_score_for_card(metric_feat, c['card']['name_en'], self.metric_features):.2f}"
-                    if self.advanced_enabled
+                    f"METRIC:{metric_scores[i]:.2f}"
+                    if use_metric
                     else ""
                 )
             )
@@ -853,37 +1234,73 @@ class CameraWindow(QWidget):
 
 
             if final_card is not None:
+                source = (
+                    f"CLIP:{best_clip_score:.2f} "
+                    if rec["source"] == "CLIP" else f"{rec['source']} "
+                )
+                if self.cascade_check.isChecked():
+                    source += f"(hash hit rate {self.phash_cascade.hit_rate:.0%}) "
+                source += f"#{track.id}"
+                if fusion:
+                    source += f" fused:{track.fused_n} margin:{rec['margin']:.2f}"
+                if reused:
+                    source += f" cached ({self.tracker.reuse_rate:.0%}) "
+                else:
+                    source += " "
                 text = (
                     f"{final_card['name_en']} "
-                    f"CLIP:{best_clip_score:.2f} "
+                    f"{source}"
                     f"--- TOP-{len(top_cards)} ---\n"
                     f"{topk_text}"
                 )
 
 
-                frame = self.draw_text_qt(frame, text, x1, y2 + 30)
+                overlay_texts.append((text, x1, y2 + 30))
                 print(text)
+            self.timings.add("render", time.perf_counter() - render_start)
 
 
         # Reset only if no nearby card was found in this frame
         if not found_target:
             self.vote_buffer.clear()
+            self.result_cards.clear()
 
 
-        # ---------- Main View ----------
-        frame = self.overlay_detected_image(frame)
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        img = QImage(
-            rgb.data, rgb.shape[1], rgb.shape[0],
-            rgb.strides[0], QImage.Format_RGB888
-        )
-        self.view.setPixmap(
-            QPixmap.fromImage(img).scaled(
-                self.view.size(),
-                Qt.KeepAspectRatio,
-                Qt.FastTransformation
+        # ---------- Detection readout / stage latencies ----------
+        render_start = time.perf_counter()
+        if self.debug_check.isChecked():
+            readout = self.detector.readout()
+            truth = getattr(self.source, "truth", None)
+            if truth:
+                readout += f" truth:{','.join(truth)}"
+            if isinstance(self.source, LatestFrameSource):
+                readout += (
+                    f" frame age:{self.source.age() * 1000.0:.0f}ms"
+                    f" dropped:{self.source.dropped}"
+                )
+            cv2.putText(
+                frame,
+                readout,
+                (10, 25),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.6,
+                (0, 255, 255),
+                2
             )
-        )
+            for i, line in enumerate(self.timings.readout_lines()):
+                cv2.putText(
+                    frame,
+                    line,
+                    (10, 50 + 20 * i),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    0.5,
+                    (0, 255, 255),
+                    1
+                )
+
+        # ---------- Main View ----------
+        self.render_frame(frame, overlay_texts)
+        self.timings.add("render", time.perf_counter() - render_start)
         # ---------- Debug View ----------
 
         if self.debug_check.isChecked():
@@ -899,6 +1316,338 @@ class CameraWindow(QWidget):
             print("current:", self.current_card)
 
 
+    def recognize(self, card_img, art_img, track=None):
+        """
+        Recognize one card crop (RGB full card and art region).
+
+        Perceptual-hash cascade first (deck mode); CLIP search, then the
+        metric re-rank in Advanced mode, for ambiguous crops.
+        With a track (fusion mode) the search uses the running mean of
+        the track's embeddings instead of this frame's.
+        Returns {"card", "score", "clip_score", "topk", "use_metric",
+        "metric_scores", "source", "embedding", "margin", "accepted"}.
+        "margin" is the lead of the best card over the next other card.
+        """
+        rec = self.cascade_result(art_img)
+        if rec is not None:
+            return rec
+
+        art_clip = None
+        if self.scoring_weights.uses("art_clip"):
+            with self.timings.stage("clip_art"):
+                art_clip = extract_image_feature(art_img)
+
+        full_img = card_img
+        full_clip = None
+        if self.scoring_weights.uses("full_clip"):
+            with self.timings.stage("clip_full"):
+                full_clip = extract_image_feature(full_img)
+
+        if track is not None:
+            art_clip, full_clip = self.fuse_track(track, art_clip, full_clip)
+
+        search_start = time.perf_counter()
+
+        # Query colour histograms, once per frame
+        art_hist, full_hist = self.query_hists(art_img, full_img)
+
+        if self.collection_mode:
+            res = self.collection_index.search(
+                query_art_clip_feat=art_clip,
+                query_art_img=art_img,
+                query_full_clip_feat=full_clip,
+                query_full_img=full_img,
+                weights=self.scoring_weights,
+                query_art_hist=art_hist,
+                query_full_hist=full_hist,
+            )
+        else:
+            res = search_clip_with_color(
+                query_art_clip_feat=art_clip,
+                query_art_img=art_img,
+                query_full_clip_feat=full_clip,
+                query_full_img=full_img,
+                deck=self.deck_index,
+                query_art_hist=art_hist,
+                query_full_hist=full_hist,
+            )
+        self.timings.add("search", time.perf_counter() - search_start)
+
+        return self.finish_recognition(res, art_img, art_clip, track)
+
+    def recognize_batch(self, crops, tracks):
+        """
+        recognize() for several cards of one frame: the CLIP passes of
+        all crops run as one batch and the deck search as one matrix
+        product per region.
+        crops: [(card_img, art_img)], tracks: matching tracks (fusion) or Nones
+        """
+        recs = [self.cascade_result(art_img) for _, art_img in crops]
+        todo = [i for i, rec in enumerate(recs) if rec is None]
+        if not todo:
+            return recs
+
+        art_imgs = [crops[i][1] for i in todo]
+        full_imgs = [crops[i][0] for i in todo]
+
+        art_clips = [None] * len(todo)
+        if self.scoring_weights.uses("art_clip"):
+            with self.timings.stage("clip_art"):
+                art_clips = list(extract_image_features(art_imgs))
+        full_clips = [None] * len(todo)
+        if self.scoring_weights.uses("full_clip"):
+            with self.timings.stage("clip_full"):
+                full_clips = list(extract_image_features(full_imgs))
+        for k, i in enumerate(todo):
+            if tracks[i] is not None:
+                art_clips[k], full_clips[k] = self.fuse_track(
+                    tracks[i], art_clips[k], full_clips[k]
+                )
+
+        search_start = time.perf_counter()
+        hists = [self.query_hists(a, f) for a, f in zip(art_imgs, full_imgs)]
+        art_hists = [h[0] for h in hists]
+        full_hists = [h[1] for h in hists]
+
+        if self.collection_mode:
+            results = [
+                self.collection_index.search(
+                    query_art_clip_feat=art_clips[k],
+                    query_art_img=art_imgs[k],
+                    query_full_clip_feat=full_clips[k],
+                    query_full_img=full_imgs[k],
+                    weights=self.scoring_weights,
+                    query_art_hist=art_hists[k],
+                    query_full_hist=full_hists[k],
+                )
+                for k in range(len(todo))
+            ]
+        else:
+            results = search_clip_with_color_batch(
+                query_art_clip_feats=(
+                    art_clips if self.scoring_weights.uses("art_clip") else None
+                ),
+                query_art_imgs=art_imgs,
+                query_full_clip_feats=(
+                    full_clips if self.scoring_weights.uses("full_clip") else None
+                ),
+                query_full_imgs=full_imgs,
+                deck=self.deck_index,
+                query_art_hists=(
+                    art_hists if self.scoring_weights.uses("art_color") else None
+                ),
+                query_full_hists=(
+                    full_hists if self.scoring_weights.uses("full_color") else None
+                ),
+            )
+        self.timings.add("search", time.perf_counter() - search_start)
+
+        for k, i in enumerate(todo):
+            recs[i] = self.finish_recognition(
+                results[k], art_imgs[k], art_clips[k], tracks[i]
+            )
+        return recs
+
+    def recognize_all(self, frame, valid_boxes, tracks, now):
+        """
+        Recognize every valid box of the frame: unchanged tracks reuse
+        their result, the others go through recognize_batch() together.
+        With fusion, every track decides on its own fused result.
+        Labels each box on the frame. Returns {box index: (result, reused)}.
+        """
+        fusion = self.fusion_check.isChecked()
+        recs = {}
+        pending = []  # (box index, card_img, art_img, signature)
+
+        for i, (x1, y1, x2, y2, conf, area) in enumerate(valid_boxes):
+            crop_start = time.perf_counter()
+            card_img = crop_inner(frame, x1, y1, x2, y2)
+            if card_img.size == 0:
+                continue
+            card_img = cv2.rotate(
+                cv2.cvtColor(card_img, cv2.COLOR_BGR2RGB), cv2.ROTATE_180
+            )
+            art_img = crop_art_region(card_img)
+            if art_img is None or art_img.size == 0:
+                continue
+            art_img = np.ascontiguousarray(art_img)
+
+            track = tracks[i]
+            signature = crop_signature(art_img)
+            self.timings.add("crop", time.perf_counter() - crop_start)
+            if fusion and self.tracker.crop_changed(track, signature):
+                track.reset_fusion()
+            if self.can_reuse(track, signature, now):
+                recs[i] = (self.tracker.reuse(track), True)
+            else:
+                pending.append((i, card_img, art_img, signature))
+
+        if pending:
+            batch = self.recognize_batch(
+                [(card_img, art_img) for _, card_img, art_img, _ in pending],
+                [tracks[i] if fusion else None for i, _, _, _ in pending],
+            )
+            for (i, _, _, signature), rec in zip(pending, batch):
+                self.tracker.store(tracks[i], signature, rec, now, embedding=rec["embedding"])
+                if fusion:
+                    self.decide_track(tracks[i], rec)
+                recs[i] = (rec, False)
+
+        for i, (rec, _) in recs.items():
+            x1, y1, x2, y2 = valid_boxes[i][:4]
+            if fusion:
+                name = tracks[i].decided or "?"
+            else:
+                name = rec["card"]["name_en"] if rec["accepted"] else "?"
+            cv2.rectangle(frame, (x1, y1), (x2, y2), (255, 128, 0), 2)
+            cv2.putText(
+                frame,
+                f"#{tracks[i].id} {name}",
+                (x1, y2 + 25),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.7,
+                (255, 128, 0),
+                2
+            )
+        return recs
+
+    def can_reuse(self, track, signature, now):
+        """
+        Reuse the track's result while its crop is unchanged
+        (fusion: only once the track is decided).
+        """
+        fusion = self.fusion_check.isChecked()
+        return (
+            self.track_check.isChecked()
+            and (not fusion or track.decided is not None)
+            and not self.tracker.needs_recognition(track, signature, now)
+        )
+
+    def decide_track(self, track, rec):
+        # Fusion: decide as soon as the fused embedding is clearly ahead
+        if rec["accepted"] and rec["margin"] >= FUSION_MARGIN:
+            track.decided = rec["card"]["name_en"]
+
+    def cascade_result(self, art_img):
+        """
+        Perceptual-hash cascade (deck mode): a recognition result for a
+        clear hash match, otherwise None.
+        """
+        if not self.cascade_check.isChecked() or self.collection_mode:
+            return None
+
+        with self.timings.stage("hash"):
+            hit = self.phash_cascade.match(art_img)
+        if hit is None:
+            return None
+
+        return {
+            "card": hit["card"],
+            "score": hit["score"],
+            "clip_score": 0.0,
+            "topk": [],
+            "use_metric": False,
+            "metric_scores": None,
+            "source": f"HASH d:{hit['distance']} margin:{hit['margin']}",
+            "embedding": None,
+            # distance and margin are already checked
+            "margin": 1.0,
+            "accepted": True,
+        }
+
+    def fuse_track(self, track, art_clip, full_clip):
+        if art_clip is not None:
+            art_clip = track.fuse("art", art_clip)
+        if full_clip is not None:
+            full_clip = track.fuse("full", full_clip)
+        track.fused_n += 1
+        return art_clip, full_clip
+
+    def query_hists(self, art_img, full_img):
+        art_hist = (
+            extract_color_hist_hsv(art_img)
+            if self.scoring_weights.uses("art_color") else None
+        )
+        full_hist = (
+            extract_color_hist_hsv(full_img)
+            if self.scoring_weights.uses("full_color") else None
+        )
+        return art_hist, full_hist
+
+    def finish_recognition(self, res, art_img, art_clip, track=None):
+        """
+        CLIP search result -> recognition result (metric re-rank in
+        Advanced mode, margin and acceptance).
+        """
+        clip_card = res["best"]["card"]
+        clip_score = res["best"]["score"]
+        top_cards = res["topk"]
+        for c in top_cards:
+            self.result_cards.setdefault(c["card"]["name_en"], c["card"])
+
+        final_card = clip_card
+        final_score = clip_score
+        metric_scores = None
+
+        # ---------------------------
+        # Advanced image detection
+        # (CLIP only while the metric model is still training;
+        # the metric gallery only covers the deck)
+        # ---------------------------
+        use_metric = (
+            self.advanced_enabled
+            and self.metric_loaded
+            and not self.collection_mode
+        )
+        if use_metric:
+            metric_start = time.perf_counter()
+            metric_feat = extract_metric_feature(
+                self.metric_model, art_img, size=self.metric_input_size
+            )
+            if track is not None:
+                metric_feat = track.fuse("metric", metric_feat)
+
+            # Re-evaluate only the CLIP Top-K card names using the Metric model
+            # (one matrix-vector product, reused by the debug text)
+            topk_names = [c["card"]["name_en"] for c in top_cards]
+            metric_scores = self.metric_gallery.rerank(metric_feat, topk_names)
+
+            if len(metric_scores) and not np.isnan(metric_scores).all():
+                best_i = int(np.nanargmax(metric_scores))
+                final_card = {"name_en": topk_names[best_i]}
+                final_score = float(metric_scores[best_i])
+            self.timings.add("metric", time.perf_counter() - metric_start)
+
+        # Advanced ON → decide using Metric score, OFF → CLIP score
+        threshold = METRIC_SCORE_TH if use_metric else CLIP_SCORE_TH
+
+        # Lead over the best other card name
+        if use_metric and metric_scores is not None:
+            ranked = [
+                (float(sc), c["card"]["name_en"])
+                for sc, c in zip(metric_scores, top_cards) if not np.isnan(sc)
+            ]
+        else:
+            ranked = [(c["final_score"], c["card"]["name_en"]) for c in top_cards]
+        others = [
+            sc for sc, name in ranked
+            if final_card is None or name != final_card["name_en"]
+        ]
+        margin = final_score - max(others) if others else 1.0
+
+        return {
+            "card": final_card,
+            "score": final_score,
+            "clip_score": clip_score,
+            "topk": top_cards,
+            "use_metric": use_metric,
+            "metric_scores": metric_scores,
+            "source": "CLIP",
+            "embedding": art_clip,
+            "margin": margin,
+            "accepted": final_card is not None and final_score >= threshold,
+        }
+
     def majority_vote(self):
         IGNORE_LAST = 2
 
@@ -921,6 +1670,39 @@ class CameraWindow(QWidget):
     # ================= Cleanup =================
 
     def closeEvent(self, event):
-        if self.cap:
-            self.cap.release()
+        worker = getattr(self, "metric_worker", None)
+        if worker is not None:
+            # The checkpoint lets the next session resume the training
+            worker.shutdown()
+        if self.gallery_worker is not None:
+            self.gallery_worker.wait()
+        if self.cascade_check.isChecked():
+            self.on_cascade_changed(Qt.Unchecked)
+        self.close_source()
+        if self.trace_path:
+            self.timings.export(self.trace_path)
         event.accept()
+
+
+# -------------------------
+# Entry point
+# -------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Camera recognition window")
+    parser.add_argument("csv_path", type=Path)
+    parser.add_argument(
+        "--source",
+        help='"synthetic", a video file or an image directory (default: camera)',
+    )
+    parser.add_argument("--fast", action="store_true", help="replay as fast as possible")
+    parser.add_argument("--once", action="store_true", help="stop at the end of the replay")
+    parser.add_argument("--trace", type=Path, help="per-stage timings (.csv/.json) written on close")
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    w = CameraWindow(
+        args.csv_path, source=args.source, realtime=not args.fast, loop=not args.once,
+        trace_path=args.trace,
+    )
+    w.show()
+    sys.exit(app.exec_())
@@ -0,0 +1,167 @@
+# card_tracker.py
+"""
+Lightweight card tracker for the camera loop.
+
+YOLO boxes are matched to existing tracks by IoU. Each track caches its
+last recognition result and embedding; a card is only recognized again
+when its crop changed materially (thumbnail correlation) or the refresh
+interval elapsed, so a static card costs almost no model work.
+"""
+import itertools
+
+import cv2
+import numpy as np
+
+IOU_MATCH_TH = 0.3     # minimum IoU to continue a track
+CROP_SIM_TH = 0.90     # thumbnail correlation below this → recognize again
+REFRESH_SEC = 1.5      # recognize again at least this often
+TRACK_TTL_SEC = 0.5    # tracks not seen for this long are dropped
+SIGNATURE_SIZE = 24
+
+
+def box_iou(a, b):
+    """
+    IoU of two (x1, y1, x2, y2) boxes.
+    """
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, ix2 - ix1) * max(0, iy2 - iy1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def crop_signature(img_rgb):
+    """
+    Zero-mean, unit-norm grayscale thumbnail; the dot product of two
+    signatures is their normalized cross-correlation.
+    """
+    gray = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2GRAY)
+    small = cv2.resize(
+        gray, (SIGNATURE_SIZE, SIGNATURE_SIZE), interpolation=cv2.INTER_AREA
+    ).astype(np.float32).flatten()
+    small -= small.mean()
+    norm = np.linalg.norm(small)
+    return small / norm if norm > 0 else small
+
+
+class Track:
+    def __init__(self, track_id, box, now):
+        self.id = track_id
+        self.box = box
+        self.first_seen = now
+        self.last_seen = now
+
+        # Cache of the last recognition
+        self.signature = None
+        self.result = None
+        self.embedding = None
+        self.recognized_at = 0.0
+
+        # Embedding fusion: running sums of normalized embeddings
+        self.fused = {}
+        self.fused_n = 0
+        self.decided = None
+
+    def fuse(self, key, embedding):
+        """
+        Add a query embedding and return the normalized mean of all
+        embeddings of this track so far.
+        """
+        e = np.asarray(embedding, dtype=np.float32)
+        e = e / np.linalg.norm(e)
+        total = self.fused.get(key)
+        total = e.copy() if total is None else total + e
+        self.fused[key] = total
+        return total / np.linalg.norm(total)
+
+    def reset_fusion(self):
+        self.fused = {}
+        self.fused_n = 0
+        self.decided = None
+
+
+class CardTracker:
+    def __init__(
+        self,
+        iou_th=IOU_MATCH_TH,
+        sim_th=CROP_SIM_TH,
+        refresh_sec=REFRESH_SEC,
+        ttl_sec=TRACK_TTL_SEC,
+    ):
+        self.iou_th = iou_th
+        self.sim_th = sim_th
+        self.refresh_sec = refresh_sec
+        self.ttl_sec = ttl_sec
+
+        self.tracks = []
+        self._ids = itertools.count(1)
+
+        self.recognitions = 0
+        self.reuses = 0
+
+    def update(self, boxes, now):
+        """
+        Match boxes [(x1, y1, x2, y2, ...)] to tracks (greedy by IoU).
+        Returns the track of every box, in box order.
+        """
+        pairs = sorted(
+            (
+                (box_iou(box[:4], track.box[:4]), bi, ti)
+                for bi, box in enumerate(boxes)
+                for ti, track in enumerate(self.tracks)
+            ),
+            reverse=True,
+        )
+
+        matched = [None] * len(boxes)
+        used = set()
+        for iou, bi, ti in pairs:
+            if iou < self.iou_th:
+                break
+            if matched[bi] is not None or ti in used:
+                continue
+            matched[bi] = self.tracks[ti]
+            used.add(ti)
+
+        for bi, box in enumerate(boxes):
+            track = matched[bi]
+            if track is None:
+                track = Track(next(self._ids), box, now)
+                self.tracks.append(track)
+                matched[bi] = track
+            track.box = box
+            track.last_seen = now
+
+        self.tracks = [t for t in self.tracks if now - t.last_seen <= self.ttl_sec]
+        return matched
+
+    def crop_changed(self, track, signature) -> bool:
+        if track.signature is None:
+            return False
+        return float(np.dot(signature, track.signature)) < self.sim_th
+
+    def needs_recognition(self, track, signature, now) -> bool:
+        if track.result is None or track.signature is None:
+            return True
+        if now - track.recognized_at > self.refresh_sec:
+            return True
+        return self.crop_changed(track, signature)
+
+    def store(self, track, signature, result, now, embedding=None):
+        track.signature = signature
+        track.result = result
+        track.embedding = embedding
+        track.recognized_at = now
+        self.recognitions += 1
+
+    def reuse(self, track):
+        self.reuses += 1
+        return track.result
+
+    @property
+    def reuse_rate(self):
+        total = self.recognitions + self.reuses
+        return self.reuses / total if total else 0.0
+
+    def clear(self):
+        self.tracks.clear()
@@ -0,0 +1,79 @@
+# clip_benchmark.py
+"""
+Per-backbone latency / accuracy benchmark on the current deck.
+
+Every registered CLIP backbone gets its own gallery of the deck and
+recognizes the same augmented images of the deck.
+
+Usage:
+    python clip_benchmark.py deck.csv [--models vit-b-32 vit-l-14] [--queries N] [--int8]
+"""
+import argparse
+import random
+from pathlib import Path
+
+import numpy as np
+
+from clip_model import CLIP_REGISTRY, create_image_encoder
+from clip_quant_eval import load_faces, face_entry, recognize
+from image_utils import augment_image
+
+
+def benchmark(csv_path: Path, model_ids=None, queries_per_face=3, quantized=False, log_fn=print):
+    model_ids = model_ids or list(CLIP_REGISTRY)
+    faces = list(load_faces(csv_path))
+
+    # Same queries for every backbone
+    random.seed(0)
+    queries = [
+        (name, augment_image(img))
+        for name, _, img in faces
+        for _ in range(queries_per_face)
+    ]
+    log_fn(f"[INFO] {len(faces)} card faces, {len(queries)} queries")
+
+    results = []
+    for model_id in model_ids:
+        encoder = create_image_encoder(model_id, quantized=quantized)
+
+        cards = {}
+        for name, side, img in faces:
+            card = cards.setdefault(name, {"name_en": name, "front": None, "back": None})
+            card[side] = face_entry(encoder, img)
+        deck = list(cards.values())
+
+        correct = 0
+        seconds = []
+        for name, query in queries:
+            pred, _, elapsed = recognize(encoder, deck, query)
+            correct += pred == name
+            seconds.append(elapsed)
+
+        row = {
+            "model": model_id + ("_int8" if quantized else ""),
+            "acc": correct / max(1, len(queries)),
+            # per image (two CLIP passes per query: art + full)
+            "ms_per_image": float(np.mean(seconds)) * 1000.0 / 2 if seconds else 0.0,
+        }
+        results.append(row)
+        log_fn(
+            f"[BENCH] {row['model']:<16} "
+            f"acc={row['acc']:.3f} "
+            f"latency={row['ms_per_image']:.1f}ms/image"
+        )
+
+    return results
+
+
+# -------------------------
+# Entry point
+# -------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark CLIP backbones on a deck")
+    parser.add_argument("csv_path", type=Path)
+    parser.add_argument("--models", nargs="*", default=None, choices=list(CLIP_REGISTRY))
+    parser.add_argument("--queries", type=int, default=3, help="augmented queries per card face")
+    parser.add_argument("--int8", action="store_true", help="benchmark the quantized encoders")
+    args = parser.parse_args()
+
+    benchmark(args.csv_path, args.models, args.queries, args.int8)
@@ -1,37 +1,183 @@
-# clip_model.py
 import os
 os.environ["HF_HUB_DISABLE_PROGRESS_BARS"] = "1"
 
 import torch
+import torch.nn as nn
 import open_clip
 import numpy as np
 import cv2
 from PIL import Image
 
+from config import RUNTIME_DIR, CLIP_QUANTIZE, CLIP_MODEL
+from inference_backend import load_runtime, EagerModel
+
 device = "cpu"
 
-model, _, preprocess = open_clip.create_model_and_transforms(
-    "ViT-B-32",
-    pretrained="openai"
-)
-# model, _, preprocess = open_clip.create_model_and_transforms(
-#     "ViT-L-14",
-#     pretrained="openai"
-# )
-# model, _, preprocess = open_clip.create_model_and_transforms(
-#     "ViT-B-16",
-#     pretrained="openai"
-# )
+# =========================
+# Model registry
+# =========================
+CLIP_REGISTRY = {
+    "vit-b-32": ("ViT-B-32", "openai"),
+    "vit-b-16": ("ViT-B-16", "openai"),
+    "vit-l-14": ("ViT-L-14", "openai"),
+}
+
+CLIP_PROFILES = {
+    "fast": "vit-b-32",
+    "accurate": "vit-l-14",
+}
+
+# Bump when crop / augmentation / preprocessing of the features changes,
+# so that old feature files are not reused
+PREPROCESS_VERSION = 1
+
+_models = {}
+
+
+def resolve_model_id(model_id=None) -> str:
+    model_id = model_id or CLIP_MODEL
+    model_id = CLIP_PROFILES.get(model_id, model_id)
+    if model_id not in CLIP_REGISTRY:
+        raise ValueError(f"unknown CLIP model: {model_id}")
+    return model_id
+
+
+def get_clip(model_id):
+    """
+    (model, preprocess) of a registered backbone, created once.
+    """
+    if model_id not in _models:
+        name, pretrained = CLIP_REGISTRY[model_id]
+        model, _, preprocess = open_clip.create_model_and_transforms(
+            name,
+            pretrained=pretrained
+        )
+        model.eval()
+        _models[model_id] = (model, preprocess)
+    return _models[model_id]
+
+
+class ClipImageEncoder(nn.Module):
+    """
+    encode_image as a plain forward() so it can be exported.
+    """
+    def __init__(self, clip):
+        super().__init__()
+        self.clip = clip
+
+    def forward(self, x):
+        return self.clip.encode_image(x)
+
+
+class ClipEncoder:
+    """
+    Preprocessing + image encoder of one backbone.
+    """
+    def __init__(self, model_id, quantized, preprocess, runtime):
+        self.model_id = model_id
+        self.quantized = quantized
+        self.preprocess = preprocess
+        self.runtime = runtime
+
+    def encode(self, img):
+        image = Image.fromarray(img)
+        image = self.preprocess(image).unsqueeze(0)
+
+        feat = self.runtime(image)
+
+        return feat.cpu().numpy()[0]
+
+    def encode_batch(self, imgs):
+        """
+        One forward pass over several images -> (B, D).
+        """
+        batch = torch.stack([self.preprocess(Image.fromarray(img)) for img in imgs])
+        return self.runtime(batch).cpu().numpy()
+
+
+def create_image_encoder(model_id=None, quantized=False):
+    """
+    quantized=True: dynamic INT8 quantization of the transformer linear
+    layers (weights int8, activations quantized on the fly). It runs on
+    eager PyTorch; the float encoder goes through the inference runtime.
+    """
+    model_id = resolve_model_id(model_id)
+    model, preprocess = get_clip(model_id)
+    encoder = ClipImageEncoder(model).eval()
+
+    if quantized:
+        encoder = torch.ao.quantization.quantize_dynamic(
+            encoder, {nn.Linear}, dtype=torch.qint8
+        )
+        return ClipEncoder(model_id, True, preprocess, EagerModel(encoder))
+
+    # Random images for the export trace and the parity check
+    example = torch.stack([
+        preprocess(Image.fromarray(
+            np.random.randint(0, 256, (320, 240, 3), dtype=np.uint8)
+        ))
+        for _ in range(2)
+    ])
+    runtime = load_runtime(
+        encoder,
+        example,
+        RUNTIME_DIR / f"clip_{model_id}",
+    )
+    return ClipEncoder(model_id, False, preprocess, runtime)
+
+
+def feature_namespace(model_id=None, quantized=None) -> str:
+    """
+    Suffix of the feature files: model id + preprocessing version
+    (+ "_int8"), so features of different encoders are never mixed.
+    Defaults to the active encoder.
+    """
+    if model_id is None:
+        model_id = active_model_id
+    if quantized is None:
+        quantized = active_quantized
+
+    ns = f"_{resolve_model_id(model_id)}_p{PREPROCESS_VERSION}"
+    return ns + ("_int8" if quantized else "")
+
+
+def set_active_model(model_id=None, quantized=None):
+    """
+    Switch the encoder used by extract_image_feature at runtime.
+    """
+    global active_model_id, active_quantized
+    if quantized is None:
+        quantized = active_quantized
+    active_model_id = resolve_model_id(model_id)
+    active_quantized = quantized
+    return get_active_encoder()
+
+
+def get_active_encoder():
+    """
+    Encoder of the active model, created on first use (importing this
+    module does not load CLIP, e.g. in training child processes).
+    """
+    global active_encoder
+    if (
+        active_encoder is None
+        or active_encoder.model_id != active_model_id
+        or active_encoder.quantized != active_quantized
+    ):
+        active_encoder = create_image_encoder(active_model_id, active_quantized)
+    return active_encoder
 
-model.eval()
 
-def extract_image_feature(img):
+active_model_id = resolve_model_id(CLIP_MODEL)
+active_quantized = CLIP_QUANTIZE
+active_encoder = None
 
-    image = Image.fromarray(img)
-    image = preprocess(image).unsqueeze(0)
+def extract_image_feature(img, encoder=None):
+    return (encoder or get_active_encoder()).encode(img)
 
-    with torch.no_grad():
-        feat = model.encode_image(image)
 
-    feat = feat.cpu().numpy()[0]
-    return feat
+def extract_image_features(imgs, encoder=None):
+    """
+    Batched extract_image_feature -> (B, D).
+    """
+    return (encoder or get_active_encoder()).encode_batch(imgs)
@@ -0,0 +1,151 @@
+# clip_quant_eval.py
+"""
+Compare the INT8 quantized CLIP encoder with the float encoder on the
+deck's own augmented images.
+
+Each encoder gets its own gallery (base art/full features per card face)
+and recognizes the same augmented queries with search_clip_with_color.
+
+Usage:
+    python clip_quant_eval.py deck.csv [--queries N]
+"""
+import argparse
+import csv
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from clip_model import create_image_encoder, extract_image_feature
+from image_utils import (
+    crop_art_region, augment_image, extract_color_hist_hsv, search_clip_with_color
+)
+from build_deck_clip import imread_utf8
+
+
+def load_faces(csv_path: Path):
+    """
+    Yields (name_en, side, full RGB image) for every card face.
+    """
+    deck_dir = csv_path.parent
+    with open(csv_path, encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+
+    for row in rows:
+        for side, key in (("front", "card_file_front"), ("back", "card_file_back")):
+            file = row.get(key)
+            if not file or not (deck_dir / file).exists():
+                continue
+            img = imread_utf8(deck_dir / file)
+            if img is None:
+                continue
+            yield row["name_en"], side, cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def face_entry(encoder, full_rgb):
+    art = np.ascontiguousarray(crop_art_region(full_rgb))
+    return {
+        "art": {
+            "clip_feats": [extract_image_feature(art, encoder)],
+            "color_hist": extract_color_hist_hsv(art),
+        },
+        "full": {
+            "clip_feats": [extract_image_feature(full_rgb, encoder)],
+            "color_hist": extract_color_hist_hsv(full_rgb),
+        },
+    }
+
+
+def recognize(encoder, deck, full_rgb):
+    art = np.ascontiguousarray(crop_art_region(full_rgb))
+
+    start = time.perf_counter()
+    art_feat = extract_image_feature(art, encoder)
+    full_feat = extract_image_feature(full_rgb, encoder)
+    elapsed = time.perf_counter() - start
+
+    res = search_clip_with_color(
+        query_art_clip_feat=art_feat,
+        query_art_img=art,
+        query_full_clip_feat=full_feat,
+        query_full_img=full_rgb,
+        deck=deck,
+    )
+    return res["best"]["card"]["name_en"], art_feat, elapsed
+
+
+def evaluate(csv_path: Path, queries_per_face=5, log_fn=print) -> dict:
+    encoders = {
+        "float": create_image_encoder(quantized=False),
+        "int8": create_image_encoder(quantized=True),
+    }
+
+    faces = list(load_faces(csv_path))
+    log_fn(f"[INFO] {len(faces)} card faces, {queries_per_face} queries each")
+
+    decks = {}
+    for key, encoder in encoders.items():
+        cards = {}
+        for name, side, img in faces:
+            card = cards.setdefault(name, {"name_en": name, "front": None, "back": None})
+            card[side] = face_entry(encoder, img)
+        decks[key] = list(cards.values())
+
+    total = agree = 0
+    correct = {key: 0 for key in encoders}
+    seconds = {key: 0.0 for key in encoders}
+    cosines = []
+
+    for name, _, img in faces:
+        for _ in range(queries_per_face):
+            query = augment_image(img)
+
+            results = {}
+            feats = {}
+            for key, encoder in encoders.items():
+                results[key], feats[key], elapsed = recognize(encoder, decks[key], query)
+                seconds[key] += elapsed
+                correct[key] += results[key] == name
+
+            a, b = feats["float"], feats["int8"]
+            cosines.append(float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))))
+
+            agree += results["float"] == results["int8"]
+            total += 1
+
+    total = max(1, total)
+    report = {
+        "queries": total,
+        "agreement": agree / total,
+        "float_acc": correct["float"] / total,
+        "int8_acc": correct["int8"] / total,
+        "embedding_cosine": float(np.mean(cosines)) if cosines else 0.0,
+        # two CLIP passes per query (art + full)
+        "float_ms": seconds["float"] / total * 1000.0,
+        "int8_ms": seconds["int8"] / total * 1000.0,
+    }
+
+    log_fn(
+        f"[REPORT] agreement={report['agreement']:.3f} "
+        f"float acc={report['float_acc']:.3f} "
+        f"int8 acc={report['int8_acc']:.3f} "
+        f"cosine={report['embedding_cosine']:.4f}"
+    )
+    log_fn(
+        f"[REPORT] latency per query float={report['float_ms']:.1f}ms "
+        f"int8={report['int8_ms']:.1f}ms"
+    )
+    return report
+
+
+# -------------------------
+# Entry point
+# -------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate the INT8 CLIP encoder")
+    parser.add_argument("csv_path", type=Path)
+    parser.add_argument("--queries", type=int, default=5, help="augmented queries per card face")
+    args = parser.parse_args()
+
+    evaluate(args.csv_path, queries_per_face=args.queries)
@@ -0,0 +1,395 @@
+# collection_index.py
+"""
+Collection-scale approximate nearest-neighbour index for card recognition.
+
+All card faces of the local decks (plus an optional image corpus) are
+indexed once per CLIP encoder from the feature store. The art CLIP
+vectors are grouped by an inverted file (IVF): k-means centroids over the
+normalized vectors, every vector stored in the list of its nearest
+centroid. A query only scores the vectors of the nprobe closest lists,
+keeps the best faces and re-scores that shortlist exactly with
+search_clip_with_color, so the result has the usual best / topk shape.
+
+Every array is saved as .npy and opened memory-mapped, so the index is
+not loaded into RAM.
+
+Usage:
+    python collection_index.py build [--corpus DIR] [--nlist N] [--no-extract]
+    python collection_index.py eval [--queries N] [--nprobe N]
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+from common_func import exe_dir
+from embedding_storage import kmeans, normalize_rows
+from feature_store import get_store, file_sha256
+from image_utils import region_feats, search_clip_with_color, ScoringWeights
+
+COLLECTION_DIR = exe_dir() / "collection_index"
+INDEX_VERSION = 1
+
+NPROBE = 8          # IVF lists scored per query
+SHORTLIST = 32      # faces re-scored exactly per query
+TRAIN_SIZE = 50000  # vectors used to train the IVF centroids
+ASSIGN_BLOCK = 65536
+
+
+def index_dir(namespace=None) -> Path:
+    """
+    One index per feature store namespace (CLIP encoder + augmentation).
+    """
+    from build_deck_clip import clip_store_namespace
+    return COLLECTION_DIR / (namespace or clip_store_namespace())
+
+
+def default_nlist(n_rows: int) -> int:
+    return int(np.clip(4 * np.sqrt(n_rows), 16, 4096))
+
+
+def assign_lists(X, centroids):
+    """
+    Nearest centroid (cosine) of every row, in blocks.
+    """
+    out = np.empty(len(X), dtype=np.int32)
+    for start in range(0, len(X), ASSIGN_BLOCK):
+        block = np.asarray(X[start:start + ASSIGN_BLOCK], dtype=np.float32)
+        out[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return out
+
+
+def offsets_of(counts):
+    return np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+
+# =========================
+# Build
+# =========================
+
+def iter_collection_images(csv_paths, corpus_dir: Path | None = None):
+    from global_metric import iter_deck_images, iter_corpus_images
+
+    for csv_path in csv_paths:
+        yield from iter_deck_images(csv_path)
+    if corpus_dir is not None:
+        yield from iter_corpus_images(corpus_dir)
+
+
+def build_collection_index(
+    csv_paths=None,
+    corpus_dir: Path | None = None,
+    nlist=None,
+    extract=True,
+    log_fn=print,
+) -> bool:
+    """
+    Index every card face (deduplicated by file content).
+    Features come from the feature store; faces not in the store are
+    extracted (and stored) unless extract=False.
+    The IVF is built over the art CLIP vectors, so the art CLIP weight
+    must not be 0.
+    """
+    from build_deck_clip import (
+        clip_store_namespace, store_get, store_put, extract_features_from_image
+    )
+    from global_metric import find_local_decks
+
+    if csv_paths is None:
+        csv_paths = find_local_decks()
+        log_fn(f"[INFO] {len(csv_paths)} local decks found")
+
+    weights = ScoringWeights.from_config()
+    if not weights.uses("art_clip"):
+        raise ValueError("the collection index needs the art CLIP features (art_clip > 0)")
+    use_full = weights.uses("full_clip")
+
+    namespace = clip_store_namespace()
+    store = get_store()
+
+    faces = []
+    feats = {"art": [], "full": []}
+    hists = {"art": [], "full": []}
+    seen = set()
+    extracted = missing = 0
+
+    for name, img_path in iter_collection_images(csv_paths, corpus_dir):
+        img_hash = file_sha256(img_path)
+        if img_hash in seen:
+            continue
+        seen.add(img_hash)
+
+        data = store_get(store, img_hash, namespace)
+        if data is None:
+            if not extract:
+                missing += 1
+                continue
+            data = extract_features_from_image(img_path)
+            if not data:
+                continue
+            store_put(store, img_hash, namespace, data)
+            extracted += 1
+
+        region = {r: region_feats(data[r]) for r in ("art", "full")}
+        if region["art"] is None or (use_full and region["full"] is None):
+            continue
+        if region["full"] is None:
+            region["full"] = np.zeros((0, region["art"].shape[1]), dtype=np.float32)
+
+        faces.append({"name_en": name, "image": str(Path(img_path).resolve())})
+        for r in ("art", "full"):
+            feats[r].append(region[r].astype(np.float16))
+            hist = data[r]["color_hist"]
+            hists[r].append(
+                np.zeros(512, dtype=np.float32) if hist is None
+                else np.asarray(hist, dtype=np.float32)
+            )
+
+    if not faces:
+        log_fn("[WARN] no card faces to index")
+        return False
+
+    out_dir = index_dir(namespace)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    art_off = offsets_of([len(f) for f in feats["art"]])
+    full_off = offsets_of([len(f) for f in feats["full"]])
+    art = np.concatenate(feats["art"])
+    full = np.concatenate(feats["full"])
+    del feats
+
+    # ---- IVF over the art vectors ----
+    nlist = min(nlist or default_nlist(len(art)), len(art))
+    rng = np.random.default_rng(0)
+    train = art if len(art) <= TRAIN_SIZE else art[rng.choice(len(art), TRAIN_SIZE, replace=False)]
+    start = time.perf_counter()
+    centroids = normalize_rows(kmeans(train.astype(np.float32), nlist))
+    assign = assign_lists(art, centroids)
+    log_fn(f"[INFO] IVF trained: {nlist} lists ({time.perf_counter() - start:.1f}s)")
+
+    # Art rows are stored grouped by list (contiguous probing);
+    # art_rows maps the face-ordered rows to their position
+    order = np.argsort(assign, kind="stable")
+    art_rows = np.empty_like(order)
+    art_rows[order] = np.arange(len(order))
+    row_face = np.repeat(np.arange(len(faces), dtype=np.int32), np.diff(art_off))
+
+    arrays = {
+        "centroids": centroids.astype(np.float32),
+        "list_offsets": offsets_of(np.bincount(assign, minlength=nlist)),
+        "art": art[order],
+        "art_face": row_face[order],
+        "art_rows": art_rows.astype(np.int64),
+        "art_offsets": art_off,
+        "full": full,
+        "full_offsets": full_off,
+        "art_hist": np.stack(hists["art"]),
+        "full_hist": np.stack(hists["full"]),
+    }
+    for key, arr in arrays.items():
+        np.save(out_dir / f"{key}.npy", arr)
+
+    with open(out_dir / "faces.json", "w", encoding="utf-8") as f:
+        json.dump(faces, f, ensure_ascii=False)
+    with open(out_dir / "meta.json", "w", encoding="utf-8") as f:
+        json.dump({
+            "version": INDEX_VERSION,
+            "namespace": namespace,
+            "faces": len(faces),
+            "vectors": int(len(art)),
+            "nlist": int(nlist),
+        }, f, indent=2)
+
+    size = sum(p.stat().st_size for p in out_dir.iterdir())
+    log_fn(
+        f"[OK] collection index saved: {out_dir} "
+        f"({len(faces)} faces, {len(art)} vectors, {size / 1024 ** 2:.1f} MB, "
+        f"{extracted} extracted"
+        + (f", {missing} not in the feature store" if missing else "")
+        + ")"
+    )
+    return True
+
+
+# =========================
+# Search
+# =========================
+
+def collection_index_available(namespace=None) -> bool:
+    meta_path = index_dir(namespace) / "meta.json"
+    if not meta_path.exists():
+        return False
+    with open(meta_path, encoding="utf-8") as f:
+        return json.load(f).get("version") == INDEX_VERSION
+
+
+class CollectionIndex:
+    def __init__(self, path: Path | None = None):
+        path = Path(path) if path else index_dir()
+        with open(path / "meta.json", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        with open(path / "faces.json", encoding="utf-8") as f:
+            self.faces = json.load(f)
+
+        # Small: loaded; everything else stays on disk
+        self.centroids = np.load(path / "centroids.npy")
+        self.list_offsets = np.load(path / "list_offsets.npy")
+
+        for key in (
+            "art", "art_face", "art_rows", "art_offsets",
+            "full", "full_offsets", "art_hist", "full_hist",
+        ):
+            setattr(self, key, np.load(path / f"{key}.npy", mmap_mode="r"))
+
+    def __len__(self):
+        return len(self.faces)
+
+    def probe(self, q, nprobe=NPROBE, shortlist=SHORTLIST):
+        """
+        Face ids of the best art matches among the vectors of the
+        nprobe closest IVF lists, best first.
+        """
+        q = np.asarray(q, dtype=np.float32)
+        nprobe = min(nprobe, len(self.centroids))
+        lists = np.argpartition(-(self.centroids @ q), nprobe - 1)[:nprobe]
+
+        scores = []
+        faces = []
+        for j in lists:
+            s, e = self.list_offsets[j], self.list_offsets[j + 1]
+            if s == e:
+                continue
+            scores.append(np.asarray(self.art[s:e], dtype=np.float32) @ q)
+            faces.append(self.art_face[s:e])
+        if not scores:
+            return np.zeros(0, dtype=np.int64)
+
+        scores = np.concatenate(scores)
+        faces = np.concatenate(faces)
+
+        # Per-face max: first occurrence in descending score order
+        ranked = faces[np.argsort(-scores)]
+        _, first = np.unique(ranked, return_index=True)
+        return ranked[np.sort(first)][:shortlist]
+
+    def face_card(self, i):
+        """
+        One face as a deck_clip.pkl card.
+        """
+        a0, a1 = self.art_offsets[i], self.art_offsets[i + 1]
+        f0, f1 = self.full_offsets[i], self.full_offsets[i + 1]
+        face = self.faces[i]
+        return {
+            "name_en": face["name_en"],
+            "front": {
+                "image": face["image"],
+                "art": {
+                    "clip_feats": np.asarray(self.art[self.art_rows[a0:a1]], dtype=np.float32),
+                    "color_hist": np.array(self.art_hist[i], dtype=np.float32),
+                },
+                "full": {
+                    "clip_feats": np.asarray(self.full[f0:f1], dtype=np.float32),
+                    "color_hist": np.array(self.full_hist[i], dtype=np.float32),
+                },
+            },
+            "back": None,
+        }
+
+    def search(
+        self,
+        query_art_clip_feat,
+        query_art_img,
+        query_full_clip_feat,
+        query_full_img,
+        topk=10,
+        nprobe=NPROBE,
+        shortlist=SHORTLIST,
+        **weights,
+    ):
+        """
+        Same arguments and result as search_clip_with_color, over the
+        whole collection.
+        """
+        q = query_art_clip_feat / np.linalg.norm(query_art_clip_feat)
+        cards = [self.face_card(i) for i in self.probe(q, nprobe, shortlist)]
+        return search_clip_with_color(
+            query_art_clip_feat=query_art_clip_feat,
+            query_art_img=query_art_img,
+            query_full_clip_feat=query_full_clip_feat,
+            query_full_img=query_full_img,
+            deck=cards,
+            topk=topk,
+            **weights,
+        )
+
+
+# =========================
+# Recall check
+# =========================
+
+def evaluate(index: CollectionIndex, queries=200, nprobe=NPROBE, log_fn=print) -> dict:
+    """
+    Use stored augmented art vectors as queries and compare the IVF
+    top-1 face with the exact (full scan) top-1 face.
+    """
+    rng = np.random.default_rng(0)
+    rows = rng.choice(len(index.art), min(queries, len(index.art)), replace=False)
+
+    hits = 0
+    seconds = {"ivf": 0.0, "exact": 0.0}
+    for row in rows:
+        q = np.asarray(index.art[row], dtype=np.float32)
+        q /= np.linalg.norm(q)
+
+        start = time.perf_counter()
+        ids = index.probe(q, nprobe, shortlist=1)
+        seconds["ivf"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        scores = np.empty(len(index.art), dtype=np.float32)
+        for s in range(0, len(index.art), ASSIGN_BLOCK):
+            block = np.asarray(index.art[s:s + ASSIGN_BLOCK], dtype=np.float32)
+            scores[s:s + len(block)] = block @ q
+        exact = index.art_face[int(np.argmax(scores))]
+        seconds["exact"] += time.perf_counter() - start
+
+        hits += len(ids) > 0 and ids[0] == exact
+
+    n = max(1, len(rows))
+    report = {
+        "queries": len(rows),
+        "recall_at_1": hits / n,
+        "ivf_ms": seconds["ivf"] / n * 1000.0,
+        "exact_ms": seconds["exact"] / n * 1000.0,
+    }
+    log_fn(
+        f"[REPORT] nprobe={nprobe}/{len(index.centroids)} "
+        f"recall@1={report['recall_at_1']:.3f} "
+        f"ivf={report['ivf_ms']:.2f}ms exact={report['exact_ms']:.2f}ms"
+    )
+    return report
+
+
+# -------------------------
+# Entry point
+# -------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collection-wide card recognition index")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build")
+    build.add_argument("--corpus", type=Path, default=None, help="imported card image folder")
+    build.add_argument("--nlist", type=int, default=None, help="number of IVF lists")
+    build.add_argument("--no-extract", action="store_true", help="only index faces already in the feature store")
+    ev = sub.add_parser("eval")
+    ev.add_argument("--queries", type=int, default=200)
+    ev.add_argument("--nprobe", type=int, default=NPROBE)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_collection_index(
+            corpus_dir=args.corpus, nlist=args.nlist, extract=not args.no_extract
+        )
+    else:
+        evaluate(CollectionIndex(), args.queries, args.nprobe)
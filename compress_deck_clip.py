@@ -0,0 +1,218 @@
+# compress_deck_clip.py
+"""
+Prototype compression of the augmented CLIP features.
+
+Each face region stores 1 base + AUG_N augmented CLIP vectors. They are
+reduced to k spherical k-means centroids ("prototypes"), stored with a
+coverage metric (mean cosine of every original vector to its nearest
+prototype) in a separate, much smaller feature file.
+
+Usage:
+    python compress_deck_clip.py deck.csv [--k 8] [--eval N]
+"""
+import argparse
+import pickle
+import time
+from pathlib import Path
+
+import numpy as np
+
+PROTOTYPE_K = 8
+
+
+def spherical_kmeans(feats, k, iters=20, seed=0):
+    """
+    k-means on the unit sphere (cosine similarity).
+    The first (base, non-augmented) vector is always an initial center.
+    Returns (centers (k, D), assign (N,)).
+    """
+    X = np.asarray(feats, dtype=np.float32)
+    X = X / np.linalg.norm(X, axis=1, keepdims=True)
+    k = min(k, len(X))
+    rng = np.random.default_rng(seed)
+
+    # ---- k-means++ initialization ----
+    centers = [X[0]]
+    for _ in range(1, k):
+        sim = np.max(X @ np.stack(centers).T, axis=1)
+        dist = np.clip(1.0 - sim, 0.0, None) ** 2
+        if dist.sum() <= 0:
+            break
+        centers.append(X[rng.choice(len(X), p=dist / dist.sum())])
+    C = np.stack(centers)
+
+    for _ in range(iters):
+        assign = np.argmax(X @ C.T, axis=1)
+        new_C = C.copy()
+        for j in range(len(C)):
+            members = X[assign == j]
+            if len(members):
+                m = members.sum(axis=0)
+                new_C[j] = m / np.linalg.norm(m)
+        if np.allclose(new_C, C):
+            break
+        C = new_C
+
+    assign = np.argmax(X @ C.T, axis=1)
+    return C, assign
+
+
+def compress_region(region, k=PROTOTYPE_K):
+    feats = region.get("clip_feats")
+    if feats is None:
+        return None
+    if len(feats) == 0:
+        # Region not used by the scoring weights
+        return {"prototypes": [], "coverage": None, "color_hist": region.get("color_hist")}
+
+    X = np.asarray(feats, dtype=np.float32)
+    X = X / np.linalg.norm(X, axis=1, keepdims=True)
+    C, _ = spherical_kmeans(X, k)
+
+    return {
+        "prototypes": C.astype(np.float32),
+        "coverage": float(np.max(X @ C.T, axis=1).mean()),
+        "color_hist": region.get("color_hist"),
+    }
+
+
+def compress_deck(cards, k=PROTOTYPE_K):
+    """
+    Same structure as deck_clip.pkl with "clip_feats" replaced by
+    "prototypes" + "coverage" per face region.
+    """
+    out = []
+    for card in cards:
+        new_card = {"name_en": card["name_en"], "front": None, "back": None}
+        for side in ("front", "back"):
+            face = card.get(side)
+            if not face:
+                continue
+            art = compress_region(face["art"], k)
+            full = compress_region(face["full"], k)
+            if art and full:
+                new_card[side] = {"image": face["image"], "art": art, "full": full}
+        out.append(new_card)
+    return out
+
+
+def coverage_summary(proto_cards):
+    covs = []
+    for card in proto_cards:
+        for side in ("front", "back"):
+            face = card.get(side)
+            if face:
+                covs.extend(
+                    face[r]["coverage"] for r in ("art", "full")
+                    if face[r]["coverage"] is not None
+                )
+    if not covs:
+        return 0.0, 0.0
+    return float(np.mean(covs)), float(np.min(covs))
+
+
+def prototype_path(deck_dir: Path, k=PROTOTYPE_K) -> Path:
+    from build_deck_clip import clip_feature_paths
+    out_path, _ = clip_feature_paths(deck_dir)
+    return out_path.with_name(f"{out_path.stem}_proto{k}.pkl")
+
+
+def write_prototypes(deck_dir: Path, cards, k=PROTOTYPE_K, log_fn=print):
+    proto_cards = compress_deck(cards, k)
+    path = prototype_path(deck_dir, k)
+    with open(path, "wb") as f:
+        pickle.dump(proto_cards, f)
+
+    mean_cov, min_cov = coverage_summary(proto_cards)
+    log_fn(
+        f"[OK] prototypes saved: {path.name} (k={k}) "
+        f"coverage mean={mean_cov:.4f} min={min_cov:.4f}"
+    )
+    return proto_cards
+
+
+# =========================
+# Accuracy impact
+# =========================
+
+def evaluate(csv_path: Path, cards, proto_cards, queries_per_face=3, log_fn=print):
+    """
+    Recognize fresh augmentations of every face with the full feature
+    set and with the prototypes, and compare.
+    """
+    from clip_model import extract_image_feature
+    from clip_quant_eval import load_faces
+    from image_utils import crop_art_region, augment_image, search_clip_with_color
+
+    total = agree = 0
+    correct = {"full": 0, "proto": 0}
+    seconds = {"full": 0.0, "proto": 0.0}
+
+    for name, _, img in load_faces(csv_path):
+        for _ in range(queries_per_face):
+            query = augment_image(img)
+            art = np.ascontiguousarray(crop_art_region(query))
+            art_feat = extract_image_feature(art)
+            full_feat = extract_image_feature(query)
+
+            preds = {}
+            for mode, deck in (("full", cards), ("proto", proto_cards)):
+                start = time.perf_counter()
+                res = search_clip_with_color(
+                    query_art_clip_feat=art_feat,
+                    query_art_img=art,
+                    query_full_clip_feat=full_feat,
+                    query_full_img=query,
+                    deck=deck,
+                    use_prototypes=mode == "proto",
+                )
+                seconds[mode] += time.perf_counter() - start
+                preds[mode] = res["best"]["card"]["name_en"]
+                correct[mode] += preds[mode] == name
+
+            agree += preds["full"] == preds["proto"]
+            total += 1
+
+    total = max(1, total)
+    report = {
+        "queries": total,
+        "agreement": agree / total,
+        "full_acc": correct["full"] / total,
+        "proto_acc": correct["proto"] / total,
+        "full_search_ms": seconds["full"] / total * 1000.0,
+        "proto_search_ms": seconds["proto"] / total * 1000.0,
+    }
+    log_fn(
+        f"[REPORT] agreement={report['agreement']:.3f} "
+        f"full acc={report['full_acc']:.3f} "
+        f"proto acc={report['proto_acc']:.3f} "
+        f"search full={report['full_search_ms']:.2f}ms "
+        f"proto={report['proto_search_ms']:.2f}ms"
+    )
+    return report
+
+
+# -------------------------
+# Entry point
+# -------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compress deck CLIP features into prototypes")
+    parser.add_argument("csv_path", type=Path)
+    parser.add_argument("--k", type=int, default=PROTOTYPE_K)
+    parser.add_argument("--eval", type=int, default=0, help="augmented queries per face for the accuracy report")
+    args = parser.parse_args()
+
+    from build_deck_clip import clip_feature_paths
+    deck_dir = args.csv_path.parent
+    full_path, _ = clip_feature_paths(deck_dir)
+    with open(full_path, "rb") as f:
+        cards = pickle.load(f)
+
+    proto_cards = write_prototypes(deck_dir, cards, args.k)
+    print(
+        f"[INFO] file size {full_path.stat().st_size / 1024:.0f} KB → "
+        f"{prototype_path(deck_dir, args.k).stat().st_size / 1024:.0f} KB"
+    )
+
+    if args.eval:
+        evaluate(args.csv_path, cards, proto_cards, args.eval)
@@ -2,4 +2,30 @@ from common_func import exe_dir
 
 APP_VERSION = "3.0.0"
 EMOJI_DIR = exe_dir() / "emojis"
-UI_FONT_SIZE = 18
\ No newline at end of file
+UI_FONT_SIZE = 18
+
+# Inference runtime: "auto" | "onnx" | "torchscript" | "eager"
+INFERENCE_BACKEND = "auto"
+RUNTIME_DIR = exe_dir() / "weights"
+
+# Dynamic INT8 quantization of the CLIP image encoder
+CLIP_QUANTIZE = False
+
+# CLIP backbone: profile ("fast" / "accurate") or model id (see clip_model.CLIP_REGISTRY)
+CLIP_MODEL = "fast"
+
+# In-memory embedding storage for search: "float32" | "float16" | "pq"
+# (anything but float32 also stores CLIP features as float16 in the feature store)
+EMBEDDING_STORAGE = "float32"
+
+# Search scoring weights (see image_utils.ScoringWeights).
+# Features with weight 0 are not built, loaded, encoded nor scored.
+SCORING_WEIGHTS = {
+    "art_clip": 0.8,
+    "art_color": 0.10,
+    "full_clip": 0.00,
+    "full_color": 0.10,
+}
+
+# Card detection schedule: "full" | "skip" | "roi" (see detect_scheduler.py)
+DETECT_POLICY = "skip"
@@ -1,21 +1,76 @@
 # dataset_metric.py
 import pickle
+from pathlib import Path
 import torch
 from torch.utils.data import Dataset
 import torchvision.transforms as T
 import numpy as np
 import cv2
 
+FLAT_SUFFIX = ".u8"
+INDEX_SUFFIX = ".index.npz"
+
+
+def write_flat_images(cards, data_path: Path, index_path: Path):
+    """
+    Store every image of every card in one contiguous uint8 file,
+    indexed by byte offsets and shapes.
+    """
+    offsets, shapes, labels = [], [], []
+    pos = 0
+
+    with open(data_path, "wb") as f:
+        for label, card in enumerate(cards):
+            for img in card["images"]:
+                img = np.ascontiguousarray(img, dtype=np.uint8)
+                f.write(img.tobytes())
+                offsets.append(pos)
+                shapes.append(img.shape)
+                labels.append(label)
+                pos += img.nbytes
+
+    np.savez(
+        index_path,
+        offsets=np.asarray(offsets, dtype=np.int64),
+        shapes=np.asarray(shapes, dtype=np.int32).reshape(-1, 3),
+        labels=np.asarray(labels, dtype=np.int64),
+        class_names=np.asarray([card["name_en"] for card in cards]),
+    )
+
 
 class MetricCardDataset(Dataset):
+    """
+    Images live in a memory-mapped file next to the pkl, so DataLoader
+    workers share the OS page cache instead of each holding a copy.
+    The file is (re)written from the pkl when that is newer; datasets
+    written directly with write_flat_images have no pkl.
+    """
+
     def __init__(self, pkl_path, image_size=256):
-        with open(pkl_path, "rb") as f:
-            self.cards = pickle.load(f)
+        pkl_path = Path(pkl_path)
+        self.data_path = pkl_path.with_suffix(FLAT_SUFFIX)
+        index_path = pkl_path.with_suffix(INDEX_SUFFIX)
 
-        self.samples = []
-        for label, card in enumerate(self.cards):
-            for img in card["images"]:
-                self.samples.append((img, label))
+        # Without a pkl the flat file is the dataset itself
+        stale = pkl_path.exists() and (
+            not self.data_path.exists()
+            or not index_path.exists()
+            or index_path.stat().st_mtime < pkl_path.stat().st_mtime
+        )
+        if stale:
+            with open(pkl_path, "rb") as f:
+                cards = pickle.load(f)
+            write_flat_images(cards, self.data_path, index_path)
+            del cards
+
+        with np.load(index_path) as index:
+            self.offsets = index["offsets"]
+            self.shapes = index["shapes"]
+            self.labels = index["labels"]
+            self.class_names = [str(n) for n in index["class_names"]]
+
+        # Opened lazily in each worker process
+        self._data = None
 
         self.transform = T.Compose([
             T.ToPILImage(),
@@ -27,13 +82,34 @@ class MetricCardDataset(Dataset):
             )
         ])
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_data"] = None
+        return state
+
+    def data(self):
+        if self._data is None:
+            self._data = np.memmap(self.data_path, dtype=np.uint8, mode="r")
+        return self._data
+
+    def image(self, idx):
+        """
+        Zero-copy view of one image in the memory-mapped file.
+        """
+        start = int(self.offsets[idx])
+        shape = tuple(self.shapes[idx])
+        size = shape[0] * shape[1] * shape[2]
+        return self.data()[start:start + size].reshape(shape)
+
+    def class_indices(self, label):
+        return np.flatnonzero(self.labels == label)
+
     def __len__(self):
-        return len(self.samples)
+        return len(self.offsets)
 
     def __getitem__(self, idx):
-        img, label = self.samples[idx]
-        img = self.transform(img)
-        return img, label
+        img = self.transform(self.image(idx))
+        return img, int(self.labels[idx])
 
 def extract_metric_feature(model, img_rgb, size=320):
     img = cv2.resize(img_rgb, (size, size))
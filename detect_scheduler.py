@@ -0,0 +1,224 @@
+# detect_scheduler.py
+"""
+Detection scheduler for the camera loop.
+
+Full-frame YOLO is the most expensive step per frame. Policies:
+
+    full : full-frame YOLO on every frame (reference)
+    skip : full-frame YOLO every `full_every` frames or on a scene change;
+           in between, boxes are propagated by template matching, and
+           YOLO runs on a padded ROI at a reduced imgsz when a box is
+           lost locally
+    roi  : full-frame YOLO every `full_every` frames, ROI YOLO around
+           the last boxes in between
+
+Each policy keeps its own FPS and per-step timings for tuning.
+"""
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+DETECT_POLICIES = ("full", "skip", "roi")
+
+FULL_EVERY = 5          # frames between full-frame detections
+ROI_PAD = 0.35          # ROI = box padded by this ratio of its size
+ROI_IMGSZ = 320         # YOLO input size on the ROI
+MATCH_TH = 0.6          # template match score to accept a propagated box
+SEARCH_PAD = 0.15       # template search window around the last box
+TEMPLATE_SIDE = 64      # longer side of the (downscaled) template
+SCENE_SIZE = (64, 36)   # thumbnail for scene change detection
+SCENE_TH = 18.0         # mean absolute difference (0-255) = scene change
+FPS_WINDOW = 60
+
+
+def scene_thumb(gray):
+    return cv2.resize(gray, SCENE_SIZE, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+
+class DetectionScheduler:
+    def __init__(
+        self,
+        detect_fn,
+        policy="skip",
+        full_every=FULL_EVERY,
+        roi_pad=ROI_PAD,
+        roi_imgsz=ROI_IMGSZ,
+        match_th=MATCH_TH,
+        scene_th=SCENE_TH,
+    ):
+        """
+        detect_fn(frame, imgsz=None) -> [(x1, y1, x2, y2, conf)]
+        """
+        self.detect_fn = detect_fn
+        self.policy = policy
+        self.full_every = full_every
+        self.roi_pad = roi_pad
+        self.roi_imgsz = roi_imgsz
+        self.match_th = match_th
+        self.scene_th = scene_th
+
+        self.boxes = []
+        self.prev_gray = None
+        self.scene_ref = None
+        self.since_full = 0
+
+        # {kind: [count, seconds]} and {policy: frame timestamps}
+        self.stats = {}
+        self.frame_times = {p: deque(maxlen=FPS_WINDOW) for p in DETECT_POLICIES}
+
+    def set_policy(self, policy):
+        self.policy = policy
+        self.stats = {}
+        self.reset()
+
+    def reset(self):
+        self.boxes = []
+        self.prev_gray = None
+        self.scene_ref = None
+        self.since_full = 0
+
+    # ---------- Steps ----------
+    def _timed(self, kind, fn, *args):
+        start = time.perf_counter()
+        out = fn(*args)
+        entry = self.stats.setdefault(kind, [0, 0.0])
+        entry[0] += 1
+        entry[1] += time.perf_counter() - start
+        return out
+
+    def _full(self, frame, gray):
+        boxes = self._timed("full", self.detect_fn, frame)
+        self.scene_ref = scene_thumb(gray)
+        self.since_full = 0
+        return boxes
+
+    def _roi(self, frame, box):
+        h, w = frame.shape[:2]
+        x1, y1, x2, y2 = box[:4]
+        px, py = int((x2 - x1) * self.roi_pad), int((y2 - y1) * self.roi_pad)
+        rx1, ry1 = max(0, x1 - px), max(0, y1 - py)
+        rx2, ry2 = min(w, x2 + px), min(h, y2 + py)
+        if rx2 <= rx1 or ry2 <= ry1:
+            return []
+
+        roi = np.ascontiguousarray(frame[ry1:ry2, rx1:rx2])
+        found = self._timed("roi", self.detect_fn, roi, self.roi_imgsz)
+        return [
+            (bx1 + rx1, by1 + ry1, bx2 + rx1, by2 + ry1, conf)
+            for bx1, by1, bx2, by2, conf in found
+        ]
+
+    def _propagate_box(self, gray, box):
+        """
+        Shift a box by template matching its previous content in a
+        window around it (on a downscaled image). None when lost.
+        """
+        h, w = gray.shape[:2]
+        x1, y1, x2, y2, conf = box[:5]
+        bw, bh = x2 - x1, y2 - y1
+        if bw <= 4 or bh <= 4:
+            return None
+
+        scale = TEMPLATE_SIDE / max(bw, bh)
+        px, py = int(bw * SEARCH_PAD), int(bh * SEARCH_PAD)
+        sx1, sy1 = max(0, x1 - px), max(0, y1 - py)
+        sx2, sy2 = min(w, x2 + px), min(h, y2 + py)
+
+        template = self.prev_gray[max(0, y1):y2, max(0, x1):x2]
+        window = gray[sy1:sy2, sx1:sx2]
+        if template.size == 0 or window.shape[0] < template.shape[0] or window.shape[1] < template.shape[1]:
+            return None
+
+        template = cv2.resize(template, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        window = cv2.resize(window, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        if window.shape[0] < template.shape[0] or window.shape[1] < template.shape[1]:
+            return None
+
+        result = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, (mx, my) = cv2.minMaxLoc(result)
+        if score < self.match_th:
+            return None
+
+        nx1 = sx1 + int(round(mx / scale))
+        ny1 = sy1 + int(round(my / scale))
+        return (nx1, ny1, nx1 + bw, ny1 + bh, conf)
+
+    def _propagate(self, frame, gray):
+        boxes = []
+        for box in self.boxes:
+            moved = self._timed("propagate", self._propagate_box, gray, box)
+            if moved is None:
+                # Lost locally: detect again around the last position
+                found = self._roi(frame, box)
+                if not found:
+                    return None
+                moved = max(found, key=lambda b: b[4])
+            boxes.append(moved)
+        return boxes
+
+    def scene_changed(self, gray) -> bool:
+        if self.scene_ref is None:
+            return True
+        diff = np.abs(scene_thumb(gray) - self.scene_ref).mean()
+        return diff > self.scene_th
+
+    # ---------- Entry ----------
+    def detect(self, frame):
+        """
+        Boxes [(x1, y1, x2, y2, conf)] for this frame according to the
+        policy.
+        """
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        self.since_full += 1
+
+        due = (
+            self.policy == "full"
+            or self.prev_gray is None
+            or self.since_full >= self.full_every
+            or self.scene_changed(gray)
+        )
+
+        boxes = None
+        if not due and self.boxes:
+            if self.policy == "skip":
+                boxes = self._propagate(frame, gray)
+            else:
+                boxes = []
+                for box in self.boxes:
+                    found = self._roi(frame, box)
+                    if found:
+                        boxes.append(max(found, key=lambda b: b[4]))
+                boxes = boxes or None
+        elif not due:
+            # Nothing to follow and the scene is unchanged
+            boxes = []
+
+        if boxes is None:
+            boxes = self._full(frame, gray)
+
+        self.boxes = boxes
+        self.prev_gray = gray
+        return boxes
+
+    # ---------- Readouts ----------
+    def frame_done(self, now=None):
+        self.frame_times[self.policy].append(now or time.perf_counter())
+
+    def fps(self, policy=None):
+        times = self.frame_times[policy or self.policy]
+        if len(times) < 2 or times[-1] <= times[0]:
+            return 0.0
+        return (len(times) - 1) / (times[-1] - times[0])
+
+    def readout(self) -> str:
+        parts = [f"detect:{self.policy} {self.fps():.1f}fps"]
+        for kind, (count, seconds) in sorted(self.stats.items()):
+            parts.append(f"{kind}:{count} {seconds / count * 1000.0:.1f}ms")
+        others = [
+            f"{p}:{self.fps(p):.1f}fps"
+            for p in DETECT_POLICIES
+            if p != self.policy and len(self.frame_times[p]) > 1
+        ]
+        return " ".join(parts + others)
@@ -0,0 +1,223 @@
+# distill_metric.py
+from pathlib import Path
+import json
+import time
+from datetime import datetime
+
+import torch
+import torch.nn.functional as F
+import torch.optim as optim
+from torch.utils.data import DataLoader, Dataset
+
+from dataset_metric import MetricCardDataset
+from model_metric import ConvNeXtEmbed, StudentEmbed
+from train_metric import MODEL_PATH_NAME, default_num_workers
+
+STUDENT_PATH_NAME = "metric_student.pth"
+STUDENT_REPORT_NAME = "metric_student_report.json"
+
+TEACHER_IMAGE_SIZE = 320
+STUDENT_IMAGE_SIZE = 160
+EMBED_DIM = 256
+RERANK_K = 5
+
+
+class IndexedDataset(Dataset):
+    """
+    Returns (image, sample index) so teacher targets can be looked up.
+    """
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
+        img, _ = self.dataset[idx]
+        return img, idx
+
+
+def student_is_stale(deck_dir: Path) -> bool:
+    model_path = deck_dir / MODEL_PATH_NAME
+    student_path = deck_dir / STUDENT_PATH_NAME
+    if not model_path.exists():
+        return False
+    if not student_path.exists():
+        return True
+    return student_path.stat().st_mtime < model_path.stat().st_mtime
+
+
+def to_student_input(imgs, size=STUDENT_IMAGE_SIZE):
+    return F.interpolate(
+        imgs, size=(size, size), mode="bilinear",
+        align_corners=False, antialias=True
+    )
+
+
+def embed_all(model, loader, device, size=None):
+    model.eval()
+    feats = torch.empty(len(loader.dataset), EMBED_DIM)
+    with torch.no_grad():
+        for imgs, idx in loader:
+            imgs = imgs.to(device)
+            if size is not None:
+                imgs = to_student_input(imgs, size)
+            feats[idx] = model(imgs).cpu()
+    return feats
+
+
+def class_gallery(feats, labels, num_classes):
+    gallery = torch.zeros(num_classes, feats.shape[1])
+    gallery.index_add_(0, labels, feats)
+    return F.normalize(gallery, dim=1)
+
+
+def time_forward(model, size, device, runs=10):
+    """
+    Mean single-image latency in milliseconds.
+    """
+    model.eval()
+    x = torch.randn(1, 3, size, size, device=device)
+    with torch.no_grad():
+        model(x)
+        start = time.perf_counter()
+        for _ in range(runs):
+            model(x)
+    return (time.perf_counter() - start) / runs * 1000.0
+
+
+def agreement_report(teacher_feats, student_feats, labels, num_classes, k=RERANK_K):
+    """
+    Compare student and teacher decisions on every deck image.
+    rerank_agreement mirrors CameraWindow: the student picks among the
+    teacher's top-k candidates.
+    """
+    t_gallery = class_gallery(teacher_feats, labels, num_classes)
+    s_gallery = class_gallery(student_feats, labels, num_classes)
+
+    t_scores = teacher_feats @ t_gallery.T
+    s_scores = student_feats @ s_gallery.T
+
+    t_pred = t_scores.argmax(dim=1)
+    s_pred = s_scores.argmax(dim=1)
+
+    k = min(k, num_classes)
+    t_topk = t_scores.topk(k, dim=1).indices
+    s_rerank = t_topk.gather(1, s_scores.gather(1, t_topk).argmax(dim=1, keepdim=True))[:, 0]
+
+    return {
+        "samples": int(len(labels)),
+        "top1_agreement": float((t_pred == s_pred).float().mean()),
+        "rerank_agreement": float((t_pred == s_rerank).float().mean()),
+        "teacher_acc": float((t_pred == labels).float().mean()),
+        "student_acc": float((s_pred == labels).float().mean()),
+        "embedding_cosine": float((teacher_feats * student_feats).sum(dim=1).mean()),
+    }
+
+
+def distill_metric(
+    csv_path: Path,
+    epochs=10,
+    batch_size=64,
+    log_fn=print,
+    should_stop=None,
+    num_workers=None,
+):
+    """
+    Train StudentEmbed to reproduce the ConvNeXtEmbed embeddings of the
+    deck's art crops (cosine loss), then write a teacher/student report.
+
+    Returns:
+        True  -> student saved
+        False -> cancelled
+    """
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    deck_dir = csv_path.parent
+
+    dataset = MetricCardDataset(deck_dir / "deck_metric.pkl", image_size=TEACHER_IMAGE_SIZE)
+    labels = torch.from_numpy(dataset.labels)
+    num_classes = len(dataset.class_names)
+
+    if num_workers is None:
+        num_workers = default_num_workers()
+    indexed = IndexedDataset(dataset)
+    eval_loader = DataLoader(indexed, batch_size=batch_size, num_workers=num_workers)
+    train_loader = DataLoader(
+        indexed,
+        batch_size=batch_size,
+        shuffle=True,
+        num_workers=num_workers,
+        drop_last=len(indexed) > batch_size
+    )
+
+    # ---------- Teacher targets ----------
+    teacher = ConvNeXtEmbed(embed_dim=EMBED_DIM).to(device)
+    teacher.load_state_dict(
+        torch.load(deck_dir / MODEL_PATH_NAME, map_location=device, weights_only=True)
+    )
+    log_fn("[INFO] computing teacher embeddings...")
+    teacher_feats = embed_all(teacher, eval_loader, device)
+
+    # ---------- Student ----------
+    student = StudentEmbed(embed_dim=EMBED_DIM).to(device)
+    optimizer = optim.AdamW(student.parameters(), lr=1e-3, weight_decay=1e-4)
+
+    start_time = time.time()
+    now = datetime.now().strftime("%H:%M:%S")
+    log_fn(f"[INFO] [{now}] Start distillation for {epochs} epochs")
+    for epoch in range(1, epochs + 1):
+        student.train()
+        total_loss = 0.0
+
+        for imgs, idx in train_loader:
+            if should_stop is not None and should_stop():
+                log_fn(f"[INFO] distillation cancelled at epoch {epoch}")
+                return False
+
+            imgs = to_student_input(imgs.to(device))
+            target = teacher_feats[idx].to(device)
+
+            emb = student(imgs)
+            loss = (1.0 - (emb * target).sum(dim=1)).mean()
+
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+
+            total_loss += loss.item()
+
+        avg_loss = total_loss / max(1, len(train_loader))
+        elapsed = time.time() - start_time
+        now = datetime.now().strftime("%H:%M:%S")
+        log_fn(
+            f"[INFO] [{now}] "
+            f"[Distill {epoch:03d}] "
+            f"loss={avg_loss:.4f} "
+            f"total elapsed time={elapsed:.1f}s"
+        )
+
+    # ---------- Report ----------
+    student_feats = embed_all(student, eval_loader, device, size=STUDENT_IMAGE_SIZE)
+    report = agreement_report(teacher_feats, student_feats, labels, num_classes)
+    report["teacher_ms"] = time_forward(teacher, TEACHER_IMAGE_SIZE, device)
+    report["student_ms"] = time_forward(student, STUDENT_IMAGE_SIZE, device)
+
+    log_fn(
+        f"[REPORT] rerank agreement={report['rerank_agreement']:.3f} "
+        f"top1 agreement={report['top1_agreement']:.3f} "
+        f"teacher acc={report['teacher_acc']:.3f} "
+        f"student acc={report['student_acc']:.3f}"
+    )
+    log_fn(
+        f"[REPORT] latency teacher={report['teacher_ms']:.1f}ms "
+        f"student={report['student_ms']:.1f}ms"
+    )
+
+    out = deck_dir / STUDENT_PATH_NAME
+    torch.save(student.state_dict(), out)
+    (deck_dir / STUDENT_REPORT_NAME).write_text(
+        json.dumps(report, indent=2), encoding="utf-8"
+    )
+    log_fn(f"[OK] student saved: {out}")
+
+    return True
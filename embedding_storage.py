@@ -0,0 +1,170 @@
+# embedding_storage.py
+"""
+Compact in-memory storage for normalized embedding matrices.
+
+    float32  : reference
+    float16  : half the memory, scored in blocks upcast to float32
+    pq       : product quantization (uint8 codes, 1/4..1/16 of float16),
+               scored with asymmetric distance computation (ADC): the query
+               stays in float32, the database stays compressed
+
+All storages score inner products (= cosine similarity for normalized
+vectors) for a query vector (D,) or a query batch (B, D).
+"""
+import numpy as np
+
+STORAGE_KINDS = ("float32", "float16", "pq")
+
+# Rows upcast at once when scoring float16 (fits in L2 cache)
+FLOAT16_BLOCK = 4096
+
+
+def normalize_rows(X):
+    X = np.asarray(X, dtype=np.float32)
+    return X / np.linalg.norm(X, axis=-1, keepdims=True)
+
+
+class Float32Storage:
+    kind = "float32"
+
+    def __init__(self, X):
+        self.data = np.ascontiguousarray(X, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def scores(self, Q):
+        return np.asarray(Q, dtype=np.float32) @ self.data.T
+
+    def decode(self):
+        return self.data
+
+
+class Float16Storage:
+    kind = "float16"
+
+    def __init__(self, X):
+        self.data = np.ascontiguousarray(X, dtype=np.float16)
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def scores(self, Q):
+        Q = np.asarray(Q, dtype=np.float32)
+        out = np.empty(Q.shape[:-1] + (len(self.data),), dtype=np.float32)
+        for start in range(0, len(self.data), FLOAT16_BLOCK):
+            block = self.data[start:start + FLOAT16_BLOCK].astype(np.float32)
+            out[..., start:start + len(block)] = Q @ block.T
+        return out
+
+    def decode(self):
+        return self.data.astype(np.float32)
+
+
+def kmeans(X, k, iters=10, seed=0):
+    """
+    Plain Lloyd k-means (squared L2). Returns centroids (k, d).
+    """
+    rng = np.random.default_rng(seed)
+    k = min(k, len(X))
+    C = X[rng.choice(len(X), k, replace=False)].copy()
+
+    for _ in range(iters):
+        # argmin ||x - c||^2 = argmax (x.c - |c|^2 / 2)
+        assign = np.argmax(X @ C.T - 0.5 * (C ** 2).sum(axis=1), axis=1)
+        sums = np.zeros_like(C)
+        np.add.at(sums, assign, X)
+        counts = np.bincount(assign, minlength=k)
+        filled = counts > 0
+        C[filled] = sums[filled] / counts[filled, None]
+
+    return C
+
+
+class PQStorage:
+    """
+    Product quantizer: D dims are split into m subspaces, each encoded by
+    the index of its nearest of ks centroids (uint8).
+    """
+    kind = "pq"
+
+    def __init__(self, X, m=32, ks=256, iters=10, train_size=20000, seed=0, codebooks=None):
+        X = np.asarray(X, dtype=np.float32)
+        n, d = X.shape
+        if d % m != 0:
+            raise ValueError(f"dim {d} is not divisible by m={m}")
+
+        self.m = m
+        self.dsub = d // m
+
+        if codebooks is None:
+            rng = np.random.default_rng(seed)
+            train = X if n <= train_size else X[rng.choice(n, train_size, replace=False)]
+            codebooks = np.stack([
+                self._pad(kmeans(self._sub(train, j), ks, iters, seed + j), ks)
+                for j in range(m)
+            ])
+        self.codebooks = codebooks.astype(np.float32)  # (m, ks, dsub)
+        self.codes = self.encode(X)
+
+    def _sub(self, X, j):
+        return X[:, j * self.dsub:(j + 1) * self.dsub]
+
+    @staticmethod
+    def _pad(C, ks):
+        # Fewer training vectors than centroids: repeat the last centroid
+        if len(C) < ks:
+            C = np.concatenate([C, np.repeat(C[-1:], ks - len(C), axis=0)])
+        return C
+
+    def encode(self, X):
+        codes = np.empty((len(X), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            C = self.codebooks[j]
+            sub = self._sub(X, j)
+            codes[:, j] = np.argmax(sub @ C.T - 0.5 * (C ** 2).sum(axis=1), axis=1)
+        return codes
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.codebooks.nbytes
+
+    def tables(self, Q):
+        """
+        ADC lookup tables: inner product of every query subvector with
+        every centroid -> (B, m, ks).
+        """
+        Q = np.asarray(Q, dtype=np.float32).reshape(-1, self.m, self.dsub)
+        return np.einsum("bmd,mkd->bmk", Q, self.codebooks)
+
+    def scores(self, Q):
+        single = np.ndim(Q) == 1
+        T = self.tables(Q)
+        cols = np.arange(self.m)
+        out = np.stack([t[cols, self.codes].sum(axis=1) for t in T])
+        return out[0] if single else out
+
+    def decode(self):
+        return np.concatenate(
+            [self.codebooks[j][self.codes[:, j]] for j in range(self.m)],
+            axis=1
+        )
+
+
+def make_storage(X, kind="float32", **kwargs):
+    if kind == "float16":
+        return Float16Storage(X)
+    if kind == "pq":
+        return PQStorage(X, **kwargs)
+    return Float32Storage(X)
@@ -0,0 +1,221 @@
+# feature_store.py
+"""
+User-level content-addressed feature store shared by all decks.
+
+Entries are keyed by the SHA-256 of the image file plus a namespace
+describing how the value was computed (model id, preprocessing and
+augmentation config), so the same card image in many decks is processed
+only once. The store is size-bounded with LRU eviction (file mtime is
+the access time).
+
+Large entries (the augmented art crops of metric training) live in a
+separate store with its own quota, so they never evict the small CLIP
+features.
+
+Usage:
+    python feature_store.py stats [--store metric]
+    python feature_store.py compact [--store metric] [--max-mb N] [--drop NAMESPACE_PREFIX ...]
+"""
+import argparse
+import hashlib
+import os
+import pickle
+from pathlib import Path
+
+from common_func import exe_dir
+
+STORE_DIR = exe_dir() / "feature_store"
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+# name -> (root, max bytes)
+STORES = {
+    "features": (STORE_DIR, DEFAULT_MAX_BYTES),
+    "metric": (exe_dir() / "feature_store_metric", 4 * 1024 ** 3),
+}
+
+# After eviction the store is trimmed to this ratio of max_bytes
+EVICT_TARGET_RATIO = 0.9
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(8192), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class FeatureStore:
+    def __init__(self, root: Path = STORE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._size = None
+
+    # ---------- Keys ----------
+    def key(self, image_sha256: str, namespace: str) -> str:
+        return hashlib.sha256(f"{image_sha256}:{namespace}".encode("utf-8")).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.pkl"
+
+    # ---------- Access ----------
+    def get(self, image_sha256: str, namespace: str):
+        path = self.path(self.key(image_sha256, namespace))
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Broken entry (e.g. interrupted write of an old version)
+            path.unlink(missing_ok=True)
+            return None
+
+        # LRU: mark as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        if value.get("namespace") != namespace:
+            return None
+        return value["data"]
+
+    def put(self, image_sha256: str, namespace: str, data):
+        path = self.path(self.key(image_sha256, namespace))
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Size before the write; an overwritten entry no longer counts
+        size = self.total_size()
+        try:
+            size -= path.stat().st_size
+        except FileNotFoundError:
+            pass
+
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump({"namespace": namespace, "data": data}, f)
+        tmp.replace(path)
+
+        self._size = size + path.stat().st_size
+        if self._size > self.max_bytes:
+            self.evict()
+
+    # ---------- Maintenance ----------
+    def entries(self):
+        """
+        [(path, size, mtime)] of all entries.
+        """
+        if not self.root.exists():
+            return []
+        out = []
+        for path in self.root.glob("*/*.pkl"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            out.append((path, st.st_size, st.st_mtime))
+        return out
+
+    def total_size(self) -> int:
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self.entries())
+        return self._size
+
+    def evict(self, max_bytes=None) -> int:
+        """
+        Remove least recently used entries until the store fits.
+        Returns the number of removed entries.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        target = max_bytes * EVICT_TARGET_RATIO
+
+        removed = 0
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+
+        self._size = total
+        return removed
+
+    def compact(self, max_bytes=None, drop_prefixes=(), log_fn=print):
+        """
+        Remove leftovers of interrupted writes, broken entries and entries
+        of dropped namespaces, then evict down to the size bound.
+        """
+        if not self.root.exists():
+            log_fn("[INFO] feature store is empty")
+            return
+
+        for tmp in self.root.glob("*/*.tmp"):
+            tmp.unlink(missing_ok=True)
+
+        dropped = broken = 0
+        for path, _, _ in self.entries():
+            try:
+                with open(path, "rb") as f:
+                    namespace = pickle.load(f)["namespace"]
+            except Exception:
+                path.unlink(missing_ok=True)
+                broken += 1
+                continue
+            if any(namespace.startswith(p) for p in drop_prefixes):
+                path.unlink(missing_ok=True)
+                dropped += 1
+
+        self._size = None
+        evicted = self.evict(max_bytes)
+
+        for shard in self.root.iterdir():
+            if shard.is_dir() and not any(shard.iterdir()):
+                shard.rmdir()
+
+        log_fn(
+            f"[OK] feature store compacted: {broken} broken, {dropped} dropped, "
+            f"{evicted} evicted, {self.total_size() / 1024 ** 2:.1f} MB left"
+        )
+
+    def stats(self, log_fn=print):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        log_fn(
+            f"[INFO] feature store: {self.root} "
+            f"{len(entries)} entries, {total / 1024 ** 2:.1f} MB "
+            f"(limit {self.max_bytes / 1024 ** 2:.0f} MB)"
+        )
+
+
+_stores = {}
+
+
+def get_store(name="features") -> FeatureStore:
+    if name not in _stores:
+        root, max_bytes = STORES[name]
+        _stores[name] = FeatureStore(root, max_bytes)
+    return _stores[name]
+
+
+# -------------------------
+# Entry point
+# -------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Global feature store maintenance")
+    parser.add_argument("--store", choices=list(STORES), default="features")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats")
+    compact = sub.add_parser("compact")
+    compact.add_argument("--max-mb", type=int, default=None)
+    compact.add_argument("--drop", nargs="*", default=[], help="namespace prefixes to remove")
+    args = parser.parse_args()
+
+    store = get_store(args.store)
+    if args.command == "stats":
+        store.stats()
+    else:
+        max_bytes = args.max_mb * 1024 ** 2 if args.max_mb is not None else None
+        store.compact(max_bytes, args.drop)
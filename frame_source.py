@@ -0,0 +1,457 @@
+# frame_source.py
+"""
+Frame sources for the camera loop.
+
+    camera    : live camera (cv2.VideoCapture)
+    video     : video file
+    folder    : directory of images, in name order
+    synthetic : deck images rendered on a table with random placement,
+                rotation and lighting (the ground-truth card names of the
+                current frame are in `truth`)
+
+LatestFrameSource reads a live camera on its own thread and only hands
+out the most recent frame, so frames never queue up behind a slow
+processing loop.
+
+Every source has the read() -> (ok, BGR frame) interface of
+cv2.VideoCapture. Replay sources either follow the wall clock at their
+frame rate (real time: frames are dropped when processing is slower,
+like a live camera) or return every frame as fast as they are read
+(throughput measurement).
+
+Usage (headless replay throughput):
+    python frame_source.py video.mp4 | image_dir | synthetic --csv deck.csv [--fast]
+"""
+import argparse
+import csv
+import random
+import threading
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+FRAME_SOURCES = ("camera", "video", "folder", "synthetic")
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+CAMERA_POLL_MS = 30     # timer interval for live cameras
+LATEST_POLL_MS = 5      # timer interval when a capture thread delivers frames
+FOLDER_FPS = 10.0       # replay rate of image folders
+SYNTH_FPS = 30.0
+SYNTH_SIZE = (1280, 720)
+SYNTH_HOLD = 45         # frames per synthetic layout (cards stay put meanwhile)
+SYNTH_ROTATE = 12.0     # max deviation (deg) from the upside-down camera view
+SYNTH_NOISE = 4.0       # per-frame sensor noise (std, 0-255)
+NOISE_BANK = 8          # pre-rendered noise fields, cycled per frame
+
+
+def imread_any(path):
+    # Non-ASCII paths (cv2.imread cannot open them on Windows)
+    data = np.fromfile(str(path), dtype=np.uint8)
+    return cv2.imdecode(data, cv2.IMREAD_COLOR)
+
+
+def load_deck_faces(csv_path):
+    """
+    [(name_en, BGR image)] of every card face of a deck CSV.
+    """
+    deck_dir = Path(csv_path).parent
+    with open(csv_path, encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+
+    faces = []
+    for row in rows:
+        for key in ("card_file_front", "card_file_back"):
+            file = row.get(key)
+            if not file or not (deck_dir / file).exists():
+                continue
+            img = imread_any(deck_dir / file)
+            if img is not None:
+                faces.append((row["name_en"], img))
+    return faces
+
+
+class FrameSource:
+    kind = ""
+    fps = None  # native frame rate; None = live (the device paces itself)
+
+    def __init__(self, realtime=True, loop=False):
+        self.realtime = realtime
+        self.loop = loop
+
+        self.frames = 0     # frames returned
+        self.dropped = 0    # frames skipped to keep up with the wall clock
+        self.started = None
+        self.index = 0      # next frame index of the replay
+
+    def interval_ms(self) -> int:
+        """
+        Timer interval for the camera loop.
+        """
+        if self.fps is None:
+            return CAMERA_POLL_MS
+        return int(1000 / self.fps) if self.realtime else 0
+
+    def read(self):
+        now = time.perf_counter()
+        if self.started is None:
+            self.started = now
+
+        if self.fps is not None and self.realtime:
+            # Skip the frames that were due while the caller was busy
+            due = int((now - self.started) * self.fps)
+            if due > self.index:
+                self.dropped += self.skip(due - self.index)
+
+        ok, frame = self.next_frame()
+        if not ok and self.loop and self.frames:
+            self.rewind()
+            ok, frame = self.next_frame()
+        if ok:
+            self.frames += 1
+        return ok, frame
+
+    def rewind(self):
+        self.index = 0
+        self.started = time.perf_counter()
+
+    def set_realtime(self, realtime):
+        # Restart the wall clock at the current frame
+        self.realtime = realtime
+        if self.started is not None and self.fps:
+            self.started = time.perf_counter() - self.index / self.fps
+
+    def skip(self, n) -> int:
+        self.index += n
+        return n
+
+    def next_frame(self):
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+    def describe(self) -> str:
+        return self.kind
+
+    def report(self) -> str:
+        elapsed = time.perf_counter() - self.started if self.started else 0.0
+        fps = self.frames / elapsed if elapsed > 0 else 0.0
+        return (
+            f"[REPORT] {self.describe()}: {self.frames} frames in {elapsed:.1f}s "
+            f"({fps:.1f} fps, {self.dropped} dropped)"
+        )
+
+
+# =========================
+# Live camera
+# =========================
+
+class CameraSource(FrameSource):
+    kind = "camera"
+
+    def __init__(self, index=0, resolution=None, backend=cv2.CAP_ANY):
+        super().__init__(realtime=True, loop=False)
+        self.camera_index = index
+        self.cap = cv2.VideoCapture(index, backend)
+        if resolution:
+            w, h = resolution
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, w)
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, h)
+
+    def next_frame(self):
+        return self.cap.read()
+
+    def release(self):
+        self.cap.release()
+
+    def describe(self):
+        return f"camera {self.camera_index}"
+
+
+class LatestFrameSource(FrameSource):
+    """
+    Grabs frames of a live source continuously on a thread and keeps
+    only the newest one (with its capture time). read() returns each
+    frame at most once and (False, None) while no new frame arrived;
+    frames replaced before they were read count as dropped.
+    """
+
+    def __init__(self, source):
+        super().__init__(realtime=True, loop=False)
+        self.source = source
+        self.kind = source.kind
+
+        self.frame = None
+        self.frame_time = 0.0   # perf_counter at capture
+        self.read_time = 0.0    # capture time of the last frame handed out
+        self.seq = 0            # frames captured
+        self.read_seq = 0       # last frame handed out
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            ok, frame = self.source.read()
+            if not ok:
+                # Device busy or unplugged: retry
+                time.sleep(0.01)
+                continue
+            now = time.perf_counter()
+            with self._lock:
+                if self.seq > self.read_seq:
+                    self.dropped += 1
+                self.frame = frame
+                self.frame_time = now
+                self.seq += 1
+
+    def interval_ms(self):
+        return LATEST_POLL_MS
+
+    def read(self):
+        with self._lock:
+            if self.seq == self.read_seq:
+                return False, None
+            self.read_seq = self.seq
+            self.read_time = self.frame_time
+            frame = self.frame
+
+        if self.started is None:
+            self.started = time.perf_counter()
+        self.frames += 1
+        return True, frame
+
+    def age(self) -> float:
+        """
+        Seconds since the last handed-out frame was captured.
+        """
+        return time.perf_counter() - self.read_time
+
+    def release(self):
+        self._stop.set()
+        self._thread.join(timeout=1.0)
+        self.source.release()
+
+    def describe(self):
+        return f"{self.source.describe()} (latest frame)"
+
+
+# =========================
+# Replay sources
+# =========================
+
+class VideoFileSource(FrameSource):
+    kind = "video"
+
+    def __init__(self, path, realtime=True, loop=False):
+        super().__init__(realtime, loop)
+        self.path = Path(path)
+        self.cap = cv2.VideoCapture(str(self.path))
+        if not self.cap.isOpened():
+            raise FileNotFoundError(f"cannot open video: {self.path}")
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+
+    def skip(self, n):
+        # grab() skips decoding into an image
+        skipped = 0
+        while skipped < n and self.cap.grab():
+            skipped += 1
+        self.index += skipped
+        return skipped
+
+    def next_frame(self):
+        ok, frame = self.cap.read()
+        if ok:
+            self.index += 1
+        return ok, frame
+
+    def rewind(self):
+        super().rewind()
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def release(self):
+        self.cap.release()
+
+    def describe(self):
+        return f"video {self.path.name}"
+
+
+class ImageFolderSource(FrameSource):
+    kind = "folder"
+
+    def __init__(self, directory, fps=FOLDER_FPS, realtime=True, loop=False):
+        super().__init__(realtime, loop)
+        self.directory = Path(directory)
+        self.files = sorted(
+            p for p in self.directory.iterdir() if p.suffix.lower() in IMAGE_EXTS
+        )
+        if not self.files:
+            raise FileNotFoundError(f"no images in {self.directory}")
+        self.fps = fps
+
+    def next_frame(self):
+        while self.index < len(self.files):
+            frame = imread_any(self.files[self.index])
+            self.index += 1
+            if frame is not None:
+                return True, frame
+        return False, None
+
+    def describe(self):
+        return f"folder {self.directory.name} ({len(self.files)} images)"
+
+
+class SyntheticSource(FrameSource):
+    """
+    Deck cards on a random table. The layout (cards, position, rotation,
+    lighting) changes every `hold` frames; within a layout only sensor
+    noise changes, as with a card held in front of the camera.
+    Cards are rendered upside down like the real camera view.
+    """
+    kind = "synthetic"
+
+    def __init__(
+        self,
+        csv_path,
+        size=SYNTH_SIZE,
+        fps=SYNTH_FPS,
+        hold=SYNTH_HOLD,
+        max_cards=1,
+        frames=None,
+        seed=0,
+        realtime=True,
+        loop=False,
+    ):
+        super().__init__(realtime, loop)
+        self.csv_path = Path(csv_path)
+        self.faces = load_deck_faces(self.csv_path)
+        if not self.faces:
+            raise FileNotFoundError(f"no card images for {self.csv_path}")
+
+        self.size = size
+        self.fps = fps
+        self.hold = hold
+        self.max_cards = max_cards
+        self.length = frames
+        self.seed = seed
+
+        self.truth = []
+        self._layout_id = None
+        self._layout = None
+
+        rng = np.random.default_rng(seed)
+        w, h = size
+        self._noise = [
+            np.round(rng.normal(0.0, SYNTH_NOISE, (h, w, 1))).astype(np.int16)
+            for _ in range(NOISE_BANK)
+        ]
+
+    def render_layout(self, layout_id):
+        """
+        Background and cards of one layout -> (BGR image, card names).
+        """
+        rng = random.Random(self.seed * 1_000_003 + layout_id)
+        w, h = self.size
+
+        # Table: smooth random colour field
+        coarse = np.array(
+            [[[rng.randint(30, 200) for _ in range(3)] for _ in range(4)] for _ in range(3)],
+            dtype=np.uint8,
+        )
+        img = cv2.resize(coarse, (w, h), interpolation=cv2.INTER_CUBIC).astype(np.float32)
+
+        n = rng.randint(1, self.max_cards)
+        names = []
+        slot_w = w / n
+        for k in range(n):
+            name, card = self.faces[rng.randrange(len(self.faces))]
+            names.append(name)
+
+            ch, cw = card.shape[:2]
+            scale = rng.uniform(0.45, 0.85) * min(h / ch, slot_w / cw)
+            cx = slot_w * (k + rng.uniform(0.35, 0.65))
+            cy = h * rng.uniform(0.4, 0.6)
+            angle = 180.0 + rng.uniform(-SYNTH_ROTATE, SYNTH_ROTATE)
+
+            M = cv2.getRotationMatrix2D((cw / 2, ch / 2), angle, scale)
+            M[:, 2] += (cx - cw / 2, cy - ch / 2)
+            warped = cv2.warpAffine(card, M, (w, h), flags=cv2.INTER_LINEAR)
+            mask = cv2.warpAffine(
+                np.ones((ch, cw), np.float32), M, (w, h), flags=cv2.INTER_LINEAR
+            )[..., None]
+            img = img * (1.0 - mask) + warped.astype(np.float32) * mask
+
+        # Lighting: contrast, brightness and a linear light falloff
+        alpha = rng.uniform(0.6, 1.1)
+        beta = rng.uniform(-25, 35)
+        gx, gy = rng.uniform(-0.25, 0.25), rng.uniform(-0.25, 0.25)
+        xs = np.linspace(-0.5, 0.5, w, dtype=np.float32)[None, :]
+        ys = np.linspace(-0.5, 0.5, h, dtype=np.float32)[:, None]
+        shade = (1.0 + gx * xs + gy * ys)[..., None]
+        img = img * alpha * shade + beta
+
+        if rng.random() < 0.3:
+            img = cv2.GaussianBlur(img, (5, 5), 0)
+
+        return np.clip(img, 0, 255).astype(np.int16), names
+
+    def next_frame(self):
+        if self.length is not None and self.index >= self.length:
+            return False, None
+
+        layout_id = self.index // self.hold
+        if layout_id != self._layout_id:
+            self._layout = self.render_layout(layout_id)
+            self._layout_id = layout_id
+
+        base, self.truth = self._layout
+        noise = self._noise[self.index % NOISE_BANK]
+        frame = np.clip(base + noise, 0, 255).astype(np.uint8)
+        self.index += 1
+        return True, frame
+
+    def describe(self):
+        return f"synthetic {self.csv_path.parent.name} ({len(self.faces)} faces)"
+
+
+def open_source(spec, csv_path=None, realtime=True, loop=False, **kwargs):
+    """
+    "synthetic", a video file or an image directory -> replay source.
+    """
+    if spec == "synthetic":
+        if csv_path is None:
+            raise ValueError("synthetic frames need a deck csv")
+        return SyntheticSource(csv_path, realtime=realtime, loop=loop, **kwargs)
+
+    path = Path(spec)
+    if path.is_dir():
+        return ImageFolderSource(path, realtime=realtime, loop=loop)
+    return VideoFileSource(path, realtime=realtime, loop=loop)
+
+
+# -------------------------
+# Entry point
+# -------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a frame source and report its throughput")
+    parser.add_argument("source", help='video file, image directory or "synthetic"')
+    parser.add_argument("--csv", type=Path, help="deck csv (synthetic frames)")
+    parser.add_argument("--fast", action="store_true", help="as fast as possible instead of real time")
+    parser.add_argument("--frames", type=int, default=300, help="synthetic frames to render")
+    parser.add_argument("--cards", type=int, default=1, help="max cards per synthetic frame")
+    args = parser.parse_args()
+
+    extra = {"frames": args.frames, "max_cards": args.cards} if args.source == "synthetic" else {}
+    source = open_source(args.source, args.csv, realtime=not args.fast, **extra)
+    while True:
+        ok, _ = source.read()
+        if not ok:
+            break
+        if source.realtime:
+            time.sleep(source.interval_ms() / 1000.0)
+    print(source.report())
+    source.release()
@@ -0,0 +1,338 @@
+# global_metric.py
+"""
+Deck-independent metric model.
+
+One ConvNeXtEmbed is trained over the union of the card images of all
+local decks (plus an optional image corpus) and stored once per user.
+Each deck is then only a gallery of precomputed embeddings, so adding or
+swapping cards costs one embedding pass per image instead of a training run.
+
+Usage:
+    python global_metric.py [--corpus DIR] [--epochs N]
+"""
+import argparse
+import csv
+import pickle
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+
+from common_func import exe_dir
+from image_utils import crop_art_region, augment_image
+from model_metric import ConvNeXtEmbed
+from build_deck_metric import (
+    AUG_N, imread_utf8, hash_image, compute_deck_fingerprint
+)
+from train_metric import (
+    train_metric, MODEL_PATH_NAME, HASH_PATH_NAME, CHECKPOINT_PATH_NAME
+)
+from dataset_metric import write_flat_images, FLAT_SUFFIX, INDEX_SUFFIX
+from feature_store import get_store
+
+GLOBAL_DIR = exe_dir() / "global_metric"
+GALLERY_PATH_NAME = "deck_metric_gallery.pkl"
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp")
+SKIP_DIRS = {"venv", ".venv", "dist", "build", "__pycache__", ".git"}
+GALLERY_AUG_N = 4
+EMBED_DIM = 256
+INPUT_SIZE = 320
+
+
+# =========================
+# Global dataset
+# =========================
+
+def find_local_decks(root: Path | None = None) -> list[Path]:
+    """
+    Deck CSVs under the application folder (generated decks live in
+    "<name>_images/<name>.csv").
+    """
+    root = root or exe_dir()
+    return sorted(
+        p for p in root.rglob("*.csv")
+        if not p.name.endswith("_consideration.csv")
+        and not SKIP_DIRS.intersection(p.relative_to(root).parts)
+        and GLOBAL_DIR not in p.parents
+    )
+
+
+def iter_deck_images(csv_path: Path):
+    """
+    Yields (name_en, image_path) for every card face of a deck CSV.
+    """
+    deck_dir = csv_path.parent
+    try:
+        with open(csv_path, encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+    except (OSError, UnicodeDecodeError, csv.Error):
+        return
+
+    for row in rows:
+        name = row.get("name_en")
+        if not name:
+            continue
+        for side_key in ("card_file_front", "card_file_back"):
+            file = row.get(side_key)
+            if file and (deck_dir / file).exists():
+                yield name, deck_dir / file
+
+
+def iter_corpus_images(corpus_dir: Path):
+    """
+    Yields (name, image_path) for an imported corpus.
+    The card name is the file stem ("Sol Ring.jpg") or, for nested
+    layouts, the parent folder name ("Sol Ring/001.jpg").
+    """
+    for path in sorted(corpus_dir.rglob("*")):
+        if path.suffix.lower() not in IMAGE_EXTS:
+            continue
+        name = path.parent.name if path.parent != corpus_dir else path.stem
+        yield name, path
+
+
+def load_art(img_path: Path):
+    img = imread_utf8(img_path)
+    if img is None:
+        return None
+
+    art = crop_art_region(img)
+    if art is None or art.size == 0:
+        return None
+
+    art = cv2.cvtColor(art, cv2.COLOR_BGR2RGB)
+    return np.ascontiguousarray(art)
+
+
+def iter_augmented_art(img_paths):
+    """
+    Yields the art crop of every image followed by its AUG_N
+    augmentations, one image at a time.
+    """
+    for img_path in img_paths:
+        art = load_art(img_path)
+        if art is None:
+            continue
+        yield art
+        for _ in range(AUG_N):
+            yield augment_image(art)
+
+
+def process_global_metric(
+    csv_paths: list[Path],
+    corpus_dir: Path | None = None,
+    log_fn=print,
+) -> bool:
+    """
+    Build the GLOBAL_DIR/deck_metric flat image file from the union of
+    all card images. Images are deduplicated by content, classes by card
+    name; only the hashes are kept until the fingerprint has changed.
+
+    Returns:
+        True  -> Data has changed (retraining required)
+        False -> Same as last time (no training needed)
+    """
+    GLOBAL_DIR.mkdir(parents=True, exist_ok=True)
+    hash_path = GLOBAL_DIR / HASH_PATH_NAME
+
+    sources = []
+    for csv_path in csv_paths:
+        sources.extend(iter_deck_images(csv_path))
+    if corpus_dir is not None:
+        sources.extend(iter_corpus_images(corpus_dir))
+
+    card_paths = {}
+    seen = set()
+
+    for name, img_path in sources:
+        art = load_art(img_path)
+        if art is None:
+            continue
+
+        img_hash = hash_image(art)
+        if img_hash in seen:
+            continue
+        seen.add(img_hash)
+        card_paths.setdefault(name, []).append(img_path)
+
+    fingerprint = compute_deck_fingerprint(list(seen))
+    if hash_path.exists() and hash_path.read_text().strip() == fingerprint:
+        # An unfinished training run of the same dataset is resumed
+        if (GLOBAL_DIR / CHECKPOINT_PATH_NAME).exists():
+            log_fn("[INFO] unfinished global metric training found → resume")
+            return True
+        # Interrupted before the first checkpoint: the model is missing
+        # or older than the dataset (the hash is written before training)
+        model_path = GLOBAL_DIR / MODEL_PATH_NAME
+        if not model_path.exists() or model_path.stat().st_mtime < hash_path.stat().st_mtime:
+            log_fn("[INFO] global metric model not trained on this dataset → train")
+            return True
+        log_fn("[INFO] global metric dataset unchanged → skip training")
+        return False
+
+    # Streamed straight into the memory-mapped file MetricCardDataset
+    # reads; no pickle, so the dataset is never rebuilt from one
+    pkl_path = GLOBAL_DIR / "deck_metric.pkl"
+    pkl_path.unlink(missing_ok=True)
+    data_path = pkl_path.with_suffix(FLAT_SUFFIX)
+    cards = [
+        {"name_en": name, "images": iter_augmented_art(paths)}
+        for name, paths in card_paths.items()
+    ]
+    write_flat_images(cards, data_path, pkl_path.with_suffix(INDEX_SUFFIX))
+
+    hash_path.write_text(fingerprint)
+
+    log_fn(
+        f"[OK] global metric dataset saved: {data_path} "
+        f"({len(cards)} cards, {len(seen)} images)"
+    )
+    return True
+
+
+def build_global_metric(
+    corpus_dir: Path | None = None,
+    epochs=30,
+    log_fn=print,
+    should_stop=None,
+) -> bool:
+    csv_paths = find_local_decks()
+    log_fn(f"[INFO] {len(csv_paths)} local decks found")
+
+    changed = process_global_metric(csv_paths, corpus_dir, log_fn=log_fn)
+    if not changed:
+        return True
+
+    return train_metric(
+        None,
+        epochs=epochs,
+        log_fn=log_fn,
+        should_stop=should_stop,
+        work_dir=GLOBAL_DIR,
+    )
+
+
+# =========================
+# Deck gallery
+# =========================
+
+def global_model_available() -> bool:
+    return (GLOBAL_DIR / MODEL_PATH_NAME).exists()
+
+
+def global_model_stamp() -> str:
+    st = (GLOBAL_DIR / MODEL_PATH_NAME).stat()
+    return f"{st.st_mtime_ns}-{st.st_size}"
+
+
+def load_global_model():
+    model = ConvNeXtEmbed(embed_dim=EMBED_DIM)
+    model.load_state_dict(
+        torch.load(GLOBAL_DIR / MODEL_PATH_NAME, map_location="cpu", weights_only=True)
+    )
+    model.eval()
+    return model
+
+
+def embed_art(model, art):
+    """
+    One batched forward pass over the art crop and a few augmentations.
+    """
+    imgs = [art] + [augment_image(art) for _ in range(GALLERY_AUG_N)]
+
+    batch = np.stack([cv2.resize(img, (INPUT_SIZE, INPUT_SIZE)) for img in imgs])
+    x = torch.from_numpy(batch).permute(0, 3, 1, 2).float() / 255.0
+
+    mean = torch.tensor([0.485, 0.456, 0.406])[:, None, None]
+    std  = torch.tensor([0.229, 0.224, 0.225])[:, None, None]
+    x = (x - mean) / std
+
+    with torch.no_grad():
+        feats = model(x).cpu().numpy()
+
+    feat = feats.mean(axis=0)
+    return feat / np.linalg.norm(feat)
+
+
+def build_deck_gallery(csv_path: Path, model=None, log_fn=print) -> list[dict]:
+    """
+    Embed every card of the deck with the global model.
+    Per-image embeddings are cached by content hash, so only new images
+    are processed.
+    Returns the same structure as CameraWindow.metric_features.
+    """
+    deck_dir = csv_path.parent
+    gallery_path = deck_dir / GALLERY_PATH_NAME
+    stamp = global_model_stamp()
+
+    cache = {}
+    if gallery_path.exists():
+        with open(gallery_path, "rb") as f:
+            saved = pickle.load(f)
+        if saved.get("model_stamp") == stamp:
+            cache = saved["entries"]
+
+    model = model or load_global_model()
+    store = get_store()
+    store_ns = f"global_metric_{stamp}_aug{GALLERY_AUG_N}"
+
+    per_card = {}
+    entries = {}
+    computed = 0
+
+    for name, img_path in iter_deck_images(csv_path):
+        art = load_art(img_path)
+        if art is None:
+            continue
+
+        img_hash = hash_image(art)
+        feat = cache.get(img_hash)
+        if feat is None:
+            feat = store.get(img_hash, store_ns)
+        if feat is None:
+            feat = embed_art(model, art)
+            store.put(img_hash, store_ns, feat)
+            computed += 1
+        entries[img_hash] = feat
+        per_card.setdefault(name, []).append(feat)
+
+    gallery = []
+    for name, feats in per_card.items():
+        mean_feat = np.mean(feats, axis=0)
+        mean_feat /= np.linalg.norm(mean_feat)
+        gallery.append({
+            "name_en": name,
+            "metric_feature": mean_feat
+        })
+
+    with open(gallery_path, "wb") as f:
+        pickle.dump({
+            "model_stamp": stamp,
+            "entries": entries,
+            "cards": gallery,
+        }, f)
+
+    log_fn(
+        f"[OK] deck gallery saved: {gallery_path} "
+        f"({len(gallery)} cards, {computed} new embeddings)"
+    )
+    return gallery
+
+
+def load_deck_gallery(csv_path: Path) -> list[dict]:
+    with open(csv_path.parent / GALLERY_PATH_NAME, "rb") as f:
+        return pickle.load(f)["cards"]
+
+
+# -------------------------
+# Entry point
+# -------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the global metric model")
+    parser.add_argument("--corpus", type=Path, default=None, help="imported card image folder")
+    parser.add_argument("--epochs", type=int, default=30)
+    args = parser.parse_args()
+
+    build_global_metric(corpus_dir=args.corpus, epochs=args.epochs)
@@ -2,6 +2,8 @@ import cv2
 import numpy as np
 import random
 
+from embedding_storage import make_storage, normalize_rows
+
 
 def extract_color_hist_hsv(img, bins=(8, 8, 8)):
     """
@@ -41,6 +43,192 @@ def compare_color_hist(h1, h2):
     d = cv2.compareHist(h1, h2, cv2.HISTCMP_BHATTACHARYYA)
     return 1.0 - d   # 1.0 means a perfect match
 
+def hist_matrix(hists):
+    """
+    (sqrt of the histograms (N, B), histogram sums (N,)) for vectorized
+    Bhattacharyya scoring. Missing histograms (None) get a zero sum.
+    float64: the distance is a sqrt of (1 - coefficient), which
+    amplifies float32 rounding near a perfect match.
+    """
+    dim = next((len(h) for h in hists if h is not None), 0)
+    H = np.zeros((len(hists), dim), dtype=np.float64)
+    for i, h in enumerate(hists):
+        if h is not None:
+            H[i] = h
+    return np.sqrt(H), H.sum(axis=1)
+
+
+def bhattacharyya_similarity(q_hist, hist_sqrt, hist_sums):
+    """
+    1 - Bhattacharyya distance (same formula as cv2.HISTCMP_BHATTACHARYYA)
+    of one query histogram (B,) or a batch (Q, B) against every row at
+    once -> (N,) or (Q, N).
+    Rows with a zero sum (missing histogram) score 0.0.
+    """
+    q = np.asarray(q_hist, dtype=np.float64)
+    bc = np.sqrt(q) @ hist_sqrt.T
+    norm = q.sum(axis=-1, keepdims=True) * hist_sums
+
+    valid = norm > np.finfo(np.float32).eps
+    dist = np.ones(bc.shape)
+    dist[valid] = np.sqrt(np.maximum(1.0 - bc[valid] / np.sqrt(norm[valid]), 0.0))
+    return np.where(hist_sums > 0, 1.0 - dist, 0.0)
+
+
+def region_feats(region, use_prototypes=False):
+    """
+    Normalized (N, D) feature matrix of one face region, or None.
+    """
+    if use_prototypes:
+        feats = region.get("prototypes")
+        # prototypes are stored normalized
+        return None if feats is None or len(feats) == 0 else feats
+
+    feats = region.get("clip_feats")
+    if feats is None or len(feats) == 0:
+        return None
+    return normalize_rows(feats)
+
+
+class ScoringWeights:
+    """
+    Weights of the search scoring function (see config.SCORING_WEIGHTS).
+    Features with weight 0 are neither built, loaded, encoded nor scored.
+    """
+    KEYS = ("art_clip", "art_color", "full_clip", "full_color")
+
+    def __init__(self, art_clip=0.8, art_color=0.10, full_clip=0.00, full_color=0.10):
+        self.art_clip = art_clip
+        self.art_color = art_color
+        self.full_clip = full_clip
+        self.full_color = full_color
+
+    @classmethod
+    def from_config(cls):
+        from config import SCORING_WEIGHTS
+        return cls(**SCORING_WEIGHTS)
+
+    def uses(self, key) -> bool:
+        return getattr(self, key) != 0
+
+    def clip_regions(self):
+        return tuple(r for r in ("art", "full") if self.uses(f"{r}_clip"))
+
+    def color_regions(self):
+        return tuple(r for r in ("art", "full") if self.uses(f"{r}_color"))
+
+    def feature_tag(self) -> str:
+        """
+        File / namespace suffix of features built with these weights
+        ("" when every feature is used).
+        """
+        unused = [k.replace("_", "") for k in self.KEYS if not self.uses(k)]
+        return f"_no-{'-'.join(unused)}" if unused else ""
+
+    def __repr__(self):
+        return "ScoringWeights(" + ", ".join(f"{k}={getattr(self, k)}" for k in self.KEYS) + ")"
+
+
+def card_metadata(card):
+    """
+    name_en and face image names of a deck card, without its features.
+    """
+    meta = {"name_en": card["name_en"]}
+    for side in ("front", "back"):
+        face = card.get(side)
+        meta[side] = {"image": face["image"]} if face else None
+    return meta
+
+
+class ClipDeckIndex:
+    """
+    All CLIP features of a deck as one matrix per region ("art" / "full"),
+    with per-face row offsets, in a compact storage
+    ("float32" / "float16" / "pq", see embedding_storage.py).
+    Only the regions and histograms used by the weights are kept, and
+    the faces only keep the card metadata, so the deck features can be
+    released once the index is built. Build it once and pass it as `deck` to search_clip_with_color.
+    """
+
+    def __init__(
+        self, deck, storage="float32", use_prototypes=False, weights=None, **storage_kwargs
+    ):
+        self.storage_kind = storage
+        self.use_prototypes = use_prototypes
+        self.weights = weights or ScoringWeights.from_config()
+        clip_regions = self.weights.clip_regions()
+        color_regions = self.weights.color_regions()
+
+        # Faces that have features for every used region
+        self.faces = []
+        feats = {r: [] for r in clip_regions}
+        hists = {r: [] for r in color_regions}
+
+        for card in deck:
+            meta = card_metadata(card)
+            for side in ("front", "back"):
+                face = card.get(side)
+                if not face:
+                    continue
+
+                regions = {r: face.get(r) for r in ("art", "full")}
+                if not all(regions.values()):
+                    continue
+
+                face_feats = {r: region_feats(regions[r], use_prototypes) for r in clip_regions}
+                if any(f is None for f in face_feats.values()):
+                    continue
+
+                self.faces.append((meta, side))
+                for r in clip_regions:
+                    feats[r].append(face_feats[r])
+                for r in color_regions:
+                    hists[r].append(regions[r].get("color_hist"))
+
+        # Colour: sqrt-histogram matrix per region (one matmul per query)
+        self.hists = {r: hist_matrix(h) for r, h in hists.items()}
+
+        self.storage = {}
+        self.offsets = {}
+        for region, mats in feats.items():
+            counts = [len(m) for m in mats]
+            self.offsets[region] = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+            if mats:
+                self.storage[region] = make_storage(
+                    np.concatenate(mats), storage, **storage_kwargs
+                )
+
+    def __len__(self):
+        return len(self.faces)
+
+    @property
+    def nbytes(self):
+        return (
+            sum(s.nbytes for s in self.storage.values())
+            + sum(h.nbytes for h, _ in self.hists.values())
+        )
+
+    def clip_stats(self, region, q):
+        """
+        Per-face max / mean / median of the cosine scores of a
+        normalized query (D,) or query batch (B, D) -> (N,) or (B, N).
+        """
+        scores = self.storage[region].scores(q)
+        off = self.offsets[region]
+
+        face_max = np.maximum.reduceat(scores, off[:-1], axis=-1)
+        face_mean = np.add.reduceat(scores, off[:-1], axis=-1) / np.diff(off)
+        face_median = np.stack([
+            np.median(scores[..., off[i]:off[i + 1]], axis=-1)
+            for i in range(len(off) - 1)
+        ], axis=-1)
+        return face_max, face_mean, face_median
+
+    def color_scores(self, region, q_hist):
+        hist_sqrt, hist_sums = self.hists[region]
+        return bhattacharyya_similarity(q_hist, hist_sqrt, hist_sums)
+
+
 def search_clip_with_color(
     query_art_clip_feat,
     query_art_img,
@@ -49,136 +237,157 @@ def search_clip_with_color(
     deck,
     topk=10,
 
-    # ---- Weights ----
-    w_art_clip=0.8,
-    w_art_color=0.10,
-    w_full_clip=0.00,
-    w_full_color=0.10,
-    # w_art_clip=0.4,
-    # w_art_color=0.10,
-    # w_full_clip=0.4,
-    # w_full_color=0.10,
+    # ---- Weights (ScoringWeights, default: config.SCORING_WEIGHTS) ----
+    weights=None,
+
+    # Score against the k-means prototypes of each face instead of
+    # every augmented feature (see compress_deck_clip.py)
+    use_prototypes=False,
+
+    # Query colour histograms (extract_color_hist_hsv), computed from
+    # the query images when not given
+    query_art_hist=None,
+    query_full_hist=None,
+):
+    """
+    deck: list of deck_clip.pkl cards, or a prebuilt ClipDeckIndex
+    (preferred for repeated searches; its weights are the default).
+    Query features of zero-weight terms may be None.
+    """
+    def one(x):
+        return None if x is None else [x]
+
+    return search_clip_with_color_batch(
+        query_art_clip_feats=one(query_art_clip_feat),
+        query_art_imgs=[query_art_img],
+        query_full_clip_feats=one(query_full_clip_feat),
+        query_full_imgs=[query_full_img],
+        deck=deck,
+        topk=topk,
+        weights=weights,
+        use_prototypes=use_prototypes,
+        query_art_hists=one(query_art_hist),
+        query_full_hists=one(query_full_hist),
+    )[0]
+
+
+def search_clip_with_color_batch(
+    query_art_clip_feats,
+    query_art_imgs,
+    query_full_clip_feats,
+    query_full_imgs,
+    deck,
+    topk=10,
+    weights=None,
+    use_prototypes=False,
+    query_art_hists=None,
+    query_full_hists=None,
 ):
-    import numpy as np
-    from image_utils import extract_color_hist_hsv
+    """
+    search_clip_with_color for B queries at once: one (B, D) matrix
+    product per region and one histogram product per region.
+    Query arguments are sequences / (B, D) arrays of length B.
+    Returns a list of B results.
+    """
+    if isinstance(deck, ClipDeckIndex):
+        index = deck
+        weights = weights or index.weights
+    else:
+        weights = weights or ScoringWeights.from_config()
+        index = ClipDeckIndex(deck, use_prototypes=use_prototypes, weights=weights)
+
+    n_queries = len(query_art_imgs)
+    if len(index) == 0:
+        return [
+            {"best": {"card": None, "side": None, "score": -1.0}, "topk": []}
+            for _ in range(n_queries)
+        ]
 
     # =========================
-    # Query features
+    # Search (combined ART + FULL evaluation)
     # =========================
-    q_art_clip = query_art_clip_feat / np.linalg.norm(query_art_clip_feat)
-    q_art_color = extract_color_hist_hsv(query_art_img)
-
-    q_full_clip = query_full_clip_feat / np.linalg.norm(query_full_clip_feat)
-    q_full_color = extract_color_hist_hsv(query_full_img)
-
-    best_card = None
-    best_side = None
-    best_score = -1.0
-
-    candidates = []
+    queries = {
+        "art": (query_art_clip_feats, query_art_imgs, query_art_hists),
+        "full": (query_full_clip_feats, query_full_imgs, query_full_hists),
+    }
+    zeros = np.zeros((n_queries, len(index)))
+    stats = {}
+    color = {}
+
+    for region, (clip_feats, imgs, hists) in queries.items():
+        if weights.uses(f"{region}_clip"):
+            Q = np.asarray(clip_feats, dtype=np.float32)
+            Q = Q / np.linalg.norm(Q, axis=1, keepdims=True)
+            stats[region] = index.clip_stats(region, Q)
+        else:
+            stats[region] = (zeros, zeros, zeros)
+
+        if weights.uses(f"{region}_color"):
+            if hists is None:
+                hists = [extract_color_hist_hsv(img) for img in imgs]
+            color[region] = index.color_scores(region, np.stack(hists))
+        else:
+            color[region] = zeros
+
+    art_clip_max, art_clip_mean, art_clip_median = stats["art"]
+    full_clip_max, full_clip_mean, full_clip_median = stats["full"]
+    art_color_score = color["art"]
+    full_color_score = color["full"]
 
     # =========================
-    # Search (combined ART + FULL evaluation)
+    # FINAL SCORE (scoring function)
     # =========================
-    for card in deck:
-        for side in ("front", "back"):
-            face = card.get(side)
-            if not face:
-                continue
-
-            art = face.get("art")
-            full = face.get("full")
-            if not art or not full:
-                continue
-
-            if not art.get("clip_feats") or not full.get("clip_feats"):
-                continue
-
-            # ---------- ART CLIP ----------
-            art_clip_scores = [
-                float(np.dot(q_art_clip, f / np.linalg.norm(f)))
-                for f in art["clip_feats"]
-            ]
-            art_clip_scores = np.array(art_clip_scores)
-
-            art_clip_max = float(art_clip_scores.max())
-            art_clip_mean = float(art_clip_scores.mean())
-            art_clip_median = float(np.median(art_clip_scores))
-
-            art_color_score = (
-                compare_color_hist(q_art_color, art["color_hist"])
-                if art.get("color_hist") is not None else 0.0
-            )
-
-            # ---------- FULL CLIP ----------
-            full_clip_scores = [
-                float(np.dot(q_full_clip, f / np.linalg.norm(f)))
-                for f in full["clip_feats"]
-            ]
-            full_clip_scores = np.array(full_clip_scores)
-
-            full_clip_max = float(full_clip_scores.max())
-            full_clip_mean = float(full_clip_scores.mean())
-            full_clip_median = float(np.median(full_clip_scores))
-
-            full_color_score = (
-                compare_color_hist(q_full_color, full["color_hist"])
-                if full.get("color_hist") is not None else 0.0
-            )
-
-            # =========================
-            # FINAL SCORE (scoring function)
-            # =========================
-            final_score = (
-                w_art_clip   * art_clip_max +
-                w_art_color  * art_color_score +
-                w_full_clip  * full_clip_max +
-                w_full_color * full_color_score
-            )
-
-            # ---- Update best result ----
-            if final_score > best_score:
-                best_score = final_score
-                best_card = card
-                best_side = side
-
-            candidates.append({
+    final_score = (
+        weights.art_clip   * art_clip_max +
+        weights.art_color  * art_color_score +
+        weights.full_clip  * full_clip_max +
+        weights.full_color * full_color_score
+    )
+
+    results = []
+    for b in range(n_queries):
+        # =========================
+        # TOP-K (based on the scoring function)
+        # =========================
+        order = np.argsort(-final_score[b], kind="stable")[:topk]
+
+        top_cards = []
+        for i in order:
+            card, side = index.faces[i]
+            top_cards.append({
                 "card": card,
                 "side": side,
 
                 # Based on the scoring function
-                "final_score": final_score,
+                "final_score": float(final_score[b, i]),
 
                 # --- ART ---
-                "art_clip_max": art_clip_max,
-                "art_clip_mean": art_clip_mean,
-                "art_clip_median": art_clip_median,
-                "art_color_score": art_color_score,
+                "art_clip_max": float(art_clip_max[b, i]),
+                "art_clip_mean": float(art_clip_mean[b, i]),
+                "art_clip_median": float(art_clip_median[b, i]),
+                "art_color_score": float(art_color_score[b, i]),
 
                 # --- FULL ---
-                "full_clip_max": full_clip_max,
-                "full_clip_mean": full_clip_mean,
-                "full_clip_median": full_clip_median,
-                "full_color_score": full_color_score,
+                "full_clip_max": float(full_clip_max[b, i]),
+                "full_clip_mean": float(full_clip_mean[b, i]),
+                "full_clip_median": float(full_clip_median[b, i]),
+                "full_color_score": float(full_color_score[b, i]),
             })
 
-    # =========================
-    # TOP-K (based on the scoring function)
-    # =========================
-    top_cards = sorted(
-        candidates,
-        key=lambda x: x["final_score"],
-        reverse=True
-    )[:topk]
-
-    return {
-        "best": {
-            "card": best_card,
-            "side": best_side,
-            "score": best_score,
-        },
-        "topk": top_cards,
-    }
+        # ---- Best result ----
+        best = int(order[0])
+        best_card, best_side = index.faces[best]
+
+        results.append({
+            "best": {
+                "card": best_card,
+                "side": best_side,
+                "score": float(final_score[b, best]),
+            },
+            "topk": top_cards,
+        })
+
+    return results
 
 
 
@@ -232,7 +441,11 @@ def search_metric_topk(query_feat, metric_features, k=5):
 def metric_score_for_card(metric_feat, card_name, metric_features):
     """
     Returns the metric cosine similarity for the specified card name.
+    metric_features: gallery list or MetricGallery (indexed, preferred).
     """
+    if isinstance(metric_features, MetricGallery):
+        return metric_features.score(metric_feat, card_name)
+
     for c in metric_features:
         if c["name_en"] == card_name:
             f = c["metric_feature"]
@@ -244,6 +457,56 @@ def metric_score_for_card(metric_feat, card_name, metric_features):
 
 
 
+class MetricGallery:
+    """
+    Metric gallery (list of {"name_en", "metric_feature"}) as one
+    normalized (N, D) matrix with a name -> row index, so re-ranking K
+    candidates costs one (K, D) @ (D,) product whatever the deck size.
+    """
+
+    def __init__(self, metric_features):
+        self.names = [c["name_en"] for c in metric_features]
+        self.rows = {name: i for i, name in enumerate(self.names)}
+        self.matrix = (
+            normalize_rows([c["metric_feature"] for c in metric_features])
+            if metric_features else np.zeros((0, 0), dtype=np.float32)
+        )
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.rows
+
+    def rerank(self, query, candidate_names):
+        """
+        Cosine similarity of the query to each candidate name
+        (NaN for names not in the gallery), aligned with candidate_names.
+        """
+        q = np.asarray(query, dtype=np.float32)
+        q = q / np.linalg.norm(q)
+
+        idx = np.array([self.rows.get(n, -1) for n in candidate_names], dtype=np.int64)
+        scores = np.full(len(idx), np.nan, dtype=np.float32)
+        known = idx >= 0
+        if known.any():
+            scores[known] = self.matrix[idx[known]] @ q
+        return scores
+
+    def best(self, query, candidate_names):
+        """
+        (name, score) of the best candidate, or (None, -1.0).
+        """
+        scores = self.rerank(query, candidate_names)
+        if len(scores) == 0 or np.isnan(scores).all():
+            return None, -1.0
+        i = int(np.nanargmax(scores))
+        return candidate_names[i], float(scores[i])
+
+    def score(self, query, name):
+        return float(self.rerank(query, [name])[0]) if name in self.rows else None
+
+
 def crop_art_region(img):
     """
     Crop the illustration (art) region from an MTG card image.
@@ -0,0 +1,216 @@
+# inference_backend.py
+"""
+Pluggable inference runtime for the CPU models.
+
+A torch module is exported once (ONNX or TorchScript), the artifact is
+cached next to its weights, and the faster runtime is used when it is
+available and passes an embedding parity check. Eager PyTorch is the
+fallback for everything.
+"""
+from pathlib import Path
+import json
+
+import numpy as np
+import torch
+
+from config import INFERENCE_BACKEND
+
+PARITY_MIN_COS = 0.999
+ONNX_OPSET = 17
+
+
+def onnxruntime_available() -> bool:
+    try:
+        import onnxruntime  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def backend_order(preferred=None) -> list[str]:
+    """
+    Backends to try, fastest first.
+    """
+    preferred = preferred or INFERENCE_BACKEND
+    if preferred == "auto":
+        order = ["onnx", "torchscript"]
+    elif preferred == "eager":
+        order = []
+    else:
+        order = [preferred]
+
+    if not onnxruntime_available() and "onnx" in order:
+        order.remove("onnx")
+    return order
+
+
+def source_stamp(path: Path | None) -> str:
+    if path is None or not Path(path).exists():
+        return ""
+    st = Path(path).stat()
+    return f"{st.st_mtime_ns}-{st.st_size}"
+
+
+# =========================
+# Runtimes
+# =========================
+
+class EagerModel:
+    backend = "eager"
+
+    def __init__(self, module):
+        self.module = module.eval()
+
+    def __call__(self, x):
+        with torch.no_grad():
+            return self.module(x)
+
+
+class TorchScriptModel:
+    backend = "torchscript"
+
+    def __init__(self, path: Path):
+        self.module = torch.jit.load(str(path), map_location="cpu").eval()
+
+    def __call__(self, x):
+        with torch.no_grad():
+            return self.module(x)
+
+
+class OnnxModel:
+    backend = "onnx"
+
+    def __init__(self, path: Path):
+        import onnxruntime as ort
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            str(path), opts, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, x):
+        out = self.session.run(None, {self.input_name: x.cpu().numpy()})[0]
+        return torch.from_numpy(out)
+
+
+def export_artifact(module, example, path: Path, backend: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+
+    with torch.no_grad():
+        if backend == "onnx":
+            torch.onnx.export(
+                module, example, str(tmp),
+                input_names=["input"],
+                output_names=["output"],
+                dynamic_axes={"input": {0: "batch"}, "output": {0: "batch"}},
+                opset_version=ONNX_OPSET,
+            )
+        else:
+            traced = torch.jit.trace(module, example)
+            traced.save(str(tmp))
+
+    tmp.replace(path)
+
+
+def open_artifact(path: Path, backend: str):
+    if backend == "onnx":
+        return OnnxModel(path)
+    return TorchScriptModel(path)
+
+
+def parity(reference, candidate, example) -> float:
+    """
+    Minimum cosine similarity between eager and runtime embeddings.
+    """
+    a = reference(example).float().reshape(len(example), -1).numpy()
+    b = candidate(example).float().reshape(len(example), -1).numpy()
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return float((a * b).sum(axis=1).min())
+
+
+def load_runtime(
+    module,
+    example,
+    artifact_base: Path,
+    weights_path: Path | None = None,
+    preferred=None,
+    log_fn=print,
+):
+    """
+    Returns a callable (torch.Tensor -> torch.Tensor) running `module`
+    on the fastest available backend.
+
+    artifact_base: path without suffix; ".onnx" / ".ts" and a ".json"
+                   stamp are written next to it.
+    weights_path:  the source weights; a newer file invalidates the export.
+    """
+    module = module.eval()
+    eager = EagerModel(module)
+    stamp = source_stamp(weights_path)
+
+    for backend in backend_order(preferred):
+        suffix = ".onnx" if backend == "onnx" else ".ts"
+        path = artifact_base.with_suffix(suffix)
+        meta_path = artifact_base.with_suffix(suffix + ".json")
+
+        try:
+            meta = json.loads(meta_path.read_text()) if meta_path.exists() else {}
+            if not path.exists() or meta.get("stamp") != stamp:
+                log_fn(f"[INFO] exporting {artifact_base.name} ({backend})...")
+                export_artifact(module, example, path, backend)
+                meta = {"stamp": stamp}
+
+            runtime = open_artifact(path, backend)
+
+            if "parity" not in meta:
+                meta["parity"] = parity(eager, runtime, example)
+                meta_path.write_text(json.dumps(meta))
+
+            if meta["parity"] < PARITY_MIN_COS:
+                log_fn(
+                    f"[WARN] {artifact_base.name} {backend} parity "
+                    f"{meta['parity']:.5f} < {PARITY_MIN_COS} → skipped"
+                )
+                continue
+
+            log_fn(
+                f"[INFO] {artifact_base.name}: {backend} runtime "
+                f"(parity {meta['parity']:.5f})"
+            )
+            return runtime
+
+        except Exception as e:
+            log_fn(f"[WARN] {artifact_base.name} {backend} unavailable: {e}")
+
+    return eager
+
+
+def load_yolo(pt_path: Path, export_dir: Path, preferred=None, log_fn=print):
+    """
+    YOLO detector on ONNX Runtime when available (exported once through
+    ultralytics), otherwise the eager .pt model.
+    """
+    from ultralytics import YOLO
+
+    if "onnx" in backend_order(preferred):
+        onnx_path = export_dir / (Path(pt_path).stem + ".onnx")
+        meta_path = onnx_path.with_suffix(".onnx.json")
+        stamp = source_stamp(pt_path)
+        try:
+            meta = json.loads(meta_path.read_text()) if meta_path.exists() else {}
+            if not onnx_path.exists() or meta.get("stamp") != stamp:
+                log_fn(f"[INFO] exporting {onnx_path.name}...")
+                exported = Path(YOLO(pt_path).export(format="onnx", dynamic=True))
+                export_dir.mkdir(parents=True, exist_ok=True)
+                if exported.resolve() != onnx_path.resolve():
+                    exported.replace(onnx_path)
+                meta_path.write_text(json.dumps({"stamp": stamp}))
+            log_fn(f"[INFO] {onnx_path.name}: onnx runtime")
+            return YOLO(str(onnx_path), task="detect")
+        except Exception as e:
+            log_fn(f"[WARN] YOLO onnx unavailable: {e}")
+
+    return YOLO(pt_path)
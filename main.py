@@ -24,7 +24,6 @@ from PyQt5.QtGui import (
 )
 import requests
 import generator
-from camera_window import CameraWindow
 
 from PyQt5.QtCore import QRunnable, QObject, pyqtSignal, QThreadPool
 
@@ -479,6 +478,9 @@ class MainWindow(QWidget):
                 return
 
             if not self.camera_window:
+                # Imported here: it loads the recognition models, and
+                # spawned training processes re-import this module
+                from camera_window import CameraWindow
                 self.camera_window = CameraWindow(self.csv_path)
                 self.camera_window.cardDetected.connect(self.on_card_detected)
             self.camera_window.show()
@@ -25,3 +25,26 @@ class ConvNeXtEmbed(nn.Module):
         z = self.head(z)
         z = F.normalize(z, dim=1)
         return z
+
+
+class StudentEmbed(nn.Module):
+    """
+    Lightweight embedding network distilled from ConvNeXtEmbed.
+    Runs at a lower input resolution for camera-time re-ranking.
+    """
+    def __init__(self, embed_dim=128):
+        super().__init__()
+
+        self.backbone = timm.create_model(
+            "mobilenetv3_small_100",
+            pretrained=True,
+            num_classes=0
+        )
+
+        self.head = nn.Linear(self.backbone.num_features, embed_dim)
+
+    def forward(self, x):
+        z = self.backbone(x)
+        z = self.head(z)
+        z = F.normalize(z, dim=1)
+        return z
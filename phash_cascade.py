@@ -0,0 +1,262 @@
+# phash_cascade.py
+"""
+Perceptual-hash first stage in front of CLIP.
+
+Every card face gets a 128-bit hash (64-bit pHash + 64-bit dHash) of its
+art crop and of a few augmentations. At runtime the art crop of the
+camera is hashed and compared by Hamming distance; when the closest card
+is near enough and clearly ahead of the second closest card, it is
+accepted without running CLIP (and the metric model). Ambiguous crops
+fall back to the usual CLIP search.
+
+Usage:
+    python phash_cascade.py deck.csv [--queries N]
+"""
+import argparse
+import csv
+import pickle
+import random
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from feature_store import file_sha256
+from image_utils import crop_art_region, augment_image
+
+PHASH_PATH_NAME = "deck_phash.pkl"
+HASH_VERSION = 1
+HASH_BITS = 128
+
+HASH_AUG_N = 20     # augmented hashes per card face
+MAX_DISTANCE = 24   # accept only when the best card is within this distance
+MIN_MARGIN = 10     # ... and the second best card is this much further
+
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+# =========================
+# Hashes
+# =========================
+
+def phash_bits(gray):
+    """
+    64-bit DCT hash: low 8x8 frequencies above their median.
+    """
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    return low > np.median(low[1:])
+
+
+def dhash_bits(gray):
+    """
+    64-bit gradient hash: horizontal brightness differences on 9x8.
+    """
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    return (small[:, 1:] > small[:, :-1]).flatten()
+
+
+def art_hash(art_rgb):
+    """
+    Packed 128-bit hash (16 uint8) of an RGB art crop.
+    """
+    gray = cv2.cvtColor(art_rgb, cv2.COLOR_RGB2GRAY)
+    return np.packbits(np.concatenate([phash_bits(gray), dhash_bits(gray)]))
+
+
+def hamming(q, H):
+    """
+    Hamming distance of one packed hash to every row of H.
+    """
+    return POPCOUNT[np.bitwise_xor(H, q)].sum(axis=1, dtype=np.int32)
+
+
+def face_hashes(img_rgb, aug_n=HASH_AUG_N):
+    """
+    (1 + aug_n, 16) hashes of the art of the card and of augmented cards
+    (same augmentation as the CLIP features); fewer, possibly none, when
+    the art could not be cropped.
+    """
+    hashes = []
+    for i in range(aug_n + 1):
+        img = img_rgb if i == 0 else augment_image(img_rgb)
+        art = crop_art_region(img)
+        if art is not None and art.size > 0:
+            hashes.append(art_hash(np.ascontiguousarray(art)))
+    if not hashes:
+        return np.zeros((0, HASH_BITS // 8), np.uint8)
+    return np.stack(hashes)
+
+
+# =========================
+# Cascade
+# =========================
+
+class PHashCascade:
+    def __init__(self, faces, hashes, max_distance=MAX_DISTANCE, min_margin=MIN_MARGIN):
+        """
+        faces : [{"name_en", "side", "image"}]
+        hashes: per face (n_i, 16) uint8
+        """
+        self.faces = faces
+        self.max_distance = max_distance
+        self.min_margin = min_margin
+
+        self.names = sorted({f["name_en"] for f in faces})
+        name_id = {n: i for i, n in enumerate(self.names)}
+        self.H = np.concatenate(hashes) if hashes else np.zeros((0, HASH_BITS // 8), np.uint8)
+        self.row_face = np.repeat(np.arange(len(faces)), [len(h) for h in hashes])
+        self.row_name = np.array([name_id[faces[i]["name_en"]] for i in self.row_face], dtype=np.int64)
+
+        self.queries = 0
+        self.hits = 0
+
+    def __len__(self):
+        return len(self.faces)
+
+    @property
+    def hit_rate(self):
+        return self.hits / self.queries if self.queries else 0.0
+
+    def reset_stats(self):
+        self.queries = 0
+        self.hits = 0
+
+    def match(self, art_rgb):
+        """
+        Best card by Hamming distance, or None when it is not clearly
+        ahead (the caller falls back to CLIP).
+        Returns {"card", "side", "distance", "margin", "score"}.
+        """
+        if len(self.names) < 2:
+            return None
+
+        self.queries += 1
+        d = hamming(art_hash(art_rgb), self.H)
+
+        # Closest hash per card name (front/back are the same card)
+        per_name = np.full(len(self.names), HASH_BITS + 1, dtype=np.int32)
+        np.minimum.at(per_name, self.row_name, d)
+        first, second = np.argpartition(per_name, 1)[:2]
+        if per_name[second] < per_name[first]:
+            first, second = second, first
+
+        best = int(per_name[first])
+        margin = int(per_name[second]) - best
+        if best > self.max_distance or margin < self.min_margin:
+            return None
+
+        self.hits += 1
+        face = self.faces[int(self.row_face[np.argmin(d)])]
+        return {
+            "card": {"name_en": face["name_en"]},
+            "side": face["side"],
+            "distance": best,
+            "margin": margin,
+            "score": 1.0 - best / HASH_BITS,
+        }
+
+
+def build_phash_cascade(csv_path: Path, aug_n=HASH_AUG_N, log_fn=print) -> PHashCascade:
+    """
+    Hash every card face of the deck. Hashes are cached per image
+    content in deck_phash.pkl, so only new images are processed.
+    """
+    from build_deck_clip import imread_utf8
+
+    deck_dir = csv_path.parent
+    cache_path = deck_dir / PHASH_PATH_NAME
+
+    entries = {}
+    if cache_path.exists():
+        with open(cache_path, "rb") as f:
+            saved = pickle.load(f)
+        if saved.get("version") == HASH_VERSION and saved.get("aug_n") == aug_n:
+            entries = saved["entries"]
+
+    with open(csv_path, encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+
+    faces = []
+    hashes = []
+    used = {}
+    computed = 0
+
+    for row in rows:
+        for side, key in (("front", "card_file_front"), ("back", "card_file_back")):
+            file = row.get(key)
+            if not file or not (deck_dir / file).exists():
+                continue
+
+            img_hash = file_sha256(deck_dir / file)
+            h = entries.get(img_hash)
+            if h is None:
+                img = imread_utf8(deck_dir / file)
+                if img is None:
+                    continue
+                h = face_hashes(cv2.cvtColor(img, cv2.COLOR_BGR2RGB), aug_n)
+                computed += 1
+
+            used[img_hash] = h
+            # No art region: cached so it is not retried, but not indexed
+            if len(h) == 0:
+                continue
+            faces.append({"name_en": row["name_en"], "side": side, "image": file})
+            hashes.append(h)
+
+    if computed or len(used) != len(entries):
+        with open(cache_path, "wb") as f:
+            pickle.dump({"version": HASH_VERSION, "aug_n": aug_n, "entries": used}, f)
+
+    log_fn(f"[OK] perceptual hashes: {len(faces)} faces ({computed} new)")
+    return PHashCascade(faces, hashes)
+
+
+# =========================
+# Hit rate / precision
+# =========================
+
+def evaluate(csv_path: Path, queries_per_face=5, log_fn=print) -> dict:
+    """
+    Run fresh augmentations of every face through the cascade.
+    hit rate  = share of queries answered without CLIP
+    precision = share of those answers that are correct
+    """
+    from clip_quant_eval import load_faces
+
+    cascade = build_phash_cascade(csv_path, log_fn=log_fn)
+    random.seed(0)
+
+    correct = 0
+    for name, _, img in load_faces(csv_path):
+        for _ in range(queries_per_face):
+            art = crop_art_region(augment_image(img))
+            if art is None or art.size == 0:
+                continue
+            hit = cascade.match(np.ascontiguousarray(art))
+            correct += hit is not None and hit["card"]["name_en"] == name
+
+    report = {
+        "queries": cascade.queries,
+        "hit_rate": cascade.hit_rate,
+        "precision": correct / cascade.hits if cascade.hits else 0.0,
+    }
+    log_fn(
+        f"[REPORT] hash cascade: {report['queries']} queries "
+        f"hit rate={report['hit_rate']:.3f} "
+        f"precision={report['precision']:.3f} "
+        f"(CLIP skipped for {cascade.hits} crops)"
+    )
+    return report
+
+
+# -------------------------
+# Entry point
+# -------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Perceptual-hash cascade hit rate on a deck")
+    parser.add_argument("csv_path", type=Path)
+    parser.add_argument("--queries", type=int, default=5, help="augmented queries per card face")
+    args = parser.parse_args()
+
+    evaluate(args.csv_path, args.queries)
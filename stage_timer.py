@@ -0,0 +1,148 @@
+# stage_timer.py
+"""
+Per-stage latency of the camera loop.
+
+Each frame records the seconds spent in every stage (perf_counter).
+The last RING_SIZE frames are kept in a ring buffer for rolling
+p50/p95/p99; the last TRACE_SIZE frames (about 30 min at 30 fps) are
+kept as a trace that can be exported to CSV or JSON for offline
+analysis.
+
+A stage that did not run in a frame (cached result, hash hit, ...) is
+recorded as missing, so its percentiles describe the runs of the stage;
+"total" is the whole frame.
+"""
+import csv
+import json
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+STAGES = (
+    "capture", "yolo", "crop", "hash", "clip_art", "clip_full",
+    "search", "metric", "vote", "render",
+)
+RING_SIZE = 300
+TRACE_SIZE = 54_000
+PERCENTILES = (50, 95, 99)
+
+
+class StageTimer:
+    def __init__(self, stages=STAGES, size=RING_SIZE, trace_size=TRACE_SIZE):
+        self.stages = tuple(stages) + ("total",)
+        self.col = {s: i for i, s in enumerate(self.stages)}
+
+        self.ring = np.full((size, len(self.stages)), np.nan)
+        self.filled = 0
+        self.pos = 0
+
+        self.trace = deque(maxlen=trace_size)
+        self.current = None
+        self.frame_start = 0.0
+        self.frame_no = 0
+
+    def begin_frame(self):
+        self.current = {}
+        self.frame_start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        # Stages can run several times per frame (one per card)
+        if self.current is not None:
+            self.current[name] = self.current.get(name, 0.0) + seconds
+
+    def end_frame(self):
+        """
+        Close the frame; frames where no stage ran are not recorded.
+        """
+        frame, self.current = self.current, None
+        if not frame:
+            return
+        frame["total"] = time.perf_counter() - self.frame_start
+
+        row = np.full(len(self.stages), np.nan)
+        for name, seconds in frame.items():
+            row[self.col[name]] = seconds
+        self.ring[self.pos] = row
+        self.pos = (self.pos + 1) % len(self.ring)
+        self.filled = min(self.filled + 1, len(self.ring))
+
+        self.frame_no += 1
+        self.trace.append((self.frame_no, self.frame_start, row))
+
+    def discard(self):
+        """
+        Drop the current frame (nothing to process this tick).
+        """
+        self.current = None
+
+    def reset(self):
+        self.ring[:] = np.nan
+        self.filled = 0
+        self.pos = 0
+        self.trace.clear()
+        self.frame_no = 0
+
+    # ---------- Readouts ----------
+    def percentiles(self):
+        """
+        {stage: (p50, p95, p99) in ms} over the ring buffer, for the
+        stages that ran in it.
+        """
+        data = self.ring[:self.filled] * 1000.0
+        out = {}
+        for s, i in self.col.items():
+            runs = data[:, i][~np.isnan(data[:, i])]
+            if len(runs):
+                out[s] = tuple(np.percentile(runs, PERCENTILES))
+        return out
+
+    def readout_lines(self):
+        return [
+            f"{s:<9} p50 {p50:6.1f}  p95 {p95:6.1f}  p99 {p99:6.1f} ms"
+            for s, (p50, p95, p99) in self.percentiles().items()
+        ]
+
+    # ---------- Export ----------
+    def export(self, path):
+        """
+        Write the trace (ms per stage and frame) to .csv or .json.
+        """
+        path = Path(path)
+        t0 = self.trace[0][1] if self.trace else 0.0
+        rows = [
+            {
+                "frame": no,
+                "t": round(start - t0, 6),
+                **{
+                    s: (None if np.isnan(v) else round(v * 1000.0, 3))
+                    for s, v in zip(self.stages, row)
+                },
+            }
+            for no, start, row in self.trace
+        ]
+
+        if path.suffix.lower() == ".json":
+            summary = {
+                s: dict(zip((f"p{p}" for p in PERCENTILES), map(float, v)))
+                for s, v in self.percentiles().items()
+            }
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"stages": self.stages, "summary_ms": summary, "frames": rows}, f, indent=1)
+        else:
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=["frame", "t", *self.stages])
+                writer.writeheader()
+                writer.writerows(rows)
+
+        print(f"[OK] stage timings: {len(rows)} frames -> {path}")
@@ -3,29 +3,224 @@ from pathlib import Path
 import torch
 from torch.utils.data import DataLoader
 import torch.nn as nn
+import torch.nn.functional as F
 import torch.optim as optim
+from torch.utils.data import Subset
 
 from dataset_metric import MetricCardDataset
 from model_metric import ConvNeXtEmbed
 from arcface import ArcFace
 from datetime import datetime
+import os
 import time
 
+MODEL_PATH_NAME = "metric_model.pth"
+ARCFACE_PATH_NAME = "metric_arcface.pth"
+CHECKPOINT_PATH_NAME = "metric_checkpoint.pth"
+HASH_PATH_NAME = "deck_metric.hash"
 
-def train_metric(csv_path: Path, epochs=30, batch_size=32, log_fn=print):
+# Fall back to a full retrain when more than this ratio of classes is new
+INCREMENTAL_MAX_NEW_RATIO = 0.5
+
+
+def default_num_workers() -> int:
+    # The dataset is memory-mapped, so extra workers cost no extra RAM
+    return max(1, min(8, (os.cpu_count() or 2) - 1))
+
+
+def load_previous_metric(deck_dir: Path, device):
+    """
+    Load the previous embedding model and ArcFace head of this deck.
+    Returns (model_state, class_names, arcface_weight) or None.
+    """
+    model_path = deck_dir / MODEL_PATH_NAME
+    arcface_path = deck_dir / ARCFACE_PATH_NAME
+    if not model_path.exists() or not arcface_path.exists():
+        return None
+
+    try:
+        model_state = torch.load(model_path, map_location=device, weights_only=True)
+        arcface_data = torch.load(arcface_path, map_location=device, weights_only=True)
+    except Exception:
+        return None
+
+    return (
+        model_state,
+        list(arcface_data["class_names"]),
+        arcface_data["state_dict"]["weight"],
+    )
+
+
+def embed_class_images(model, dataset, label, device, batch_size=32):
+    """
+    Mean normalized embedding of all images of one class.
+    """
+    imgs = [dataset[i][0] for i in dataset.class_indices(label)]
+
+    model.eval()
+    feats = []
+    with torch.no_grad():
+        for i in range(0, len(imgs), batch_size):
+            batch = torch.stack(imgs[i:i + batch_size]).to(device)
+            feats.append(model(batch))
+
+    mean_feat = torch.cat(feats).mean(dim=0)
+    return F.normalize(mean_feat, dim=0)
+
+
+def remap_arcface(arcface, model, dataset, prev_names, prev_weight, device, log_fn=print):
+    """
+    Copy ArcFace rows of known cards by name and initialize rows of
+    new cards from their embedding.
+    Returns the number of new classes.
+    """
+    prev_index = {name: i for i, name in enumerate(prev_names)}
+    new_count = 0
+
+    with torch.no_grad():
+        for label, name in enumerate(dataset.class_names):
+            if name in prev_index:
+                arcface.weight[label] = prev_weight[prev_index[name]]
+            else:
+                arcface.weight[label] = embed_class_images(model, dataset, label, device)
+                new_count += 1
+                log_fn(f"[INFO] new class initialized from embedding: {name}")
+
+    return new_count
+
+
+def split_holdout(dataset):
+    """
+    Hold out the last (augmented) image of every class for the
+    retrieval-accuracy check. Classes with a single image stay in training.
+    Returns (train_indices, val_indices).
+    """
+    by_label = {}
+    for idx, label in enumerate(dataset.labels):
+        by_label.setdefault(int(label), []).append(idx)
+
+    train_idx, val_idx = [], []
+    for indices in by_label.values():
+        if len(indices) > 1:
+            train_idx.extend(indices[:-1])
+            val_idx.append(indices[-1])
+        else:
+            train_idx.extend(indices)
+
+    return train_idx, val_idx
+
+
+def retrieval_accuracy(model, arcface, dataset, val_idx, device, batch_size=32):
+    """
+    Top-1 accuracy of held-out images against the ArcFace class centers.
+    """
+    if not val_idx:
+        return 0.0
+
+    model.eval()
+    W = F.normalize(arcface.weight, dim=1)
+    correct = 0
+
+    with torch.no_grad():
+        for i in range(0, len(val_idx), batch_size):
+            batch = [dataset[j] for j in val_idx[i:i + batch_size]]
+            imgs = torch.stack([b[0] for b in batch]).to(device)
+            labels = torch.tensor([b[1] for b in batch], device=device)
+
+            pred = (model(imgs) @ W.T).argmax(dim=1)
+            correct += int((pred == labels).sum())
+
+    return correct / len(val_idx)
+
+
+def read_fingerprint(deck_dir: Path) -> str:
+    hash_path = deck_dir / HASH_PATH_NAME
+    if hash_path.exists():
+        return hash_path.read_text().strip()
+    return ""
+
+
+def save_checkpoint(path: Path, state: dict):
+    # Write to a temporary file first so a crash never leaves a broken checkpoint
+    tmp = path.with_suffix(".tmp")
+    torch.save(state, tmp)
+    tmp.replace(path)
+
+
+def load_checkpoint(path: Path, class_names, fingerprint, device):
+    """
+    Returns the checkpoint dict when it belongs to the current dataset.
+    """
+    if not path.exists():
+        return None
+
+    try:
+        ckpt = torch.load(path, map_location=device, weights_only=True)
+    except Exception:
+        return None
+
+    if ckpt.get("class_names") != class_names:
+        return None
+    if ckpt.get("fingerprint") != fingerprint:
+        return None
+
+    return ckpt
+
+
+def train_metric(
+    csv_path: Path,
+    epochs=30,
+    batch_size=32,
+    log_fn=print,
+    incremental=True,
+    incremental_epochs=None,
+    patience=3,
+    min_delta=0.01,
+    target_acc=0.99,
+    checkpoint_every=1,
+    num_workers=None,
+    progress_fn=None,
+    should_stop=None,
+    work_dir: Path | None = None,
+):
+    """
+    epochs is an upper bound. Training stops early when the loss has not
+    improved by min_delta (relative) for `patience` epochs, or when the
+    held-out retrieval accuracy stays >= target_acc for `patience` epochs.
+    A checkpoint is written every `checkpoint_every` epochs and resumed
+    automatically on the next call with the same dataset.
+
+    progress_fn(epoch, epochs, loss, acc) is called after every epoch.
+    should_stop() is polled between batches; when it returns True the
+    training is cancelled (resumable from the last checkpoint).
+
+    work_dir overrides the directory holding deck_metric.pkl and the
+    outputs (default: the CSV's folder).
+
+    Returns:
+        True  -> model saved
+        False -> cancelled
+    """
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-    pkl_path = csv_path.parent / "deck_metric.pkl"
+    deck_dir = work_dir or csv_path.parent
+    pkl_path = deck_dir / "deck_metric.pkl"
+    ckpt_path = deck_dir / CHECKPOINT_PATH_NAME
     dataset = MetricCardDataset(pkl_path, image_size=320)
+    train_idx, val_idx = split_holdout(dataset)
+    if num_workers is None:
+        num_workers = default_num_workers()
     loader = DataLoader(
-        dataset,
+        Subset(dataset, train_idx),
         batch_size=batch_size,
         shuffle=True,
-        num_workers=2,
+        num_workers=num_workers,
+        persistent_workers=num_workers > 0,
         drop_last=True
     )
 
-    num_classes = len(dataset.cards)
+    num_classes = len(dataset.class_names)
+    class_names = list(dataset.class_names)
 
     model = ConvNeXtEmbed(embed_dim=256).to(device)
     arcface = ArcFace(
@@ -35,6 +230,34 @@ def train_metric(csv_path: Path, epochs=30, batch_size=32, log_fn=print):
         m=0.4
     ).to(device)
 
+    fingerprint = read_fingerprint(deck_dir)
+    ckpt = load_checkpoint(ckpt_path, class_names, fingerprint, device)
+
+    # ---------- Incremental mode ----------
+    prev = None
+    if incremental and ckpt is None:
+        prev = load_previous_metric(deck_dir, device)
+    if prev is not None:
+        model_state, prev_names, prev_weight = prev
+        new_names = set(class_names) - set(prev_names)
+
+        if len(new_names) > num_classes * INCREMENTAL_MAX_NEW_RATIO:
+            log_fn(
+                f"[INFO] {len(new_names)}/{num_classes} classes changed "
+                f"→ full retrain"
+            )
+        else:
+            model.load_state_dict(model_state)
+            remap_arcface(
+                arcface, model, dataset,
+                prev_names, prev_weight, device, log_fn=log_fn
+            )
+            epochs = incremental_epochs or max(2, epochs // 5)
+            log_fn(
+                f"[INFO] incremental update: {len(new_names)} new classes, "
+                f"fine-tune {epochs} epochs"
+            )
+
     for name, p in model.backbone.named_parameters():
         if "stages.3" in name:  # final stage
             p.requires_grad = True
@@ -47,15 +270,38 @@ def train_metric(csv_path: Path, epochs=30, batch_size=32, log_fn=print):
 
     criterion = nn.CrossEntropyLoss()
 
-    log_fn(f"[INFO] classes={num_classes}, samples={len(dataset)}")
+    # ---------- Resume ----------
+    start_epoch = 1
+    best_loss = float("inf")
+    bad_epochs = 0
+    good_epochs = 0
+    if ckpt is not None:
+        model.load_state_dict(ckpt["model"])
+        arcface.load_state_dict(ckpt["arcface"])
+        optimizer.load_state_dict(ckpt["optimizer"])
+        start_epoch = ckpt["epoch"] + 1
+        epochs = ckpt["epochs"]
+        best_loss = ckpt["best_loss"]
+        bad_epochs = ckpt["bad_epochs"]
+        good_epochs = ckpt["good_epochs"]
+        log_fn(f"[INFO] resume from checkpoint (epoch {ckpt['epoch']})")
+
+    log_fn(
+        f"[INFO] classes={num_classes}, samples={len(dataset)}, "
+        f"held-out={len(val_idx)}"
+    )
     start_time = time.time()
     now = datetime.now().strftime("%H:%M:%S")
-    log_fn(f"[INFO] [{now}] Start Metric training for Total {epochs} epochs")
-    for epoch in range(1, epochs + 1):
+    log_fn(f"[INFO] [{now}] Start Metric training for up to {epochs} epochs")
+    for epoch in range(start_epoch, epochs + 1):
         model.train()
         total_loss = 0.0
 
         for imgs, labels in loader:
+            if should_stop is not None and should_stop():
+                log_fn(f"[INFO] training cancelled at epoch {epoch}")
+                return False
+
             imgs = imgs.to(device)
             labels = labels.to(device)
 
@@ -69,17 +315,67 @@ def train_metric(csv_path: Path, epochs=30, batch_size=32, log_fn=print):
 
             total_loss += loss.item()
 
-        avg_loss = total_loss / len(loader)
+        avg_loss = total_loss / max(1, len(loader))
+        val_acc = retrieval_accuracy(model, arcface, dataset, val_idx, device)
         now = datetime.now().strftime("%H:%M:%S")
         elapsed = time.time() - start_time
         log_fn(
             f"[INFO] [{now}] "
             f"[Epoch {epoch:03d}] "
             f"loss={avg_loss:.4f} "
+            f"acc={val_acc:.3f} "
             f"total elapsed time={elapsed:.1f}s"
         )
+        if progress_fn is not None:
+            progress_fn(epoch, epochs, avg_loss, val_acc)
+
+        # ---- Convergence check ----
+        if avg_loss < best_loss * (1.0 - min_delta):
+            best_loss = avg_loss
+            bad_epochs = 0
+        else:
+            bad_epochs += 1
+
+        good_epochs = good_epochs + 1 if val_acc >= target_acc else 0
+
+        converged = bad_epochs >= patience or good_epochs >= patience
+
+        if checkpoint_every and epoch % checkpoint_every == 0 and not converged:
+            save_checkpoint(ckpt_path, {
+                "epoch": epoch,
+                "epochs": epochs,
+                "class_names": class_names,
+                "fingerprint": fingerprint,
+                "model": model.state_dict(),
+                "arcface": arcface.state_dict(),
+                "optimizer": optimizer.state_dict(),
+                "best_loss": best_loss,
+                "bad_epochs": bad_epochs,
+                "good_epochs": good_epochs,
+            })
+
+        if converged:
+            log_fn(f"[INFO] converged at epoch {epoch} → early stop")
+            break
 
     # save embedding model
-    out = csv_path.parent / "metric_model.pth"
+    out = deck_dir / MODEL_PATH_NAME
     torch.save(model.state_dict(), out)
     log_fn(f"[OK] model saved: {out}")
+
+    # save ArcFace head with class names (used by incremental updates)
+    arcface_out = deck_dir / ARCFACE_PATH_NAME
+    torch.save(
+        {
+            "class_names": class_names,
+            "state_dict": arcface.state_dict(),
+        },
+        arcface_out
+    )
+    log_fn(f"[OK] arcface saved: {arcface_out}")
+
+    # training finished → the checkpoint is no longer needed
+    if ckpt_path.exists():
+        ckpt_path.unlink()
+
+    return True